@@ -1,14 +1,14 @@
-from fastapi import APIRouter, Body, UploadFile, File
+from fastapi import APIRouter, Body, Query, UploadFile, File, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
-from typing import Any, Dict, List
-from app.services.layer_1.analysis import AnalysisService
+from typing import Any, Dict, List, Optional
+from app.routes.dependencies import service
 from app.services.layer_1.transformer import DataTransformer
+import asyncio
 import csv
 import io
 
 main_router = APIRouter()
-service = AnalysisService()
 transformer = DataTransformer()
 
 class AnalyzeRequest(BaseModel):
@@ -39,6 +39,42 @@ class AnalyzeResponse(BaseModel):
 class MultiAnalyzeResponse(BaseModel):
     results: List[Dict[str, Any]]
 
+class SensitivityRequest(BaseModel):
+    data: Dict[str, Any] = Field(
+        ...,
+        example={
+            "free_cash_flow": [100, 110, 121, 133.1, 146.41],
+            "terminal_growth_rate": 0.02,
+            "discount_rate": 0.1,
+            "shares_outstanding": 10,
+            "net_debt": 50
+        },
+    )
+    wacc_range: Optional[Any] = Field(
+        None, example={"start": 0.07, "stop": 0.12, "step": 0.005}
+    )
+    growth_range: Optional[Any] = Field(
+        None, example={"start": 0.0, "stop": 0.04, "step": 0.005}
+    )
+    market_price: Optional[float] = Field(None, example=140.0)
+
+class PredictionRecord(BaseModel):
+    model: str = Field(..., example="RandomForest")
+    instrument: str = Field(..., example="VNM")
+    period: str = Field(..., example="2024-Q4")
+    predicted: float = Field(..., example=72.5)
+
+class ActualRecord(BaseModel):
+    instrument: str = Field(..., example="VNM")
+    period: str = Field(..., example="2024-Q4")
+    actual: float = Field(..., example=70.1)
+
+class PredictionRecordsRequest(BaseModel):
+    records: List[PredictionRecord]
+
+class ActualRecordsRequest(BaseModel):
+    records: List[ActualRecord]
+
 @main_router.get("/", summary="Health check")
 async def index():
     """Health check endpoint."""
@@ -84,6 +120,8 @@ async def index():
 )
 async def analyze(request: AnalyzeRequest = Body(...)):
     result = await service.handle_request(request.model_dump())
+    if "error" in result:
+        return JSONResponse(result, status_code=400)
     return {"result": result}
 
 @main_router.post(
@@ -106,6 +144,15 @@ async def analyze_csv(
     This does NOT train the model, it only runs predictions/analysis.
     """
     content = await file.read()
+    # Tasks with a vectorized engine run over the whole table at once
+    if service.supports_table_batch(task):
+        results = await service.handle_table_batch(
+            task, model_type, content, file.filename or ""
+        )
+        if isinstance(results, dict):
+            return JSONResponse(results, status_code=400)
+        return {"results": results}
+
     decoded = content.decode("utf-8")
     # Use transformer to parse CSV to JSON
     if task.lower() == "consistency":
@@ -121,4 +168,131 @@ async def analyze_csv(
         req = {"task": task, "model_type": model_type, "data": data}
         result = await service.handle_request(req)
         results.append(result)
-    return {"results": results}
\ No newline at end of file
+    return {"results": results}
+
+@main_router.post(
+    "/screen",
+    summary="Screen financial statements (Altman Z / Piotroski F)",
+    description="""
+    Upload a CSV or Parquet table of financial statements (one company per row, columns
+    named like the `financial_statements` fields of Risk Mitigation, e.g. total_assets,
+    ebit, net_income, prev_roa, ...). Every Altman Z component, the nine Piotroski F
+    criteria and the risk rating are computed column-wise and returned as a ranked table.
+    - sort_by: risk (default), z_score or f_score
+    """,
+)
+async def screen(
+    sort_by: str = Body("risk", embed=True, example="risk"),
+    top_n: Optional[int] = Body(None, embed=True, example=100),
+    file: UploadFile = File(...)
+):
+    content = await file.read()
+    result = service.screen_financials(content, file.filename or "", sort_by, top_n)
+    if "error" in result:
+        return JSONResponse(result, status_code=400)
+    return result
+
+@main_router.post(
+    "/dcf-sensitivity",
+    summary="DCF sensitivity grid (WACC x terminal growth)",
+    description="""
+    Compute the whole DCF valuation grid over WACC and terminal growth ranges in one
+    vectorized pass, sharing a single cash-flow projection (explicit cash flows, or the
+    AI-driven projection when historical_cash_flows + financial_statements are given).
+    Ranges are {"start", "stop", "step"} objects or explicit lists. When market_price is
+    given, the breakeven contour (WACC at which value per share equals the price, for
+    each terminal growth) is returned as well.
+    """,
+)
+async def dcf_sensitivity(request: SensitivityRequest = Body(...)):
+    result = service.handle_dcf_sensitivity(request.model_dump())
+    if "error" in result:
+        return JSONResponse(result, status_code=400)
+    return {"result": result}
+
+@main_router.post(
+    "/accuracy/predictions",
+    summary="Record model predictions",
+    description="""
+    Append predictions (model, instrument, period, predicted) to the accuracy store.
+    Each prediction is scored once its actual for the same instrument and period is
+    recorded; per-model metrics are updated incrementally and fill in
+    historical_accuracy for Model Consistency requests that do not supply it.
+    """,
+)
+async def record_predictions(request: PredictionRecordsRequest = Body(...)):
+    result = service.record_predictions([r.model_dump() for r in request.records])
+    if "error" in result:
+        return JSONResponse(result, status_code=400)
+    return result
+
+@main_router.post(
+    "/accuracy/actuals",
+    summary="Record realized actuals",
+    description="""
+    Append realized values (instrument, period, actual). Pending predictions for the
+    same instrument and period are scored and the per-model metrics updated.
+    """,
+)
+async def record_actuals(request: ActualRecordsRequest = Body(...)):
+    result = service.record_actuals([r.model_dump() for r in request.records])
+    if "error" in result:
+        return JSONResponse(result, status_code=400)
+    return result
+
+@main_router.get("/accuracy/metrics", summary="Per-model rolling accuracy metrics")
+async def accuracy_metrics(models: Optional[List[str]] = Query(None)):
+    return service.accuracy_metrics(models)
+
+@main_router.get(
+    "/sectors",
+    summary="Sector statistics index",
+    description="""
+    Per-sector PE, growth and debt-to-equity statistics (count, mean, p10..p90) built
+    from the CSV files in the data directory (files with a sector/industry column or
+    industry_* one-hot columns). PE and Abnormal Finding requests that name a `sector`
+    use these instead of requiring sector_data / sector_metrics. refresh=true re-reads
+    changed files immediately.
+    """,
+)
+async def sector_statistics(refresh: bool = False):
+    return service.sector_statistics(refresh)
+
+@main_router.websocket("/ws/abnormal")
+async def abnormal_stream(
+    websocket: WebSocket, window: int = Query(100, ge=2, le=10000)
+):
+    """
+    Streaming anomaly detection. Send ticks as JSON, one object or a list:
+    {"ticker": "AAA", "price": 101.2, "volume": 15000,
+     "financial_ratios": {...}, "sector_metrics": {...}}  (ratios/metrics optional, sticky)
+    Each tick gets a result with the same fields as Abnormal Finding, computed from
+    O(window) per-ticker state instead of the full history (2 <= window <= 10000).
+    A message that is not valid JSON gets an error reply; the connection stays open.
+    """
+    await websocket.accept()
+    try:
+        detector = service.create_anomaly_stream(window)
+    except ValueError as e:
+        await websocket.send_json({"error": str(e)})
+        await websocket.close()
+        return
+
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except (ValueError, KeyError, TypeError):
+                await websocket.send_json(
+                    {"error": "Invalid message: send a JSON tick object or a list of ticks"}
+                )
+                continue
+            ticks = message if isinstance(message, list) else [message]
+            results = await asyncio.gather(
+                *(service.handle_stream_tick(detector, tick) for tick in ticks)
+            )
+            await websocket.send_json(
+                results if isinstance(message, list) else results[0]
+            )
+    except WebSocketDisconnect:
+        pass
@@ -0,0 +1,12 @@
+import os
+
+from app.services.layer_1.analysis import AnalysisService
+from app.services.layer_3.training import ModelTrainer
+
+# Shared by the API and training routers: models trained through the training
+# endpoints are reloaded into the same AnalysisService that serves requests.
+# ANOMALY_MODEL / PE_MODEL pin saved models by name; default is the latest one
+service = AnalysisService(
+    anomaly_model=os.getenv("ANOMALY_MODEL"), pe_model=os.getenv("PE_MODEL")
+)
+trainer = ModelTrainer(data_dir="data", models_dir="models")
@@ -1,16 +1,29 @@
-from fastapi import APIRouter, Body, UploadFile, File, Query, HTTPException
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Body,
+    UploadFile,
+    File,
+    Query,
+    HTTPException,
+)
 from fastapi.responses import JSONResponse, FileResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
-from app.services.layer_3.training import ModelTrainer
+from app.routes.dependencies import service, trainer
 import os
 import shutil
 from datetime import datetime
 import io
 import base64
+import threading
+import uuid
 
 training_router = APIRouter()
-trainer = ModelTrainer(data_dir="data", models_dir="models")
+
+# Background anomaly scoring jobs: job_id -> status dict
+scoring_jobs: Dict[str, Dict[str, Any]] = {}
+scoring_jobs_lock = threading.Lock()
 
 
 # Request and response models
@@ -31,6 +44,31 @@ class AnomalyDetectionRequest(BaseModel):
     contamination: float = Field(0.1, example=0.1)
 
 
+class ForecasterTrainingRequest(BaseModel):
+    csv_filename: str = Field(..., example="dcf.csv")
+    sector: str = Field("default", example="technology")
+    horizon: int = Field(1, example=1)
+    window: int = Field(3, example=3)
+    forecast_model: str = Field("random_forest", example="random_forest")
+    id_column: str = Field("ticker", example="ticker")
+    order: int = Field(1, example=1)
+
+
+class ForecasterUpdateRequest(BaseModel):
+    model_name: str = Field(..., example="cf_default_h1_20251009_120000")
+    csv_filename: str = Field(..., example="dcf_new_quarter.csv")
+    new_periods: int = Field(1, example=1)
+    n_estimators: int = Field(10, example=10)
+
+
+class AnomalyScoringRequest(BaseModel):
+    model_name: str = Field(..., example="anomaly_20251009_120000")
+    csv_filename: str = Field(..., example="transactions.csv")
+    output_filename: Optional[str] = Field(None, example="transactions_scores.csv")
+    chunk_size: int = Field(100000, example=100000)
+    max_workers: Optional[int] = Field(None, example=4)
+
+
 class TrainingResponse(BaseModel):
     message: str = Field(..., example="RandomForest trained successfully.")
     model_name: str = Field(..., example="rf_target_20251009_120000")
@@ -97,6 +135,8 @@ async def train_model(request: TrainingRequest = Body(...)):
                 request.csv_filename, request.target_column
             )
             model_name = list(trainer.training_history.keys())[-1]
+            # A new PE pipeline (target_pe) is served by Neural PE Analysis at once
+            service.via.load_pe_model()
         else:
             return JSONResponse(
                 {"error": f"Unsupported model type: {request.model_type}"},
@@ -145,6 +185,7 @@ async def train_with_file(
         elif model_type.lower() in ["neuralnetwork", "nn", "mlp"]:
             model, metadata = trainer.train_neural_network(filename, target_column)
             model_name = list(trainer.training_history.keys())[-1]
+            service.via.load_pe_model()
         else:
             return JSONResponse(
                 {"error": f"Unsupported model type: {model_type}"}, status_code=400
@@ -173,17 +214,187 @@ async def train_anomaly_detection(request: AnomalyDetectionRequest = Body(...)):
             request.csv_filename, request.contamination
         )
         model_name = list(trainer.training_history.keys())[-1]
+        # Serve the new forest on the request path if its features match
+        served = service.via.load_anomaly_model() == model_name
 
         return {
             "message": "Anomaly detection model trained successfully.",
             "model_name": model_name,
             "metrics": metadata["metrics"],
             "num_outliers": len(outliers),
+            "served": served,
+        }
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+
+@training_router.post(
+    "/train-forecaster",
+    response_model=TrainingResponse,
+    summary="Train cash-flow forecaster",
+    description="""
+    Train a cash-flow forecaster offline and register it for AI-driven DCF.
+    - csv_filename: CSV trong thư mục data/ (mỗi dòng một công ty, cột fcf_1..fcf_T)
+    - sector: Ngành của mô hình (mặc định "default", dùng khi không có mô hình riêng)
+    - horizon: Số kỳ dự báo trực tiếp
+    - window: Số kỳ dòng tiền dùng làm đặc trưng
+    - forecast_model: "random_forest" hoặc "autoregressive" (AR panel theo từng công
+      ty, định danh bằng id_column, bậc order; cập nhật được qua /update-forecaster)
+    """,
+)
+async def train_forecaster(request: ForecasterTrainingRequest = Body(...)):
+    try:
+        if request.forecast_model.lower() in ["autoregressive", "ar"]:
+            forecaster, metadata = trainer.train_autoregressive_panel(
+                request.csv_filename, id_column=request.id_column, order=request.order
+            )
+        else:
+            forecaster, metadata = trainer.train_cash_flow_forecaster(
+                request.csv_filename,
+                sector=request.sector,
+                horizon=request.horizon,
+                window=request.window,
+            )
+        model_name = list(trainer.training_history.keys())[-1]
+
+        return {
+            "message": f"Cash-flow forecaster trained successfully on {request.csv_filename}.",
+            "model_name": model_name,
+            "metrics": metadata["metrics"],
+        }
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+
+@training_router.post(
+    "/update-forecaster",
+    response_model=TrainingResponse,
+    summary="Incrementally update a forecaster",
+    description="""
+    Fold new cash-flow periods into a saved forecaster without retraining from scratch.
+    - model_name: Cash-flow forecaster (cf_...) hoặc AR panel (ar_panel_...)
+    - csv_filename: CSV trong thư mục data/ chứa các kỳ mới
+    - new_periods: Số kỳ mới ở cuối mỗi chuỗi (cf_...)
+    - n_estimators: Số cây thêm vào rừng (cf_...)
+    """,
+)
+async def update_forecaster(request: ForecasterUpdateRequest = Body(...)):
+    try:
+        model, metadata = trainer.update_cash_flow_forecaster(
+            request.model_name,
+            request.csv_filename,
+            new_periods=request.new_periods,
+            n_estimators=request.n_estimators,
+        )
+        model_name = list(trainer.training_history.keys())[-1]
+
+        return {
+            "message": f"{request.model_name} updated with {request.csv_filename}.",
+            "model_name": model_name,
+            "metrics": metadata["metrics"],
         }
+    except FileNotFoundError:
+        return JSONResponse(
+            {"error": f"Model {request.model_name} not found"}, status_code=404
+        )
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=400)
 
 
+def _update_scoring_job(job_id, **fields):
+    with scoring_jobs_lock:
+        scoring_jobs[job_id].update(fields)
+
+
+def _run_scoring_job(job_id, request: AnomalyScoringRequest):
+    try:
+        result = trainer.score_anomaly_file(
+            request.model_name,
+            request.csv_filename,
+            output_filename=request.output_filename,
+            chunk_size=request.chunk_size,
+            max_workers=request.max_workers,
+            progress_callback=lambda status: _update_scoring_job(job_id, **status),
+        )
+        _update_scoring_job(job_id, status="completed", progress=1.0, result=result)
+    except Exception as e:
+        _update_scoring_job(job_id, status="failed", error=str(e))
+
+
+@training_router.post(
+    "/score-anomalies",
+    summary="Score a large file against a saved anomaly model",
+    description="""
+    Start a background job that streams a CSV/Parquet file from the data directory in
+    chunks through a saved Isolation Forest (across a worker pool) and writes anomaly
+    scores/labels to an output file. Poll GET /score-anomalies/{job_id} for progress.
+    """,
+)
+async def score_anomalies(
+    background_tasks: BackgroundTasks, request: AnomalyScoringRequest = Body(...)
+):
+    if request.chunk_size <= 0:
+        return JSONResponse({"error": "chunk_size must be positive"}, status_code=400)
+    if request.model_name not in trainer.list_available_models():
+        return JSONResponse(
+            {"error": f"Model {request.model_name} not found"}, status_code=404
+        )
+    if not os.path.exists(os.path.join(trainer.data_dir, request.csv_filename)):
+        return JSONResponse(
+            {"error": f"File {request.csv_filename} not found"}, status_code=404
+        )
+    try:
+        output_filename = trainer.scoring_output_filename(
+            request.csv_filename, request.output_filename
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except FileExistsError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    request = request.model_copy(update={"output_filename": output_filename})
+
+    job_id = uuid.uuid4().hex
+    with scoring_jobs_lock:
+        scoring_jobs[job_id] = {
+            "job_id": job_id,
+            "status": "running",
+            "model_name": request.model_name,
+            "filename": request.csv_filename,
+            "rows_scored": 0,
+            "progress": 0.0,
+        }
+    background_tasks.add_task(_run_scoring_job, job_id, request)
+    return {"job_id": job_id, "status": "running"}
+
+
+@training_router.get(
+    "/score-anomalies/{job_id}",
+    summary="Get anomaly scoring job progress",
+)
+async def get_scoring_job(job_id: str):
+    with scoring_jobs_lock:
+        job = scoring_jobs.get(job_id)
+        job = dict(job) if job else None
+    if job is None:
+        return JSONResponse({"error": f"Job {job_id} not found"}, status_code=404)
+    return job
+
+
+@training_router.get(
+    "/score-anomalies/{job_id}/download",
+    summary="Download anomaly scoring output",
+)
+async def download_scoring_output(job_id: str):
+    with scoring_jobs_lock:
+        job = dict(scoring_jobs.get(job_id) or {})
+    if job.get("status") != "completed":
+        return JSONResponse({"error": "Job is not completed"}, status_code=404)
+    output_filename = job["result"]["output_filename"]
+    return FileResponse(
+        os.path.join(trainer.data_dir, output_filename), filename=output_filename
+    )
+
+
 @training_router.post(
     "/hyperparameter-tuning",
     summary="Hyperparameter tuning",
@@ -58,10 +58,14 @@ async def analyze_ui():
                     <label>Task:</label>
                     <select name="task" onchange="updateSampleData()">
                         <option value="DCF">DCF Analysis</option>
+                        <option value="WACC">WACC</option>
                         <option value="PE Analysis">PE Analysis</option>
+                        <option value="Neural PE Analysis">Neural PE Analysis</option>
+                        <option value="Comparables">Comparables</option>
                         <option value="Abnormal Finding">Abnormal Finding</option>
                         <option value="Model Consistency">Model Consistency</option>
                         <option value="Risk Mitigation">Risk Mitigation</option>
+                        <option value="Portfolio Risk">Portfolio Risk</option>
                     </select>
                     
                     <label>Model Type:</label>
@@ -105,7 +109,10 @@ async def analyze_ui():
                     <label>Task:</label>
                     <select name="task">
                         <option value="DCF">DCF Analysis</option>
+                        <option value="WACC">WACC</option>
                         <option value="PE Analysis">PE Analysis</option>
+                        <option value="Neural PE Analysis">Neural PE Analysis</option>
+                        <option value="Comparables">Comparables</option>
                         <option value="Abnormal Finding">Abnormal Finding</option>
                         <option value="Model Consistency">Model Consistency</option>
                         <option value="Risk Mitigation">Risk Mitigation</option>
@@ -345,7 +352,7 @@ async def analyze_ui():
                 const task = document.getElementById('analyzeForm').task.value;
                 if (task === 'DCF') {
                     loadSample('dcf');
-                } else if (task === 'PE Analysis') {
+                } else if (task === 'PE Analysis' || task === 'Neural PE Analysis') {
                     loadSample('pe');
                 } else if (task === 'Abnormal Finding') {
                     loadSample('abnormal');
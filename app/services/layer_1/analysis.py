@@ -1,20 +1,39 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
+import asyncio
+import numpy as np
 import pandas as pd
 import os
 from app.services.layer_1.transformer import DataTransformer
 from app.services.layer_2.via import VIA
+from app.services.layer_2.anomaly import StreamingAnomalyDetector
+from app.services.layer_2.screening import FinancialScreener
 from app.services.layer_2.vua import VUA
+from app.services.layer_3.accuracy import AccuracyStore
 from app.services.layer_3.ml import MLModels
 from app.services.layer_3.training import ModelTrainer
+from app.services.layer_3.registry import ModelRegistry
+from app.services.layer_3.sectors import SectorIndex
 
 
 class AnalysisService:
-    def __init__(self):
+    def __init__(
+        self, anomaly_model: Optional[str] = None, pe_model: Optional[str] = None
+    ):
         self.transformer = DataTransformer()
-        self.via = VIA()
+        self.trainer = ModelTrainer(data_dir="data", models_dir="models")
+        self.registry = ModelRegistry(models_dir="models")
+        self.sector_index = SectorIndex(data_dir="data")
+        self.via = VIA(
+            model_registry=self.registry,
+            anomaly_model=anomaly_model,
+            pe_model=pe_model,
+            sector_index=self.sector_index,
+        )
         self.vua = VUA()
+        self.screener = FinancialScreener()
         self.ml = MLModels()
-        self.trainer = ModelTrainer(data_dir="data", models_dir="models")
+        # Recorded predictions/actuals; source of historical_accuracy
+        self.accuracy_store = AccuracyStore(os.path.join("data", "accuracy.db"))
 
     async def handle_request(self, request_json: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -28,10 +47,14 @@ class AnalysisService:
         # Task-specific processing using enhanced VIA methods
         if task == "Abnormal Finding":
             # Use the AI-driven abnormal finding method if sufficient data is available
-            if self._has_sufficient_data(
-                data, ["historical_prices", "trading_volumes"]
+            # (requires a trained anomaly model loaded at startup)
+            if (
+                self._has_sufficient_data(
+                    data, ["historical_prices", "trading_volumes"]
+                )
+                and self.via.anomaly_scorer is not None
             ):
-                result = self.via.run_ai_driven_abnormal_finding(data)
+                result = await self.via.run_ai_driven_abnormal_finding_async(data)
             else:
                 # Fall back to simpler method if data is insufficient
                 score = self.via.run_abnormal(data)
@@ -41,8 +64,12 @@ class AnalysisService:
                 }
 
         elif task == "Model Consistency":
+            self._fill_historical_accuracy(data)
+            # Many instruments at once: (instruments x models x horizons) tensor
+            if self._has_sufficient_data(data, ["prediction_tensor"]):
+                result = self.via.run_model_consistency_batch(data)
             # Use AI-driven consistency analysis if model predictions are available
-            if self._has_sufficient_data(data, ["model_predictions"]):
+            elif self._has_sufficient_data(data, ["model_predictions"]):
                 result = self.via.run_ai_driven_model_consistency(data)
             else:
                 # Fall back to simple consistency check
@@ -59,9 +86,14 @@ class AnalysisService:
             ):
                 result = self.via.run_ai_driven_dcf(data)
             else:
-                # Fall back to traditional DCF
-                result = self.via.run_dcf(data)
-                result = {**result, "interpretation": self.vua.interpret_dcf(result)}
+                # Fall back to traditional DCF (single-row run of the batch kernel)
+                result = self._dcf_with_interpretation(
+                    self.via.run_dcf_batch(pd.DataFrame([data]))[0]
+                )
+
+        elif task == "WACC":
+            # Vectorized WACC kernel, optional capital-structure scenario sweep
+            result = self.via.run_wacc(data)
 
         elif task == "PE Analysis":
             # Use neural PE analysis if growth and financial health data are available
@@ -71,15 +103,39 @@ class AnalysisService:
                 # Fall back to standard PE analysis
                 result = self.via.run_pe_analysis(data)
 
+        elif task == "Neural PE Analysis":
+            # Trained PE model (rule-based fair PE until one is trained)
+            result = self.via.run_neural_pe_analysis(data)
+
+        elif task == "Comparables":
+            # Peer PE (median/mean/trimmed) and implied value per share
+            if self._has_sufficient_data(data, ["comparable_companies"]):
+                result = self.via.run_comparables(data)
+            else:
+                return {"error": "Insufficient data for Comparables analysis"}
+
         elif task == "Risk Mitigation":
             # Use AI-driven risk analysis with Z-score and Monte Carlo if data available
             if self._has_sufficient_data(
                 data, ["financial_statements", "stock_price_history"]
             ):
-                result = self.via.run_risk_mitigation(data)
+                # Simulations can run for seconds: keep them off the event loop
+                result = await asyncio.get_running_loop().run_in_executor(
+                    None, self.via.run_risk_mitigation, data
+                )
             else:
                 return {"error": "Insufficient data for Risk Mitigation analysis"}
 
+        elif task == "Portfolio Risk":
+            # Correlated multi-asset Monte Carlo for portfolio-level VaR/CVaR
+            if self._has_sufficient_data(data, ["positions"]):
+                # Same as Risk Mitigation: keep the simulation off the event loop
+                result = await asyncio.get_running_loop().run_in_executor(
+                    None, self.via.run_portfolio_risk, data
+                )
+            else:
+                return {"error": "Insufficient data for Portfolio Risk analysis"}
+
         else:
             return {"error": f"Unknown task: {task}"}
 
@@ -100,39 +156,248 @@ class AnalysisService:
         """
         return all(field in data and data[field] for field in required_fields)
 
+    def _fill_historical_accuracy(self, data: Dict[str, Any]) -> None:
+        """
+        Complete historical_accuracy from the accuracy store; values supplied by
+        the caller take precedence
+        """
+        supplied = data.get("historical_accuracy") or {}
+        if not isinstance(supplied, dict):
+            return
+        models = data.get("models") or list(data.get("model_predictions") or {})
+        missing = [model for model in models if model not in supplied]
+        if missing:
+            stored = self.accuracy_store.historical_accuracy(missing)
+            if stored:
+                data["historical_accuracy"] = {**stored, **supplied}
+
+    def record_predictions(self, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Append model predictions to the accuracy store
+        """
+        try:
+            scored = self.accuracy_store.record_predictions(records)
+        except (KeyError, TypeError, ValueError) as e:
+            return {"error": f"Invalid prediction record: {str(e)}"}
+        return {"recorded": len(records), "scored": scored}
+
+    def record_actuals(self, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Append realized actuals and score the predictions they resolve
+        """
+        try:
+            scored = self.accuracy_store.record_actuals(records)
+        except (KeyError, TypeError, ValueError) as e:
+            return {"error": f"Invalid actual record: {str(e)}"}
+        return {"recorded": len(records), "scored": scored}
+
+    def accuracy_metrics(self, models: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Rolling per-model error metrics from the accuracy store
+        """
+        return {"metrics": self.accuracy_store.metrics(models)}
+
+    def sector_statistics(self, refresh: bool = False) -> Dict[str, Any]:
+        """
+        Per-sector PE, growth and leverage statistics from the data directory
+        """
+        if refresh:
+            self.sector_index.refresh(force=True)
+        return {"sectors": self.sector_index.sectors()}
+
     def _should_apply_ai_prediction(self, task: str) -> bool:
         """
         Determine if AI prediction should be applied to this task
         """
         # Tasks that benefit from additional AI prediction
-        ai_prediction_tasks = ["DCF", "PE Analysis"]
-        return task in ai_prediction_tasks
+        ai_prediction_tasks = ["dcf", "pe analysis", "neural pe analysis"]
+        return task.lower() in ai_prediction_tasks
+
+    def handle_dcf_sensitivity(self, request_json: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build a WACC x terminal growth DCF sensitivity grid from one shared
+        cash-flow projection
+        """
+        data = self.transformer.transform_xxx(request_json)
+        for key in ("wacc_range", "growth_range", "market_price"):
+            if request_json.get(key) is not None:
+                data[key] = request_json[key]
+        return self.via.run_dcf_sensitivity(data)
+
+    def create_anomaly_stream(self, window: int = 100) -> StreamingAnomalyDetector:
+        """
+        Per-connection sliding-window state for streaming anomaly detection
+        """
+        return StreamingAnomalyDetector(window=window)
+
+    async def handle_stream_tick(
+        self, detector: StreamingAnomalyDetector, tick: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Score one streamed tick against its ticker's sliding-window state
+        """
+        if not isinstance(tick, dict):
+            return {"error": "Tick must be a JSON object"}
+        return await self.via.run_streaming_abnormal_tick(detector, tick)
+
+    def supports_table_batch(self, task: str) -> bool:
+        """
+        Check if a task has a vectorized whole-table implementation
+        """
+        return task.lower() in self._table_batch_handlers()
+
+    def _table_batch_handlers(self):
+        return {
+            "dcf": self._dcf_table_batch,
+            "wacc": self.via.run_wacc_batch,
+            "abnormal finding": self._abnormal_table_batch,
+            "consistency": self._consistency_table_batch,
+            "model consistency": self._model_consistency_table_batch,
+            "neural pe analysis": self.via.run_neural_pe_batch,
+            "comparables": self._comparables_table_batch,
+        }
+
+    async def handle_table_batch(
+        self, task: str, model_type: str, table: Any, filename: str = ""
+    ) -> Union[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Run a batchable task over a whole table (CSV/Parquet bytes, path or DataFrame)
+        in one vectorized pass instead of row by row through handle_request.
+        A table the task cannot use (missing or non-numeric columns) gives an error dict
+        """
+        try:
+            df = self.transformer.table_to_frame(table, filename)
+            results = self._table_batch_handlers()[task.lower()](df)
+        except (ValueError, KeyError, TypeError) as e:
+            return {"error": f"Invalid table for {task}: {str(e)}"}
+
+        # Augment with AI prediction, same as handle_request does per row
+        if self._should_apply_ai_prediction(task):
+            rows = self._frame_to_records(df)
+            results = [
+                self.vua.merge_output(
+                    result, self.vua.select_and_predict(model_type, row, self.ml)
+                )
+                for result, row in zip(results, rows)
+            ]
+        return results
+
+    def _dcf_table_batch(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
+        return [
+            self._dcf_with_interpretation(result)
+            for result in self.via.run_dcf_batch(df)
+        ]
+
+    def _abnormal_table_batch(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
+        # Long format (ticker, price, volume per row): one AI result per ticker,
+        # features for all tickers extracted together and scored in one call
+        if {"ticker", "price"} <= set(df.columns) and self.via.anomaly_scorer:
+            return self.via.run_abnormal_table(df)
+        # Flat rows: row-wise statistics over the numeric matrix of the whole table
+        return [
+            {
+                "abnormal_score": score,
+                "interpretation": self.vua.interpret_abnormal(score),
+            }
+            for score in self.via.run_abnormal_batch(df).tolist()
+        ]
+
+    def _consistency_table_batch(
+        self, df: pd.DataFrame, exclude_comparables: bool = True
+    ) -> List[Dict[str, Any]]:
+        return [
+            {
+                "consistency_index": index,
+                "interpretation": self.vua.interpret_consistency(index),
+            }
+            for index in self.via.run_consistency_batch(
+                df, exclude_comparables
+            ).tolist()
+        ]
+
+    def _model_consistency_table_batch(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
+        # The per-row Model Consistency CSV path keeps comparable_* as plain columns
+        return self._consistency_table_batch(df, exclude_comparables=False)
+
+    def _comparables_table_batch(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
+        # Wide comparable_name_i / comparable_pe_i columns -> one long peer table
+        return self.via.run_comparables_batch(
+            df, self.transformer.comparables_to_long(df)
+        )
+
+    def _dcf_with_interpretation(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        value = result.get("enterprise_value")
+        return {
+            **result,
+            "interpretation": self.vua.interpret_dcf(value if value is not None else 0),
+        }
 
     async def handle_batch_request(self, csv_file_path: str) -> List[Dict[str, Any]]:
         """
-        Process multiple analysis requests from a CSV file
+        Process multiple analysis requests from a CSV file.
+        Rows of batchable tasks (e.g. DCF) are grouped and run through the
+        vectorized engines; other rows go through handle_request one by one.
         """
-        results = []
         try:
             # Read CSV file
             df = pd.read_csv(csv_file_path)
+            if "task" in df.columns:
+                tasks = df["task"].fillna("DCF").astype(str)
+            else:
+                tasks = pd.Series("DCF", index=df.index)
 
-            # Process each row
-            for _, row in df.iterrows():
-                # Convert row to dict
-                row_dict = row.to_dict()
-
-                # Extract task from row or use default
-                task = row_dict.get("task", "DCF")
-
-                # Process request
-                result = await self.handle_request(row_dict)
-                results.append(result)
+            results: List[Optional[Dict[str, Any]]] = [None] * len(df)
+            for task, group in df.groupby(tasks, sort=False):
+                positions = [df.index.get_loc(i) for i in group.index]
+                if self.supports_table_batch(task):
+                    model_type = (
+                        group["model_type"].iloc[0]
+                        if "model_type" in group.columns
+                        else "RandomForest"
+                    )
+                    group_results = await self.handle_table_batch(
+                        task, model_type, group.reset_index(drop=True)
+                    )
+                    if isinstance(group_results, dict):
+                        # The whole group failed: report the error on each row
+                        group_results = [group_results] * len(group)
+                else:
+                    group_results = [
+                        await self.handle_request({**row, "task": task})
+                        for row in self._frame_to_records(group)
+                    ]
+                for position, result in zip(positions, group_results):
+                    results[position] = result
 
             return results
         except Exception as e:
             return [{"error": f"Error processing batch request: {str(e)}"}]
 
+    def screen_financials(
+        self,
+        table: Any,
+        filename: str = "",
+        sort_by: str = "risk",
+        top_n: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Screen a whole table of financial statements (CSV/Parquet/DataFrame) with
+        vectorized Altman Z / Piotroski F scoring and return the ranked table
+        """
+        try:
+            df = self.transformer.table_to_frame(table, filename)
+            ranked = self.screener.screen(df, sort_by=sort_by, top_n=top_n)
+            return {"count": len(df), "results": self._frame_to_records(ranked)}
+        except Exception as e:
+            return {"error": f"Error screening financial statements: {str(e)}"}
+
+    def _frame_to_records(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
+        """
+        Convert a result DataFrame to JSON-safe records (NaN/inf become None)
+        """
+        df = df.replace([np.inf, -np.inf], np.nan).astype(object)
+        return df.where(df.notna(), None).to_dict(orient="records")
+
     async def train_model(
         self, model_type: str, data_path: Optional[str] = None
     ) -> Dict[str, Any]:
@@ -145,13 +410,21 @@ class AnalysisService:
                     data_path or "default_dcf.csv", "target_value"
                 )
             elif model_type.lower() == "pe":
-                result = self.trainer.train_neural_network(
-                    data_path or "default_pe.csv", "target_value"
+                _, result = self.trainer.train_neural_network(
+                    data_path or "default_pe.csv", self.via.PE_TARGET_COLUMN
+                )
+                # Serve the newly trained PE pipeline on the request path
+                self.via.load_pe_model()
+            elif model_type.lower() == "forecaster":
+                _, result = self.trainer.train_cash_flow_forecaster(
+                    data_path or "default_dcf.csv"
                 )
             elif model_type.lower() == "anomaly":
                 result = self.trainer.train_anomaly_detection(
                     data_path or "default_anomaly.csv"
                 )
+                # Serve the newly trained forest on the request path
+                self.via.load_anomaly_model()
             else:
                 return {"error": f"Unsupported model type: {model_type}"}
 
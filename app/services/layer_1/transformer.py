@@ -1,5 +1,8 @@
 import re
 import csv
+import io
+import numpy as np
+import pandas as pd
 
 class DataTransformer:
     def transform_xxx(self, request_json):
@@ -64,6 +67,33 @@ class DataTransformer:
             f.close()
         return result
 
+    def comparables_to_long(self, df):
+        """
+        Chuyển các cột comparable_name_i / comparable_pe_i của bảng thành dạng dài
+        (row, slot, name, pe_ratio) bằng một lần reshape cho cả bảng, thay cho vòng
+        lặp từng dòng. Chỉ giữ các cặp có cả tên và PE, giống csv_to_json_consistency.
+        """
+        slots = sorted({
+            int(m.group(2))
+            for c in df.columns
+            if (m := re.match(r"^comparable_(name|pe)_(\d+)$", str(c)))
+        })
+        n = len(df)
+        names = df.reindex(columns=[f"comparable_name_{i}" for i in slots]).to_numpy(dtype=object)
+        pes = (
+            df.reindex(columns=[f"comparable_pe_{i}" for i in slots])
+            .apply(pd.to_numeric, errors="coerce")
+            .to_numpy(dtype=float)
+        )
+        long = pd.DataFrame({
+            "row": np.repeat(np.arange(n), len(slots)),
+            "slot": np.tile(np.asarray(slots, dtype=int), n),
+            "name": names.ravel(),
+            "pe_ratio": pes.ravel(),
+        })
+        named = long["name"].notna() & (long["name"].astype(str).str.strip() != "")
+        return long[named & long["pe_ratio"].notna()].reset_index(drop=True)
+
     def csv_to_json_wacc(self, csv_file):
         """
         Nhận vào file-like object (StringIO hoặc file path), trả về list dict JSON WACC.
@@ -110,4 +140,20 @@ class DataTransformer:
             result.append(item)
         if close_f:
             f.close()
-        return result
\ No newline at end of file
+        return result
+
+    def table_to_frame(self, content, filename=""):
+        """
+        Đọc bảng dữ liệu (CSV hoặc Parquet) thành DataFrame.
+        content có thể là bytes, file path hoặc DataFrame có sẵn.
+        """
+        if isinstance(content, pd.DataFrame):
+            return content
+        if isinstance(content, str):
+            filename = filename or content
+            source = content
+        else:
+            source = io.BytesIO(content)
+        if filename.lower().endswith((".parquet", ".pq")):
+            return pd.read_parquet(source)
+        return pd.read_csv(source)
@@ -0,0 +1,343 @@
+import asyncio
+from collections import deque
+
+import numpy as np
+
+from app.services.layer_2.simulation import RunningMoments
+
+
+class AnomalyScorer:
+    """
+    Chấm điểm bất thường bằng một IsolationForest đã fit, giữ thường trú trong bộ nhớ.
+
+    Các vector đặc trưng được ánh xạ theo tên cột đã dùng khi huấn luyện
+    (feature_columns trong metadata). Các request đồng thời được gom lại
+    (micro-batching) để chỉ gọi decision_function một lần cho cả lô.
+    """
+
+    def __init__(self, model, feature_columns, max_batch_size=256, max_wait=0.002):
+        self.model = model
+        self.feature_columns = list(feature_columns)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = []
+        self._flush_handle = None
+
+    def missing_features(self, available):
+        """Các đặc trưng mô hình cần nhưng không có trong available."""
+        return [column for column in self.feature_columns if column not in available]
+
+    def _check_features(self, available):
+        missing = self.missing_features(available)
+        if missing:
+            raise ValueError(f"Missing feature columns: {missing}")
+
+    def vectorize(self, features_list):
+        """
+        Ma trận N x F theo thứ tự feature_columns. Thiếu đặc trưng nào của mô hình
+        thì báo lỗi, không điền 0.
+        """
+        for features in features_list:
+            self._check_features(features)
+        return np.array(
+            [
+                [float(features[column]) for column in self.feature_columns]
+                for features in features_list
+            ],
+            dtype=float,
+        ).reshape(len(features_list), len(self.feature_columns))
+
+    def vectorize_columns(self, feature_arrays):
+        """
+        Ma trận N x F từ các vector đặc trưng theo tên. Thiếu đặc trưng nào của mô
+        hình thì báo lỗi, không điền 0.
+        """
+        self._check_features(feature_arrays)
+        n = len(next(iter(feature_arrays.values())))
+        return np.column_stack(
+            [
+                np.asarray(feature_arrays[column], dtype=float)
+                for column in self.feature_columns
+            ]
+        ).reshape(n, len(self.feature_columns))
+
+    def score_matrix(self, X):
+        """
+        Điểm bất thường (-decision_function, càng cao càng bất thường) và nhãn
+        (-1 bất thường, 1 bình thường) cho cả ma trận trong một lần gọi mô hình.
+        Nhãn giống IsolationForest.predict nhưng không phải tính lại cây.
+        """
+        decision = self.model.decision_function(X)
+        return -decision, np.where(decision < 0, -1, 1)
+
+    def score(self, features_list):
+        return self.score_matrix(self.vectorize(features_list))
+
+    async def score_async(self, features):
+        """
+        Chấm điểm một vector đặc trưng; các lời gọi đồng thời trong khoảng max_wait
+        giây (hoặc đủ max_batch_size) được chấm chung một lần.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((features, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        try:
+            scores, labels = self.score([features for features, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), score, label in zip(batch, scores, labels):
+            if not future.done():
+                future.set_result((float(score), int(label)))
+
+
+class AbnormalFeatureExtractor:
+    """
+    Trích xuất đặc trưng bất thường cho nhiều mã cùng lúc từ chuỗi giá/khối lượng có
+    độ dài khác nhau, biểu diễn dạng bộ đệm phẳng + offsets (chuỗi i nằm ở
+    values[offsets[i]:offsets[i + 1]]). Mọi phép tính theo đoạn dùng tổng tích lũy,
+    không lặp theo từng mã.
+    """
+
+    MOMENTUM_WINDOW = 5
+
+    @staticmethod
+    def ragged(series_list):
+        """(values, offsets) từ danh sách chuỗi có độ dài khác nhau."""
+        arrays = [np.asarray(s, dtype=float).ravel() for s in series_list]
+        lengths = np.array([len(a) for a in arrays], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        values = np.concatenate(arrays) if arrays else np.empty(0)
+        return values, offsets
+
+    @staticmethod
+    def ragged_from_padded(matrix):
+        """(values, offsets) từ ma trận N x T đệm NaN."""
+        matrix = np.atleast_2d(np.asarray(matrix, dtype=float))
+        observed = ~np.isnan(matrix)
+        offsets = np.concatenate([[0], np.cumsum(observed.sum(axis=1))])
+        return matrix[observed], offsets
+
+    @staticmethod
+    def _segment_sum(values, offsets):
+        cumulative = np.concatenate([[0.0], np.cumsum(values)])
+        return cumulative[offsets[1:]] - cumulative[offsets[:-1]]
+
+    def _segment_mean(self, values, offsets):
+        lengths = np.diff(offsets)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(
+                lengths > 0, self._segment_sum(values, offsets) / lengths, 0.0
+            )
+
+    def _segment_std(self, values, offsets):
+        """Độ lệch chuẩn tổng thể (ddof=0, như np.std) của từng đoạn, 0 nếu rỗng."""
+        lengths = np.diff(offsets)
+        mean = self._segment_mean(values, offsets)
+        deviations = (values - np.repeat(mean, lengths)) ** 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            variance = np.where(
+                lengths > 0, self._segment_sum(deviations, offsets) / lengths, 0.0
+            )
+        return np.sqrt(variance)
+
+    def extract(
+        self,
+        prices,
+        price_offsets,
+        volumes,
+        volume_offsets,
+        pe_ratio=0.0,
+        pb_ratio=0.0,
+        debt_to_equity=0.0,
+        sector_pe=15.0,
+    ):
+        """
+        Đặc trưng cho N mã (mỗi khóa là một vector N), cùng công thức với phân tích
+        bất thường từng mã: price_volatility, price_momentum, volume_change,
+        pe_difference, pe_ratio, pb_ratio, debt_to_equity và mean_price, num_prices.
+        """
+        prices = np.asarray(prices, dtype=float)
+        volumes = np.asarray(volumes, dtype=float)
+        price_offsets = np.asarray(price_offsets, dtype=np.int64)
+        volume_offsets = np.asarray(volume_offsets, dtype=np.int64)
+        n = len(price_offsets) - 1
+        price_lengths = np.diff(price_offsets)
+
+        # Biến động giá trong từng chuỗi: bỏ các hiệu số nối hai mã liền nhau
+        starts = np.zeros(len(prices), dtype=bool)
+        starts[price_offsets[:-1][price_lengths > 0]] = True
+        changes = np.diff(prices)[~starts[1:]]
+        change_lengths = np.maximum(price_lengths - 1, 0)
+        change_offsets = np.concatenate([[0], np.cumsum(change_lengths)])
+
+        price_volatility = self._segment_std(changes, change_offsets)
+
+        # Momentum: tổng 5 biến động cuối cùng (0 nếu chưa đủ 5)
+        window = self.MOMENTUM_WINDOW
+        cumulative = np.concatenate([[0.0], np.cumsum(changes)])
+        end = change_offsets[1:]
+        enough = change_lengths >= window
+        price_momentum = np.where(
+            enough,
+            cumulative[end] - cumulative[np.where(enough, end - window, end)],
+            0.0,
+        )
+
+        # Khối lượng: phiên cuối so với trung bình
+        volume_lengths = np.diff(volume_offsets)
+        avg_volume = self._segment_mean(volumes, volume_offsets)
+        last_index = np.clip(volume_offsets[1:] - 1, 0, None)
+        recent_volume = (
+            np.where(volume_lengths > 0, volumes[last_index], 0.0)
+            if len(volumes)
+            else np.zeros(n)
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            volume_change = np.where(
+                avg_volume > 0, recent_volume / avg_volume - 1, 0.0
+            )
+
+        pe_ratio, pb_ratio, debt_to_equity, sector_pe = (
+            np.broadcast_to(np.asarray(v, dtype=float), (n,))
+            for v in (pe_ratio, pb_ratio, debt_to_equity, sector_pe)
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pe_difference = np.where(
+                (sector_pe > 0) & (pe_ratio > 0), pe_ratio / sector_pe - 1, 0.0
+            )
+
+        return {
+            "price_volatility": price_volatility,
+            "price_momentum": price_momentum,
+            "volume_change": volume_change,
+            "pe_difference": pe_difference,
+            "pe_ratio": pe_ratio,
+            "pb_ratio": pb_ratio,
+            "debt_to_equity": debt_to_equity,
+            "mean_price": self._segment_mean(prices, price_offsets),
+            "num_prices": price_lengths,
+        }
+
+
+class TickerStreamState:
+    """
+    Trạng thái O(window) của một mã trong luồng tick: moment trượt (Welford thêm/bỏ)
+    của giá, biến động giá và khối lượng, cùng bộ đệm vòng cho momentum.
+    """
+
+    def __init__(self, window=100, momentum_window=5):
+        self.window = window
+        self.prices = deque()
+        self.changes = deque()
+        self.volumes = deque()
+        self.recent_changes = deque(maxlen=momentum_window)
+        self.price_moments = RunningMoments()
+        self.change_moments = RunningMoments()
+        self.volume_moments = RunningMoments()
+        self.momentum = 0.0
+        self.last_volume = None
+        self.ticks = 0
+        self.financial_ratios = {}
+        self.sector_metrics = {}
+
+    def _slide(self, buffer, moments, value, limit):
+        buffer.append(value)
+        moments.add(value)
+        if len(buffer) > limit:
+            moments.remove(buffer.popleft())
+
+    def push(self, price, volume=None):
+        """Thêm một tick, cập nhật mọi thống kê trong O(1)."""
+        price = float(price)
+        if self.prices:
+            change = price - self.prices[-1]
+            # Khi cửa sổ giá đầy, biến động cũ nhất cũng rời cửa sổ
+            self._slide(self.changes, self.change_moments, change, self.window - 1)
+            if len(self.recent_changes) == self.recent_changes.maxlen:
+                self.momentum -= self.recent_changes[0]
+            self.recent_changes.append(change)
+            self.momentum += change
+        self._slide(self.prices, self.price_moments, price, self.window)
+        if volume is not None:
+            self.last_volume = float(volume)
+            self._slide(
+                self.volumes, self.volume_moments, self.last_volume, self.window
+            )
+        self.ticks += 1
+
+    def features(self):
+        """Cùng bộ đặc trưng với phân tích bất thường, tính trên cửa sổ hiện tại."""
+        avg_volume = self.volume_moments.mean if self.volumes else 0.0
+        volume_change = (
+            self.last_volume / avg_volume - 1
+            if avg_volume > 0 and self.last_volume is not None
+            else 0.0
+        )
+        pe_ratio = self.financial_ratios.get("pe_ratio", 0)
+        sector_pe = self.sector_metrics.get("avg_pe", 15)
+        full_momentum = len(self.recent_changes) == self.recent_changes.maxlen
+        return {
+            "price_volatility": self.change_moments.std,
+            "price_momentum": self.momentum if full_momentum else 0.0,
+            "volume_change": volume_change,
+            "pe_difference": (
+                (pe_ratio / sector_pe - 1) if sector_pe > 0 and pe_ratio > 0 else 0.0
+            ),
+            "pe_ratio": pe_ratio,
+            "pb_ratio": self.financial_ratios.get("pb_ratio", 0),
+            "debt_to_equity": self.financial_ratios.get("debt_to_equity", 0),
+            "mean_price": self.price_moments.mean,
+            "num_prices": len(self.prices),
+        }
+
+
+class StreamingAnomalyDetector:
+    """
+    Giữ trạng thái cửa sổ trượt cho từng mã trong một luồng tick; mỗi tick chỉ cập
+    nhật trạng thái của mã đó, không tính lại trên toàn bộ lịch sử.
+    """
+
+    def __init__(self, window=100, min_ticks=10):
+        if window < min_ticks:
+            raise ValueError("window phải lớn hơn hoặc bằng min_ticks")
+        self.window = window
+        self.min_ticks = min_ticks
+        self.states = {}
+
+    def push(self, tick):
+        """
+        Thêm một tick {"ticker", "price", "volume"?, "financial_ratios"?,
+        "sector_metrics"?}. Trả về (state, features) hoặc (state, None) nếu mã chưa
+        đủ min_ticks giá trong cửa sổ.
+        """
+        ticker = tick["ticker"]
+        state = self.states.get(ticker)
+        if state is None:
+            state = self.states[ticker] = TickerStreamState(self.window)
+        if tick.get("financial_ratios"):
+            state.financial_ratios = tick["financial_ratios"]
+        if tick.get("sector_metrics"):
+            state.sector_metrics = tick["sector_metrics"]
+
+        state.push(tick["price"], tick.get("volume"))
+        if len(state.prices) < self.min_ticks:
+            return state, None
+        return state, state.features()
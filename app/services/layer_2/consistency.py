@@ -0,0 +1,133 @@
+import numpy as np
+
+
+class ModelConsistencyEngine:
+    """
+    Đánh giá độ đồng nhất của nhiều mô hình cho nhiều mã cùng lúc.
+
+    Dự đoán được đưa vào dưới dạng tensor (số mã × số mô hình × số kỳ dự báo), ô
+    thiếu là NaN. Mọi chỉ số của run_ai_driven_model_consistency được tính bằng
+    phép toán theo trục trên tensor, không lặp theo mã hay theo mô hình.
+    """
+
+    # Trọng số của độ đồng nhất nội bộ và độ chính xác lịch sử trong điểm mô hình
+    INTERNAL_WEIGHT = 0.6
+    HISTORICAL_WEIGHT = 0.4
+    DEFAULT_ACCURACY = 0.5
+
+    RECOMMENDATIONS = (
+        (0.8, "Mức độ đồng thuận cao giữa các mô hình. Độ tin cậy cao."),
+        (
+            0.6,
+            "Mức độ đồng thuận khá tốt. Nên ưu tiên mô hình có độ chính xác lịch sử cao nhất.",
+        ),
+        (
+            0.4,
+            "Mức độ đồng thuận trung bình. Xem xét kỹ các mô hình trước khi ra quyết định.",
+        ),
+    )
+    LOW_AGREEMENT = "Mức độ đồng thuận thấp giữa các mô hình. Cần thận trọng và thu thập thêm thông tin."
+
+    def _dispersion(self, values, axis):
+        """
+        1 - std / mean theo các trục đã cho, bỏ qua NaN (mean = 0 thì chia cho 1).
+        Trả về (chỉ số, số giá trị hợp lệ).
+        """
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=axis)
+        filled = np.where(valid, values, 0.0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = filled.sum(axis=axis) / count
+            deviation = np.where(valid, values - np.expand_dims(mean, axis), 0.0)
+            std = np.sqrt((deviation**2).sum(axis=axis) / count)
+        return 1.0 - std / np.where(mean != 0, mean, 1.0), count
+
+    def _model_vector(self, values, num_models, default):
+        if values is None:
+            return np.full(num_models, default, dtype=float)
+        return np.broadcast_to(np.asarray(values, dtype=float), (num_models,))
+
+    def evaluate(
+        self,
+        predictions,
+        weights=None,
+        historical_accuracy=None,
+        metric_values=None,
+    ):
+        """
+        predictions: mảng N×M×H (hoặc N×M nếu chỉ có một kỳ).
+        weights: vector M trọng số mô hình (mặc định bằng nhau).
+        historical_accuracy: vector M hoặc ma trận N×M (mặc định 0.5).
+        metric_values: dict tên chỉ tiêu -> ma trận N×M (vd. price_target), NaN khi
+        mô hình không dự báo chỉ tiêu đó.
+
+        Trả về dict các mảng: internal_consistency (N×M), model_scores (N×M),
+        best_model (N, chỉ số mô hình), overall_consistency (N),
+        weighted_horizons (N×H) và weighted_metrics (tên -> N).
+        """
+        predictions = np.asarray(predictions, dtype=float)
+        if predictions.ndim == 2:
+            predictions = predictions[:, :, np.newaxis]
+        if predictions.ndim != 3:
+            raise ValueError("predictions phải có dạng (mã × mô hình × kỳ dự báo)")
+        num_models = predictions.shape[1]
+
+        weights = self._model_vector(weights, num_models, 1.0)
+        total = weights.sum()
+        if total > 0:
+            weights = weights / total
+        if historical_accuracy is None:
+            accuracy = np.full(num_models, self.DEFAULT_ACCURACY)
+        else:
+            accuracy = np.nan_to_num(
+                np.asarray(historical_accuracy, dtype=float),
+                nan=self.DEFAULT_ACCURACY,
+            )
+
+        # Độ đồng nhất nội bộ mỗi mô hình theo các kỳ (1 nếu chỉ có <= 1 dự đoán)
+        internal, count = self._dispersion(predictions, axis=2)
+        internal = np.where(count > 1, internal, 1.0)
+        scores = (
+            self.INTERNAL_WEIGHT * internal
+            + self.HISTORICAL_WEIGHT * np.broadcast_to(accuracy, internal.shape)
+        )
+        # argmax lấy mô hình đầu tiên khi bằng điểm, giống max() trên dict
+        best_model = np.argmax(scores, axis=1)
+
+        # Độ đồng nhất giữa các mô hình: trên mọi dự đoán của một mã
+        overall, _ = self._dispersion(predictions, axis=(1, 2))
+
+        # Trung bình có trọng số theo mô hình (chỉ trên các ô có dự đoán)
+        def weighted_mean(values, axis):
+            valid = ~np.isnan(values)
+            shape = [1] * values.ndim
+            shape[axis] = num_models
+            w = np.where(valid, weights.reshape(shape), 0.0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return (np.where(valid, values, 0.0) * w).sum(axis=axis) / w.sum(
+                    axis=axis
+                )
+
+        weighted_metrics = {
+            name: weighted_mean(np.asarray(values, dtype=float), axis=1)
+            for name, values in (metric_values or {}).items()
+        }
+
+        return {
+            "internal_consistency": internal,
+            "model_scores": scores,
+            "best_model": best_model,
+            "overall_consistency": overall,
+            "weighted_horizons": weighted_mean(predictions, axis=1),
+            "weighted_metrics": weighted_metrics,
+            "weights": weights,
+        }
+
+    def recommend(self, overall_consistency):
+        """Khuyến nghị cho từng mã theo cùng ngưỡng với bản từng request."""
+        overall_consistency = np.asarray(overall_consistency, dtype=float)
+        return np.select(
+            [overall_consistency > threshold for threshold, _ in self.RECOMMENDATIONS],
+            [message for _, message in self.RECOMMENDATIONS],
+            default=self.LOW_AGREEMENT,
+        )
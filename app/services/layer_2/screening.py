@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+
+
+class FinancialScreener:
+    """
+    Sàng lọc Altman Z-score và Piotroski F-score cho cả bảng báo cáo tài chính.
+
+    Mỗi dòng là một công ty, các cột có cùng tên với các trường của
+    financial_statements trong run_risk_mitigation. Mọi chỉ số được tính bằng biểu
+    thức trên cột (vector hóa), không lặp theo từng công ty.
+    """
+
+    # Giá trị mặc định giống các lời gọi .get trong VIA.run_risk_mitigation
+    DEFAULTS = {
+        "current_assets": 0.0,
+        "current_liabilities": 0.0,
+        "total_assets": 1.0,
+        "retained_earnings": 0.0,
+        "ebit": 0.0,
+        "market_cap": 0.0,
+        "total_liabilities": 1.0,
+        "sales": 0.0,
+        "net_income": 0.0,
+        "operating_cash_flow": 0.0,
+        "roa": 0.0,
+        "prev_roa": 0.0,
+        "long_term_debt": 0.0,
+        "prev_long_term_debt": 0.0,
+        "prev_total_assets": 1.0,
+        "current_ratio": 0.0,
+        "prev_current_ratio": 0.0,
+        "shares_outstanding": 0.0,
+        "prev_shares_outstanding": np.inf,
+        "gross_margin": 0.0,
+        "prev_gross_margin": 0.0,
+        "asset_turnover": 0.0,
+        "prev_asset_turnover": 0.0,
+    }
+
+    SORT_KEYS = ("risk", "z_score", "f_score")
+
+    def _column(self, df, name):
+        default = self.DEFAULTS[name]
+        if name not in df.columns:
+            return pd.Series(default, index=df.index, dtype=float)
+        return pd.to_numeric(df[name], errors="coerce").fillna(default)
+
+    def screen(self, df, sort_by="risk", top_n=None):
+        """
+        Tính các thành phần Z-score, 9 tiêu chí F-score và xếp hạng rủi ro cho mọi
+        công ty, trả về DataFrame đã xếp hạng.
+        """
+        if sort_by not in self.SORT_KEYS:
+            raise ValueError(f"sort_by phải là một trong {self.SORT_KEYS}")
+
+        col = lambda name: self._column(df, name)  # noqa: E731
+        total_assets = col("total_assets")
+        total_liabilities = col("total_liabilities")
+
+        # 1. Altman Z-Score: Z = 1.2A + 1.4B + 3.3C + 0.6D + 1.0E
+        with np.errstate(divide="ignore", invalid="ignore"):
+            components = pd.DataFrame(
+                {
+                    "working_capital_to_assets": (
+                        col("current_assets") - col("current_liabilities")
+                    )
+                    / total_assets,
+                    "retained_earnings_to_assets": col("retained_earnings")
+                    / total_assets,
+                    "ebit_to_assets": col("ebit") / total_assets,
+                    "equity_to_liabilities": col("market_cap") / total_liabilities,
+                    "sales_to_assets": col("sales") / total_assets,
+                },
+                index=df.index,
+            ).replace([np.inf, -np.inf], np.nan)
+        z_score = components.to_numpy() @ np.array([1.2, 1.4, 3.3, 0.6, 1.0])
+        valid = ~np.isnan(z_score)
+
+        z_evaluation = np.select(
+            [~valid, z_score > 2.99, z_score > 1.81],
+            [
+                "Không đủ dữ liệu",
+                "An toàn - Khả năng phá sản thấp",
+                "Vùng xám - Cần theo dõi",
+            ],
+            default="Nguy hiểm - Khả năng phá sản cao",
+        )
+        z_risk_level = np.select(
+            [~valid, z_score > 2.99, z_score > 1.81],
+            [None, "Thấp", "Trung bình"],
+            default="Cao",
+        )
+
+        # 2. Piotroski F-Score: 9 tiêu chí, mỗi tiêu chí là một cột boolean
+        with np.errstate(divide="ignore", invalid="ignore"):
+            leverage = col("long_term_debt") / total_assets
+            prev_leverage = col("prev_long_term_debt") / col("prev_total_assets")
+        criteria = pd.DataFrame(
+            {
+                "f_positive_net_income": col("net_income") > 0,
+                "f_positive_operating_cash_flow": col("operating_cash_flow") > 0,
+                "f_improving_roa": col("roa") > col("prev_roa"),
+                "f_cash_flow_above_net_income": col("operating_cash_flow")
+                > col("net_income"),
+                "f_lower_leverage": leverage < prev_leverage,
+                "f_higher_current_ratio": col("current_ratio")
+                > col("prev_current_ratio"),
+                "f_no_dilution": col("shares_outstanding")
+                <= col("prev_shares_outstanding"),
+                "f_higher_gross_margin": col("gross_margin")
+                > col("prev_gross_margin"),
+                "f_higher_asset_turnover": col("asset_turnover")
+                > col("prev_asset_turnover"),
+            },
+            index=df.index,
+        )
+        f_score = criteria.sum(axis=1).to_numpy()
+
+        f_evaluation = np.select(
+            [f_score >= 7, f_score >= 4],
+            ["Sức khỏe tài chính tốt", "Sức khỏe tài chính trung bình"],
+            default="Sức khỏe tài chính yếu",
+        )
+
+        # 3. Đánh giá rủi ro tổng thể, cùng ngưỡng với run_risk_mitigation
+        rating_conditions = [
+            ~valid,
+            (z_score > 2.5) & (f_score >= 7),
+            (z_score > 1.8) & (f_score >= 5),
+            (z_score > 1.5) & (f_score >= 3),
+            z_score > 1.0,
+        ]
+        risk_rating = np.select(
+            rating_conditions,
+            [None, "Thấp", "Trung bình-Thấp", "Trung bình", "Trung bình-Cao"],
+            default="Cao",
+        )
+        # Thứ tự rủi ro (0 = thấp nhất) dùng để xếp hạng
+        risk_order = np.select(rating_conditions, [5, 0, 1, 2, 3], default=4)
+
+        identifiers = df.select_dtypes(exclude=["number", "bool"])
+        result = pd.concat(
+            [
+                identifiers,
+                pd.DataFrame(
+                    {
+                        "z_score": z_score,
+                        "z_evaluation": z_evaluation,
+                        "z_risk_level": z_risk_level,
+                        "f_score": f_score,
+                        "f_evaluation": f_evaluation,
+                        "risk_rating": risk_rating,
+                        "_risk_order": risk_order,
+                    },
+                    index=df.index,
+                ),
+                components,
+                criteria,
+            ],
+            axis=1,
+        )
+
+        if sort_by == "risk":
+            keys, ascending = ["_risk_order", "z_score", "f_score"], [True, False, False]
+        elif sort_by == "z_score":
+            keys, ascending = ["z_score", "f_score"], [False, False]
+        else:
+            keys, ascending = ["f_score", "z_score"], [False, False]
+        result = result.sort_values(
+            keys, ascending=ascending, na_position="last", kind="mergesort"
+        ).drop(columns="_risk_order")
+        result.insert(0, "rank", np.arange(1, len(result) + 1))
+
+        if top_n is not None:
+            result = result.head(top_n)
+        return result.reset_index(drop=True)
@@ -0,0 +1,798 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.stats import norm, qmc
+
+
+class MonteCarloEngine:
+    """
+    Bộ mô phỏng Monte Carlo giá cổ phiếu theo chuyển động Brown hình học (GBM),
+    vector hóa hoàn toàn bằng NumPy.
+    """
+
+    VARIANCE_REDUCTION_METHODS = (
+        "none",
+        "plain",
+        "antithetic",
+        "control_variate",
+        "sobol",
+    )
+
+    def __init__(self, confidence_level=0.05, block_size=10000, max_workers=None):
+        self.confidence_level = confidence_level  # 95% confidence
+        # Số đường mỗi khối ở chế độ song song. Cố định theo khối (không theo worker)
+        # để kết quả chỉ phụ thuộc vào seed.
+        self.block_size = block_size
+        # Process pool dùng chung cho mọi lần chạy song song, tạo khi cần lần đầu
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _pool(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def shutdown(self):
+        """Dừng process pool dùng chung (nếu đã tạo)."""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def quantile_sketch(self, current_price, mu, sigma, days, num_bins=4096):
+        """
+        Sketch phân vị rỗng trên miền giá cuối kỳ: log(S_T / S_0) xấp xỉ phân phối
+        chuẩn theo mô hình GBM, miền là ±8 độ lệch chuẩn quanh tâm.
+        """
+        log_mu = math.log1p(mu) if mu > -1 else 0.0
+        log_sigma = sigma / (1 + mu) if mu > -1 else sigma
+        center = math.log(current_price) + days * log_mu
+        spread = max(log_sigma * math.sqrt(days), 1e-6)
+        return StreamingQuantileSketch(
+            lower=math.exp(center - 8 * spread),
+            upper=math.exp(center + 8 * spread),
+            num_bins=num_bins,
+        )
+
+    def estimate_parameters(self, price_history):
+        """
+        Ước lượng lợi suất trung bình (mu) và độ biến động (sigma) từ lịch sử giá.
+        """
+        prices = np.asarray(price_history, dtype=float)
+        returns = prices[1:] / prices[:-1] - 1
+        return float(np.mean(returns)), float(np.std(returns))
+
+    def simulate_paths(self, current_price, mu, sigma, days, num_simulations, rng):
+        """
+        Sinh toàn bộ ma trận cú sốc (num_simulations x days) trong một lần gọi,
+        sau đó tích lũy giá theo trục thời gian bằng cumprod.
+        """
+        growth = rng.normal(mu, sigma, size=(num_simulations, days))
+        growth += 1
+        np.cumprod(growth, axis=1, out=growth)
+        growth *= current_price
+        return growth
+
+    def terminal_prices(self, current_price, mu, sigma, normals):
+        """
+        Giá cuối kỳ từ ma trận biến chuẩn hóa (num_paths x days) cho trước.
+        """
+        growth = mu + sigma * normals
+        growth += 1
+        return current_price * np.prod(growth, axis=1)
+
+    def summarize(self, terminal_prices, current_price, mean_price=None):
+        """
+        Tính các thống kê rủi ro (VaR, CVaR, xác suất giảm giá, ...) trên mảng giá cuối kỳ.
+        mean_price cho phép thay trung bình mẫu bằng một ước lượng khác (control variate).
+        """
+        terminal_prices = np.asarray(terminal_prices, dtype=float)
+        if mean_price is None:
+            mean_price = terminal_prices.mean()
+        median_price = np.median(terminal_prices)
+        std_dev = terminal_prices.std()
+
+        # Tính VaR (Value at Risk) và CVaR (Conditional VaR)
+        var_95 = np.percentile(terminal_prices, self.confidence_level * 100)
+        cvar_95 = terminal_prices[terminal_prices <= var_95].mean()
+
+        # Xác suất giảm giá
+        downside_prob = np.count_nonzero(terminal_prices < current_price) / len(
+            terminal_prices
+        )
+
+        return self._format_results(
+            mean_price=mean_price,
+            median_price=median_price,
+            std_dev=std_dev,
+            var_95=var_95,
+            cvar_95=cvar_95,
+            downside_prob=downside_prob,
+            max_price=terminal_prices.max(),
+            min_price=terminal_prices.min(),
+            current_price=current_price,
+        )
+
+    def run(
+        self,
+        price_history,
+        num_simulations=1000,
+        days=252,
+        seed=None,
+        variance_reduction="none",
+        num_replicates=10,
+    ):
+        """
+        Chạy mô phỏng Monte Carlo cho một mã cổ phiếu và trả về kết quả tổng hợp.
+
+        variance_reduction:
+        - "none": Monte Carlo thông thường
+        - "plain": Monte Carlo thông thường, kèm sai số chuẩn theo nhóm để làm mốc
+          so sánh với các phương pháp giảm phương sai
+        - "antithetic": biến đối ngẫu (z, -z)
+        - "control_variate": dùng giá GBM liên tục (có trung bình giải tích
+          S0 * exp(mu * days)) làm biến kiểm soát cho expected_price
+        - "sobol": dãy tựa ngẫu nhiên Sobol có xáo trộn (scipy.stats.qmc)
+
+        Với "plain" và các phương pháp giảm phương sai, sai số chuẩn của
+        expected_price và var_95 được ước lượng từ num_replicates nhóm độc lập (mỗi
+        nhóm phải có ít nhất một đường, hoặc một cặp đối ngẫu) để so sánh hiệu quả
+        giữa các phương pháp. "none" trả về đúng kết quả tổng hợp như trước.
+        """
+        if variance_reduction not in self.VARIANCE_REDUCTION_METHODS:
+            raise ValueError(
+                f"variance_reduction không hợp lệ: {variance_reduction}. "
+                f"Chọn một trong {self.VARIANCE_REDUCTION_METHODS}"
+            )
+
+        mu, sigma = self.estimate_parameters(price_history)
+        current_price = float(price_history[-1])
+        rng = np.random.default_rng(seed)
+
+        if variance_reduction == "none":
+            paths = self.simulate_paths(
+                current_price, mu, sigma, days, num_simulations, rng
+            )
+            return self.summarize(paths[:, -1], current_price)
+
+        num_replicates = int(num_replicates)
+        if num_replicates < 2:
+            raise ValueError("num_replicates phải lớn hơn hoặc bằng 2")
+        # Antithetic chia theo cặp (z, -z) nên cần gấp đôi số đường
+        required = (
+            2 * num_replicates - 1
+            if variance_reduction == "antithetic"
+            else num_replicates
+        )
+        if num_simulations < required:
+            raise ValueError(
+                f"variance_reduction={variance_reduction} cần num_simulations >= "
+                f"{required} để mỗi nhóm trong {num_replicates} nhóm có dữ liệu"
+            )
+
+        if variance_reduction == "plain":
+            paths = self.simulate_paths(
+                current_price, mu, sigma, days, num_simulations, rng
+            )
+            groups = np.array_split(paths[:, -1], num_replicates)
+            controls = None
+        elif variance_reduction == "antithetic":
+            normals = rng.standard_normal(((num_simulations + 1) // 2, days))
+            upper = self.terminal_prices(current_price, mu, sigma, normals)
+            lower = self.terminal_prices(current_price, mu, sigma, -normals)
+            # Giữ mỗi cặp đối ngẫu trong cùng một nhóm để các nhóm độc lập
+            pair_groups = np.array_split(np.arange(len(upper)), num_replicates)
+            groups = [np.concatenate([upper[idx], lower[idx]]) for idx in pair_groups]
+            controls = None
+        elif variance_reduction == "control_variate":
+            normals = rng.standard_normal((num_simulations, days))
+            terminal = self.terminal_prices(current_price, mu, sigma, normals)
+            control = current_price * np.exp(
+                (mu - 0.5 * sigma**2) * days + sigma * normals.sum(axis=1)
+            )
+            groups = np.array_split(terminal, num_replicates)
+            controls = np.array_split(control, num_replicates)
+        else:
+            # Mỗi nhóm là một lần xáo trộn Sobol độc lập, kích thước lũy thừa của 2
+            log2_size = max(1, math.ceil(math.log2(num_simulations / num_replicates)))
+            groups = []
+            for _ in range(num_replicates):
+                sampler = qmc.Sobol(d=days, scramble=True, seed=rng)
+                uniforms = sampler.random_base2(log2_size)
+                normals = norm.ppf(np.clip(uniforms, 1e-12, 1 - 1e-12))
+                groups.append(self.terminal_prices(current_price, mu, sigma, normals))
+            controls = None
+
+        pooled = np.concatenate(groups)
+        group_means = np.array([g.mean() for g in groups])
+        mean_price = None
+        if controls is not None:
+            pooled_control = np.concatenate(controls)
+            control_mean = current_price * math.exp(mu * days)
+            covariance = np.cov(pooled, pooled_control)
+            beta = covariance[0, 1] / covariance[1, 1] if covariance[1, 1] > 0 else 0.0
+            mean_price = pooled.mean() - beta * (pooled_control.mean() - control_mean)
+            group_means = np.array(
+                [
+                    g.mean() - beta * (c.mean() - control_mean)
+                    for g, c in zip(groups, controls)
+                ]
+            )
+
+        results = self.summarize(pooled, current_price, mean_price=mean_price)
+
+        group_vars = np.array(
+            [np.percentile(g, self.confidence_level * 100) for g in groups]
+        )
+        standard_errors = {
+            "expected_price": group_means.std(ddof=1) / math.sqrt(len(groups)),
+            "var_95": group_vars.std(ddof=1) / math.sqrt(len(groups)),
+        }
+        results["variance_reduction"] = variance_reduction
+        results["num_simulations"] = len(pooled)
+        results["standard_errors"] = {
+            k: round(float(v), 4) for k, v in standard_errors.items()
+        }
+        # Độ rộng khoảng tin cậy 95% (2 * 1.96 * SE)
+        results["ci_95_width"] = {
+            k: round(float(2 * 1.96 * v), 4) for k, v in standard_errors.items()
+        }
+        return results
+
+    def run_parallel(
+        self,
+        price_history,
+        num_simulations=100000,
+        days=252,
+        seed=None,
+        max_workers=None,
+        num_bins=4096,
+    ):
+        """
+        Mô phỏng song song trên process pool dùng chung cho số lượng đường lớn.
+
+        Các đường được chia thành khối cố định ``block_size``; mỗi khối nhận một luồng
+        ngẫu nhiên con độc lập từ ``SeedSequence(seed).spawn``, nên với cùng seed kết
+        quả không phụ thuộc vào số worker. Worker chỉ trả về thống kê rút gọn
+        (moment, min/max, sketch phân vị cho trung vị và phần đuôi trái có giới hạn
+        cho VaR/CVaR), không trả về mảng đường giá. max_workers (tối đa số worker của
+        pool) giới hạn số khối chạy đồng thời của lần gọi này.
+
+        Mỗi khối chỉ gửi về khoảng phần của nó trong đuôi confidence_level cộng một
+        biên 6 độ lệch chuẩn (nhị thức). VaR/CVaR chính xác khi đuôi gộp được chứng
+        minh là đủ; nếu không (rất hiếm) thì lấy từ sketch phân vị gộp.
+        """
+        max_workers = int(max_workers or self.max_workers)
+        if max_workers <= 0:
+            raise ValueError("max_workers phải lớn hơn 0")
+        mu, sigma = self.estimate_parameters(price_history)
+        current_price = float(price_history[-1])
+        sketch = self.quantile_sketch(current_price, mu, sigma, days, num_bins)
+
+        block_sizes = [self.block_size] * (num_simulations // self.block_size)
+        if num_simulations % self.block_size:
+            block_sizes.append(num_simulations % self.block_size)
+        child_seeds = np.random.SeedSequence(seed).spawn(len(block_sizes))
+
+        # Chỉ cần giữ các giá trị nhỏ nhất đủ để nội suy percentile VaR
+        tail_size = int(self.confidence_level * (num_simulations - 1)) + 2
+        domain = (sketch.edges[0], sketch.edges[-1], num_bins)
+        tasks = [
+            (
+                child_seed,
+                current_price,
+                mu,
+                sigma,
+                days,
+                size,
+                self.block_tail_size(size),
+                domain,
+            )
+            for child_seed, size in zip(child_seeds, block_sizes)
+        ]
+
+        max_workers = min(max_workers, self.max_workers, len(tasks))
+        if max_workers > 1:
+            executor = self._pool()
+            pending, partials = deque(), []
+            for task in tasks:
+                pending.append(executor.submit(_simulate_block, task))
+                if len(pending) >= max_workers:
+                    partials.append(pending.popleft().result())
+            partials.extend(future.result() for future in pending)
+        else:
+            partials = [_simulate_block(task) for task in tasks]
+
+        stats = _merge_block_statistics(partials, sketch)
+        tail = np.sort(np.concatenate([p["tail"] for p in partials]))[:tail_size]
+
+        # Đuôi gộp là tail_size giá trị nhỏ nhất thật sự nếu mọi khối bị cắt đều đã
+        # gửi về ít nhất tới giá trị thứ tail_size (phần còn lại của khối lớn hơn)
+        exact = len(tail) == tail_size and all(
+            p["tail"][-1] >= tail[-1] for p in partials if p["tail_truncated"]
+        )
+        if exact:
+            # Nội suy tuyến tính giống np.percentile trên toàn bộ tập giá cuối kỳ
+            position = self.confidence_level * (stats["count"] - 1)
+            lower = int(math.floor(position))
+            upper = min(lower + 1, len(tail) - 1)
+            var_95 = tail[lower] + (position - lower) * (tail[upper] - tail[lower])
+            cvar_95 = tail[tail <= var_95].mean()
+        else:
+            var_95 = sketch.quantile(self.confidence_level)
+            cvar_95 = sketch.tail_mean(self.confidence_level)
+
+        results = self._format_results(
+            mean_price=stats["mean"],
+            median_price=stats["median"],
+            std_dev=math.sqrt(stats["m2"] / stats["count"]),
+            var_95=var_95,
+            cvar_95=cvar_95,
+            downside_prob=stats["below"] / stats["count"],
+            max_price=stats["max"],
+            min_price=stats["min"],
+            current_price=current_price,
+        )
+        results["num_simulations"] = stats["count"]
+        results["num_blocks"] = len(block_sizes)
+        results["sketch_bins"] = num_bins
+        return results
+
+    def block_tail_size(self, num_paths):
+        """
+        Số giá trị nhỏ nhất một khối gửi về: kỳ vọng số đường của khối thuộc đuôi
+        confidence_level cộng 6 độ lệch chuẩn nhị thức (và 2 cho phép nội suy).
+        """
+        q = self.confidence_level
+        margin = 6 * math.sqrt(num_paths * q * (1 - q))
+        return min(num_paths, int(math.ceil(q * num_paths + margin)) + 2)
+
+    def run_streaming(
+        self,
+        price_history,
+        num_simulations=1000000,
+        days=252,
+        seed=None,
+        chunk_size=10000,
+        num_bins=4096,
+    ):
+        """
+        Mô phỏng theo từng chunk với bộ nhớ giới hạn.
+
+        Giá cuối kỳ của mỗi chunk được đưa vào moment chạy (RunningMoments) và sketch
+        phân vị (StreamingQuantileSketch) rồi bị bỏ đi, nên bộ nhớ chỉ phụ thuộc vào
+        chunk_size và num_bins, không phụ thuộc vào num_simulations.
+        """
+        if chunk_size <= 0:
+            raise ValueError("chunk_size phải lớn hơn 0")
+        mu, sigma = self.estimate_parameters(price_history)
+        current_price = float(price_history[-1])
+        rng = np.random.default_rng(seed)
+
+        sketch = self.quantile_sketch(current_price, mu, sigma, days, num_bins)
+        moments = RunningMoments()
+        below = 0
+
+        remaining = num_simulations
+        while remaining > 0:
+            size = min(chunk_size, remaining)
+            terminal = self.simulate_paths(current_price, mu, sigma, days, size, rng)[
+                :, -1
+            ]
+            moments.update(terminal)
+            sketch.update(terminal)
+            below += int(np.count_nonzero(terminal < current_price))
+            remaining -= size
+
+        var_95 = sketch.quantile(self.confidence_level)
+        results = self._format_results(
+            mean_price=moments.mean,
+            median_price=sketch.quantile(0.5),
+            std_dev=moments.std,
+            var_95=var_95,
+            cvar_95=sketch.tail_mean(self.confidence_level),
+            downside_prob=below / moments.count,
+            max_price=moments.max,
+            min_price=moments.min,
+            current_price=current_price,
+        )
+        results["num_simulations"] = moments.count
+        results["sketch_bins"] = num_bins
+        return results
+
+    def run_adaptive(
+        self,
+        price_history,
+        target_relative_error=0.01,
+        time_budget=None,
+        days=252,
+        seed=None,
+        batch_size=1000,
+        max_simulations=1000000,
+        min_batches=4,
+    ):
+        """
+        Mô phỏng theo lô cho đến khi hội tụ thay vì cố định số đường.
+
+        Sau mỗi lô, sai số tương đối (nửa độ rộng khoảng tin cậy 95% / ước lượng) của
+        expected_price và var_95 được tính từ độ phân tán giữa các lô. Dừng khi cả hai
+        nhỏ hơn target_relative_error, khi hết time_budget (giây) hoặc khi chạm
+        max_simulations. Mã ít biến động sẽ hội tụ sau ít lô hơn.
+        """
+        if batch_size <= 0 or max_simulations <= 0:
+            raise ValueError("batch_size và max_simulations phải lớn hơn 0")
+        mu, sigma = self.estimate_parameters(price_history)
+        current_price = float(price_history[-1])
+        rng = np.random.default_rng(seed)
+
+        start = time.perf_counter()
+        batches, batch_means, batch_vars = [], [], []
+        relative_errors = {"expected_price": None, "var_95": None}
+        stopping_reason = "max_simulations"
+        simulated = 0
+
+        while simulated < max_simulations:
+            size = min(batch_size, max_simulations - simulated)
+            terminal = self.simulate_paths(current_price, mu, sigma, days, size, rng)[
+                :, -1
+            ]
+            batches.append(terminal)
+            batch_means.append(terminal.mean())
+            batch_vars.append(np.percentile(terminal, self.confidence_level * 100))
+            simulated += size
+
+            if len(batches) >= min_batches:
+                n = len(batches)
+                pooled_mean = np.mean(batch_means)
+                pooled_var = np.mean(batch_vars)
+                relative_errors = {
+                    "expected_price": 1.96
+                    * np.std(batch_means, ddof=1)
+                    / math.sqrt(n)
+                    / abs(pooled_mean),
+                    "var_95": 1.96
+                    * np.std(batch_vars, ddof=1)
+                    / math.sqrt(n)
+                    / abs(pooled_var),
+                }
+                if max(relative_errors.values()) <= target_relative_error:
+                    stopping_reason = "converged"
+                    break
+
+            if time_budget is not None and time.perf_counter() - start >= time_budget:
+                stopping_reason = "time_budget"
+                break
+
+        results = self.summarize(np.concatenate(batches), current_price)
+        results["num_simulations"] = simulated
+        results["converged"] = stopping_reason == "converged"
+        results["stopping_reason"] = stopping_reason
+        results["relative_errors"] = {
+            k: round(float(v), 6) if v is not None else None
+            for k, v in relative_errors.items()
+        }
+        results["elapsed_seconds"] = round(time.perf_counter() - start, 4)
+        return results
+
+    def run_portfolio(
+        self,
+        price_histories,
+        weights,
+        num_simulations=1000,
+        days=252,
+        seed=None,
+        portfolio_value=1.0,
+        max_chunk_elements=5000000,
+    ):
+        """
+        Mô phỏng đồng thời nhiều tài sản có tương quan cho một danh mục.
+
+        Ma trận hiệp phương sai lợi suất được ước lượng một lần và phân rã Cholesky;
+        cú sốc tương quan cho mọi tài sản được sinh trong một tensor
+        (num_simulations x days x số tài sản). Trả về VaR/CVaR (theo khoản lỗ) của
+        danh mục và phần đóng góp (Euler) của từng vị thế.
+        """
+        # Căn các chuỗi giá theo độ dài ngắn nhất, lấy phần gần nhất
+        length = min(len(history) for history in price_histories)
+        prices = np.column_stack(
+            [np.asarray(history[-length:], dtype=float) for history in price_histories]
+        )
+        returns = prices[1:] / prices[:-1] - 1
+        mu = returns.mean(axis=0)
+        covariance = np.atleast_2d(np.cov(returns, rowvar=False, bias=True))
+        cholesky = self._cholesky(covariance)
+
+        weights = np.asarray(weights, dtype=float)
+        weights = weights / weights.sum()
+        position_values = portfolio_value * weights
+        num_assets = len(weights)
+
+        # Chia theo chunk để giới hạn kích thước tensor cú sốc
+        rng = np.random.default_rng(seed)
+        chunk = max(1, min(num_simulations, max_chunk_elements // (days * num_assets)))
+        growth = np.empty((num_simulations, num_assets))
+        for start in range(0, num_simulations, chunk):
+            size = min(chunk, num_simulations - start)
+            shocks = rng.standard_normal((size, days, num_assets)) @ cholesky.T
+            shocks += mu
+            shocks += 1
+            growth[start : start + size] = np.prod(shocks, axis=1)
+
+        # Khoản lỗ của từng vị thế và của cả danh mục
+        position_losses = position_values * (1 - growth)
+        portfolio_losses = position_losses.sum(axis=1)
+
+        var_95 = np.percentile(portfolio_losses, (1 - self.confidence_level) * 100)
+        tail = portfolio_losses >= var_95
+        cvar_95 = portfolio_losses[tail].mean()
+
+        # Đóng góp Euler: kỳ vọng khoản lỗ từng vị thế trong vùng đuôi (CVaR) và
+        # trong lân cận của VaR (VaR thành phần)
+        component_cvar = position_losses[tail].mean(axis=0)
+        order = np.argsort(portfolio_losses)
+        var_rank = int(round((1 - self.confidence_level) * (num_simulations - 1)))
+        window = max(1, int(0.01 * num_simulations))
+        neighbourhood = order[
+            max(0, var_rank - window) : min(num_simulations, var_rank + window + 1)
+        ]
+        component_var = position_losses[neighbourhood].mean(axis=0)
+        component_var *= var_95 / component_var.sum() if component_var.sum() else 0
+
+        volatilities = np.sqrt(np.diag(covariance))
+        positions = []
+        for i in range(num_assets):
+            positions.append(
+                {
+                    "weight": round(float(weights[i]), 4),
+                    "expected_value": round(
+                        float(position_values[i] * growth[:, i].mean()), 4
+                    ),
+                    "daily_volatility": round(float(volatilities[i]), 6),
+                    "component_var_95": round(float(component_var[i]), 4),
+                    "component_cvar_95": round(float(component_cvar[i]), 4),
+                    "marginal_cvar_95": (
+                        round(float(component_cvar[i] / position_values[i]), 4)
+                        if position_values[i]
+                        else None
+                    ),
+                    "cvar_contribution_percent": (
+                        round(float(component_cvar[i] / cvar_95 * 100), 2)
+                        if cvar_95
+                        else None
+                    ),
+                }
+            )
+
+        portfolio_values = portfolio_value - portfolio_losses
+        return {
+            "portfolio_value": round(float(portfolio_value), 4),
+            "expected_value": round(float(portfolio_values.mean()), 4),
+            "median_value": round(float(np.median(portfolio_values)), 4),
+            "var_95": round(float(var_95), 4),
+            "cvar_95": round(float(cvar_95), 4),
+            "var_95_percent": round(float(var_95 / portfolio_value * 100), 2),
+            "cvar_95_percent": round(float(cvar_95 / portfolio_value * 100), 2),
+            "downside_probability": round(float(np.mean(portfolio_losses > 0)), 4),
+            "correlation_matrix": (
+                np.round(covariance / np.outer(volatilities, volatilities), 4).tolist()
+                if np.all(volatilities > 0)
+                else None
+            ),
+            "positions": positions,
+            "num_simulations": num_simulations,
+            "history_length": length,
+        }
+
+    def _cholesky(self, covariance):
+        """
+        Phân rã Cholesky, thêm jitter nhỏ vào đường chéo nếu ma trận chưa xác định dương.
+        """
+        jitter = 0.0
+        scale = float(np.mean(np.diag(covariance))) or 1.0
+        for _ in range(8):
+            try:
+                return np.linalg.cholesky(covariance + jitter * np.eye(len(covariance)))
+            except np.linalg.LinAlgError:
+                jitter = scale * 1e-10 if jitter == 0 else jitter * 10
+        raise ValueError("Ma trận hiệp phương sai không xác định dương")
+
+    def _format_results(
+        self,
+        mean_price,
+        median_price,
+        std_dev,
+        var_95,
+        cvar_95,
+        downside_prob,
+        max_price,
+        min_price,
+        current_price,
+    ):
+        # Định giá rủi ro
+        risk_reward_ratio = (
+            (mean_price - current_price) / (current_price - var_95)
+            if current_price != var_95
+            else 0
+        )
+
+        return {
+            "expected_price": round(float(mean_price), 2),
+            "median_price": round(float(median_price), 2),
+            "current_price": round(float(current_price), 2),
+            "price_volatility": round(float(std_dev / mean_price), 4),
+            "var_95": round(float(var_95), 2),
+            "cvar_95": round(float(cvar_95), 2),
+            "downside_probability": round(float(downside_prob), 4),
+            "risk_reward_ratio": round(float(risk_reward_ratio), 2),
+            "max_price": round(float(max_price), 2),
+            "min_price": round(float(min_price), 2),
+        }
+
+
+class RunningMoments:
+    """
+    Moment chạy (count, mean, M2, min, max) cập nhật theo lô với thuật toán song
+    song của Chan/Welford; bộ nhớ O(1).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return
+        batch_mean = float(values.mean())
+        self.merge(values.size, batch_mean, float(((values - batch_mean) ** 2).sum()))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta**2 * self.count * count / total
+        self.count = total
+
+    def add(self, value):
+        """Welford: thêm một quan sát."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def remove(self, value):
+        """
+        Welford ngược: bỏ một quan sát đã thêm trước đó (dùng cho cửa sổ trượt).
+        min/max không được cập nhật khi bỏ quan sát.
+        """
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        self.count -= 1
+        delta = value - self.mean
+        self.mean -= delta / self.count
+        self.m2 = max(self.m2 - delta * (value - self.mean), 0.0)
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+class StreamingQuantileSketch:
+    """
+    Sketch phân vị kích thước cố định: histogram trên thang log của giá, mỗi bin lưu
+    số lượng và tổng giá trị để ước lượng cả phân vị (VaR) lẫn trung bình đuôi (CVaR).
+    Giá trị nằm ngoài [lower, upper) được gom vào hai bin tràn ở hai đầu.
+    """
+
+    def __init__(self, lower, upper, num_bins=4096):
+        self.edges = np.geomspace(lower, upper, num_bins + 1)
+        # Bin 0 và bin cuối là bin tràn dưới/trên
+        self.counts = np.zeros(num_bins + 2, dtype=np.int64)
+        self.sums = np.zeros(num_bins + 2)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        bins = np.searchsorted(self.edges, values, side="right")
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+        self.sums += np.bincount(bins, weights=values, minlength=len(self.sums))
+
+    def merge(self, counts, sums):
+        """Gộp một sketch khác có cùng miền và số bin (ví dụ từ một worker)."""
+        self.counts += counts
+        self.sums += sums
+
+    def _locate(self, q):
+        """Trả về (bin, tỷ lệ trong bin) chứa hạng q * tổng số quan sát."""
+        target = q * self.counts.sum()
+        cumulative = np.cumsum(self.counts)
+        index = int(np.searchsorted(cumulative, target, side="left"))
+        index = min(index, len(self.counts) - 1)
+        before = cumulative[index] - self.counts[index]
+        fraction = (target - before) / self.counts[index] if self.counts[index] else 0.0
+        return index, fraction
+
+    def quantile(self, q):
+        index, fraction = self._locate(q)
+        if index == 0:
+            return float(self.edges[0])
+        if index == len(self.counts) - 1:
+            return float(self.edges[-1])
+        # Nội suy hình học trong bin (các bin cách đều trên thang log)
+        low, high = self.edges[index - 1], self.edges[index]
+        return float(low * (high / low) ** fraction)
+
+    def tail_mean(self, q):
+        """Trung bình các giá trị thuộc phần đuôi trái có xác suất q (CVaR)."""
+        index, fraction = self._locate(q)
+        tail_count = self.counts[:index].sum() + fraction * self.counts[index]
+        tail_sum = self.sums[:index].sum() + fraction * self.sums[index]
+        return float(tail_sum / tail_count) if tail_count else float(self.edges[0])
+
+
+def _simulate_block(task):
+    """
+    Worker của process pool: mô phỏng một khối đường giá và chỉ trả về thống kê
+    rút gọn của giá cuối kỳ.
+    """
+    seed_seq, current_price, mu, sigma, days, num_paths, tail_size, domain = task
+    rng = np.random.default_rng(seed_seq)
+    terminal = MonteCarloEngine().simulate_paths(
+        current_price, mu, sigma, days, num_paths, rng
+    )[:, -1]
+
+    sketch = StreamingQuantileSketch(*domain)
+    sketch.update(terminal)
+    return {
+        "count": num_paths,
+        "mean": float(terminal.mean()),
+        "m2": float(((terminal - terminal.mean()) ** 2).sum()),
+        "min": float(terminal.min()),
+        "max": float(terminal.max()),
+        "below": int(np.count_nonzero(terminal < current_price)),
+        "sketch_counts": sketch.counts,
+        "sketch_sums": sketch.sums,
+        "tail": np.sort(np.partition(terminal, tail_size - 1)[:tail_size]),
+        "tail_truncated": tail_size < num_paths,
+    }
+
+
+def _merge_block_statistics(partials, sketch):
+    """
+    Gộp thống kê của các khối (thuật toán song song của Chan cho mean/M2). Sketch
+    phân vị của các khối được cộng vào `sketch` (cùng miền), trung vị lấy từ sketch
+    gộp như ở chế độ streaming.
+    """
+    moments = RunningMoments()
+    for part in partials:
+        moments.merge(part["count"], part["mean"], part["m2"])
+        sketch.merge(part["sketch_counts"], part["sketch_sums"])
+    count = moments.count
+
+    return {
+        "count": count,
+        "mean": moments.mean,
+        "m2": moments.m2,
+        "min": min(p["min"] for p in partials),
+        "max": max(p["max"] for p in partials),
+        "below": sum(p["below"] for p in partials),
+        "median": sketch.quantile(0.5),
+    }
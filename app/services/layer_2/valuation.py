@@ -0,0 +1,395 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
+class BatchValuation:
+    """
+    Các kernel định giá vector hóa cho nhiều công ty cùng lúc (N công ty x T kỳ).
+    """
+
+    # Các tên cột dòng tiền được chấp nhận (dạng list hoặc dạng cột fcf_1..fcf_T)
+    CASH_FLOW_FIELDS = ("cash_flows", "free_cash_flow")
+    CASH_FLOW_COLUMN = re.compile(r"^(?:fcf|free_cash_flow|cash_flow)_(\d+)$")
+
+    # Giá trị mặc định giống các lời gọi .get trong VIA.calculate_wacc
+    WACC_DEFAULTS = {
+        "equity_value": 0.0,
+        "debt_value": 0.0,
+        "risk_free_rate": 0.03,
+        "market_return": 0.10,
+        "beta": 1.0,
+        "cost_of_debt": 0.05,
+        "tax_rate": 0.2,
+    }
+
+    # Đường spread chi phí nợ (trên lãi suất phi rủi ro) theo tỷ lệ D/E, nội suy tuyến
+    # tính giữa các điểm; có thể thay bằng debt_spread_curve trong request
+    DEBT_SPREAD_CURVE = {
+        "debt_to_equity": [0.0, 0.25, 0.5, 1.0, 1.5, 2.0, 3.0],
+        "spread": [0.01, 0.0125, 0.0175, 0.03, 0.045, 0.065, 0.1],
+    }
+
+    def dcf_inputs(self, df):
+        """
+        Chuẩn hóa bảng đầu vào DCF thành ma trận dòng tiền (N x T, NaN ở các kỳ thiếu)
+        và các vector tham số theo từng dòng.
+        """
+        numbered = sorted(
+            (
+                (int(match.group(1)), column)
+                for column in df.columns
+                if (match := self.CASH_FLOW_COLUMN.match(str(column)))
+            ),
+        )
+        if numbered:
+            cash_flows = (
+                df[[column for _, column in numbered]]
+                .apply(pd.to_numeric, errors="coerce")
+                .to_numpy(dtype=float)
+            )
+        else:
+            field = next((f for f in self.CASH_FLOW_FIELDS if f in df.columns), None)
+            if field is None:
+                raise ValueError(
+                    "Thiếu dữ liệu dòng tiền (cash_flows, free_cash_flow hoặc fcf_1..fcf_T)"
+                )
+            values = df[field].tolist()
+            rows = [
+                np.atleast_1d(np.asarray(v, dtype=float)) if v is not None else []
+                for v in values
+            ]
+            width = max((len(r) for r in rows), default=0)
+            cash_flows = np.full((len(rows), width), np.nan)
+            for i, row in enumerate(rows):
+                cash_flows[i, : len(row)] = row
+
+        def column(name, default):
+            if name not in df.columns:
+                return np.full(len(df), default, dtype=float)
+            return pd.to_numeric(df[name], errors="coerce").fillna(default).to_numpy()
+
+        return {
+            "cash_flows": cash_flows,
+            "discount_rate": column("discount_rate", 0.1),
+            "terminal_growth_rate": column("terminal_growth_rate", np.nan),
+            "shares_outstanding": column("shares_outstanding", np.nan),
+            "net_debt": column("net_debt", 0.0),
+        }
+
+    def dcf(
+        self,
+        cash_flows,
+        discount_rate,
+        terminal_growth_rate=None,
+        shares_outstanding=None,
+        net_debt=None,
+    ):
+        """
+        Kernel DCF: tính giá trị hiện tại, terminal value (Gordon Growth) và giá trị
+        vốn chủ sở hữu trên mỗi cổ phiếu cho N công ty trong một phép broadcast.
+
+        - cash_flows: ma trận N x T (NaN cho kỳ không có dữ liệu)
+        - discount_rate, terminal_growth_rate, shares_outstanding, net_debt: vector N
+          (terminal_growth_rate NaN = không tính terminal value)
+        """
+        cash_flows = np.atleast_2d(np.asarray(cash_flows, dtype=float))
+        n, t = cash_flows.shape
+        rate = np.broadcast_to(np.asarray(discount_rate, dtype=float), (n,))
+        growth = np.broadcast_to(
+            np.asarray(
+                np.nan if terminal_growth_rate is None else terminal_growth_rate,
+                dtype=float,
+            ),
+            (n,),
+        )
+        shares = np.broadcast_to(
+            np.asarray(
+                np.nan if shares_outstanding is None else shares_outstanding,
+                dtype=float,
+            ),
+            (n,),
+        )
+        debt = np.broadcast_to(
+            np.asarray(0.0 if net_debt is None else net_debt, dtype=float), (n,)
+        )
+
+        periods = np.arange(1, t + 1)
+        discount_factors = (1 + rate[:, None]) ** -periods  # N x T
+        observed = ~np.isnan(cash_flows)
+        present_value = np.where(observed, cash_flows * discount_factors, 0.0).sum(
+            axis=1
+        )
+
+        # Kỳ cuối cùng có dữ liệu của từng dòng, dùng cho terminal value
+        has_data = observed.any(axis=1)
+        last_index = t - 1 - np.argmax(observed[:, ::-1], axis=1)
+        last_cash_flow = np.where(
+            has_data, cash_flows[np.arange(n), last_index], np.nan
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            terminal_value = np.where(
+                ~np.isnan(growth) & (rate > growth),
+                last_cash_flow * (1 + growth) / (rate - growth),
+                np.where(np.isnan(growth), 0.0, np.nan),
+            )
+            terminal_pv = terminal_value * discount_factors[np.arange(n), last_index]
+
+            enterprise_value = np.where(has_data, present_value + terminal_pv, np.nan)
+            equity_value = enterprise_value - debt
+            per_share = np.where(shares > 0, equity_value / shares, np.nan)
+
+        return {
+            "dcf_value": np.where(has_data, present_value, np.nan),
+            "terminal_value": terminal_value,
+            "terminal_value_pv": terminal_pv,
+            "enterprise_value": enterprise_value,
+            "equity_value": equity_value,
+            "equity_value_per_share": per_share,
+        }
+
+    def dcf_sensitivity(
+        self, cash_flows, wacc_values, growth_values, net_debt=0.0, shares=None
+    ):
+        """
+        Lưới độ nhạy DCF (WACC x tăng trưởng dài hạn) từ một dự phóng dòng tiền chung.
+
+        Giá trị hiện tại của dòng tiền chỉ phụ thuộc vào WACC (W x T), terminal value
+        phụ thuộc cả hai (W x G); toàn bộ lưới được tính bằng broadcast.
+        """
+        cash_flows = np.asarray(cash_flows, dtype=float)
+        wacc = np.asarray(wacc_values, dtype=float)[:, None]  # W x 1
+        growth = np.asarray(growth_values, dtype=float)[None, :]  # 1 x G
+
+        periods = np.arange(1, len(cash_flows) + 1)
+        discount_factors = (1 + wacc) ** -periods  # W x T
+        present_value = discount_factors @ cash_flows  # W
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            terminal_value = np.where(
+                wacc > growth,
+                cash_flows[-1] * (1 + growth) / (wacc - growth),
+                np.nan,
+            )  # W x G
+            enterprise_value = present_value[:, None] + terminal_value * (
+                discount_factors[:, -1:]
+            )
+            equity_value = enterprise_value - net_debt
+            per_share = (
+                equity_value / shares if shares is not None and shares > 0 else None
+            )
+
+        return {
+            "enterprise_value": enterprise_value,
+            "equity_value": equity_value,
+            "equity_value_per_share": per_share,
+        }
+
+    def breakeven_contour(self, grid, wacc_values, growth_values, target):
+        """
+        Đường hòa vốn trên lưới độ nhạy: với mỗi mức tăng trưởng, tìm WACC mà tại đó
+        giá trị bằng target (nội suy tuyến tính giữa hai điểm lưới đổi dấu).
+        """
+        wacc = np.asarray(wacc_values, dtype=float)
+        diff = np.asarray(grid, dtype=float) - target  # W x G
+        left, right = diff[:-1], diff[1:]
+        crossing = (np.sign(left) != np.sign(right)) & ~np.isnan(left + right)
+
+        contour = []
+        for j, growth in enumerate(growth_values):
+            rows = np.flatnonzero(crossing[:, j])
+            if rows.size == 0:
+                contour.append(
+                    {"terminal_growth": round(float(growth), 6), "wacc": None}
+                )
+                continue
+            i = rows[0]
+            weight = left[i, j] / (left[i, j] - right[i, j])
+            contour.append(
+                {
+                    "terminal_growth": round(float(growth), 6),
+                    "wacc": round(float(wacc[i] + weight * (wacc[i + 1] - wacc[i])), 6),
+                }
+            )
+        return contour
+
+    def wacc_inputs(self, df):
+        """Các vector đầu vào WACC từ bảng (mỗi dòng một công ty)."""
+        return {
+            name: (
+                pd.to_numeric(df[name], errors="coerce").fillna(default).to_numpy()
+                if name in df.columns
+                else np.full(len(df), default, dtype=float)
+            )
+            for name, default in self.WACC_DEFAULTS.items()
+        }
+
+    def wacc(
+        self,
+        equity_value,
+        debt_value,
+        risk_free_rate=0.03,
+        market_return=0.10,
+        beta=1.0,
+        cost_of_debt=0.05,
+        tax_rate=0.2,
+    ):
+        """
+        Kernel WACC cho N công ty: WACC = E/V * Re + D/V * Rd * (1 - T), với Re theo
+        CAPM. Giống VIA.calculate_wacc, WACC bằng 0 khi E + D = 0.
+        """
+        equity, debt, rf, rm, beta, rd, tax = np.broadcast_arrays(
+            *(
+                np.asarray(v, dtype=float)
+                for v in (
+                    equity_value,
+                    debt_value,
+                    risk_free_rate,
+                    market_return,
+                    beta,
+                    cost_of_debt,
+                    tax_rate,
+                )
+            )
+        )
+        total = equity + debt
+        with np.errstate(divide="ignore", invalid="ignore"):
+            equity_weight = np.where(total != 0, equity / total, 0.0)
+            debt_weight = np.where(total != 0, debt / total, 0.0)
+        cost_of_equity = rf + beta * (rm - rf)
+        after_tax_cost_of_debt = rd * (1 - tax)
+
+        return {
+            "cost_of_equity": cost_of_equity,
+            "after_tax_cost_of_debt": after_tax_cost_of_debt,
+            "equity_weight": equity_weight,
+            "debt_weight": debt_weight,
+            "wacc": equity_weight * cost_of_equity
+            + debt_weight * after_tax_cost_of_debt,
+        }
+
+    def unlevered_beta(self, beta, debt_to_equity, tax_rate):
+        """Beta không vay nợ theo Hamada: βu = βL / (1 + (1 - T) * D/E)."""
+        return np.asarray(beta, dtype=float) / (
+            1 + (1 - np.asarray(tax_rate, dtype=float)) * debt_to_equity
+        )
+
+    def debt_spread(self, debt_to_equity, curve=None):
+        curve = curve or self.DEBT_SPREAD_CURVE
+        return np.interp(
+            debt_to_equity,
+            np.asarray(curve["debt_to_equity"], dtype=float),
+            np.asarray(curve["spread"], dtype=float),
+        )
+
+    def optimal_capital_structure(
+        self,
+        debt_to_equity,
+        unlevered_beta,
+        tax_rate,
+        risk_free_rate=0.03,
+        market_return=0.10,
+        spread_curve=None,
+    ):
+        """
+        Tìm cấu trúc vốn tối thiểu hóa WACC cho N kịch bản (N x D/E trong một lần
+        broadcast). Mỗi tỷ lệ D/E được tái đòn bẩy beta theo Hamada và định giá nợ
+        bằng Rf + spread(D/E).
+
+        - debt_to_equity: lưới D tỷ lệ D/E
+        - unlevered_beta, tax_rate, risk_free_rate, market_return: vector N
+        """
+        grid = np.asarray(debt_to_equity, dtype=float)[None, :]  # 1 x D
+        beta_u, tax, rf, rm = (
+            v[:, None]
+            for v in np.broadcast_arrays(
+                *(
+                    np.atleast_1d(np.asarray(v, dtype=float))
+                    for v in (unlevered_beta, tax_rate, risk_free_rate, market_return)
+                )
+            )
+        )
+
+        levered_beta = beta_u * (1 + (1 - tax) * grid)  # N x D
+        cost_of_equity = rf + levered_beta * (rm - rf)
+        cost_of_debt = rf + self.debt_spread(grid, spread_curve)
+        debt_weight = grid / (1 + grid)
+        wacc = (1 - debt_weight) * cost_of_equity + debt_weight * cost_of_debt * (
+            1 - tax
+        )
+
+        rows = np.arange(len(wacc))
+        best = np.argmin(wacc, axis=1)
+        cost_of_debt = np.broadcast_to(cost_of_debt, wacc.shape)
+        return {
+            "debt_to_equity": grid[0, best],
+            "debt_weight": debt_weight[0, best],
+            "levered_beta": levered_beta[rows, best],
+            "cost_of_equity": cost_of_equity[rows, best],
+            "cost_of_debt": cost_of_debt[rows, best],
+            "wacc": wacc[rows, best],
+            "wacc_curve": wacc,
+        }
+
+    def comparables(
+        self, rows, pe_ratios, num_rows, earnings_per_share, trim_fraction=0.2
+    ):
+        """
+        Định giá so sánh cho N công ty từ bảng peer dạng dài (rows: chỉ số công ty của
+        mỗi peer, pe_ratios: PE của peer). Median, mean, trimmed mean (bỏ
+        floor(n * trim_fraction) peer ở mỗi đầu) và min/max PE của từng công ty được
+        tính trong một lần sắp xếp theo (công ty, PE), không lặp theo nhóm.
+        Peer có PE không dương bị loại; trim_fraction được giới hạn trong [0, 0.5].
+        Công ty không có peer nhận NaN ở mọi thống kê và giá trị. Trả về dict các
+        vector độ dài N.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        pe_ratios = np.asarray(pe_ratios, dtype=float)
+        valid = np.isfinite(pe_ratios) & (pe_ratios > 0)
+        rows, pe_ratios = rows[valid], pe_ratios[valid]
+
+        order = np.lexsort((pe_ratios, rows))
+        rows, pe_ratios = rows[order], pe_ratios[order]
+        counts = np.bincount(rows, minlength=num_rows)
+        starts = np.concatenate([[0], np.cumsum(counts)])[:-1]
+        has_peers = counts > 0
+        last = np.maximum(len(pe_ratios) - 1, 0)
+
+        def at(index):
+            if len(pe_ratios) == 0:
+                return np.full(num_rows, np.nan)
+            return np.where(has_peers, pe_ratios[np.minimum(index, last)], np.nan)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.bincount(rows, pe_ratios, minlength=num_rows) / counts
+            median = (at(starts + (counts - 1) // 2) + at(starts + counts // 2)) / 2
+
+            # Trimmed mean: vị trí của peer trong nhóm đã sắp xếp
+            # Luôn giữ ít nhất một peer (peer ở giữa) khi trim_fraction >= 0.5
+            trim_fraction = np.clip(np.asarray(trim_fraction, dtype=float), 0.0, 0.5)
+            trim = np.clip(
+                np.floor(counts * trim_fraction).astype(np.int64),
+                0,
+                np.maximum((counts - 1) // 2, 0),
+            )
+            rank = np.arange(len(rows)) - starts[rows]
+            kept = (rank >= trim[rows]) & (rank < (counts - trim)[rows])
+            trimmed_mean = np.bincount(
+                rows[kept], pe_ratios[kept], minlength=num_rows
+            ) / (counts - 2 * trim)
+
+        earnings_per_share = np.asarray(earnings_per_share, dtype=float)
+        mean = np.where(has_peers, mean, np.nan)
+        trimmed_mean = np.where(has_peers, trimmed_mean, np.nan)
+        return {
+            "peer_count": counts,
+            "median_pe": median,
+            "mean_pe": mean,
+            "trimmed_mean_pe": trimmed_mean,
+            "min_pe": at(starts),
+            "max_pe": at(starts + counts - 1),
+            "value_median": median * earnings_per_share,
+            "value_mean": mean * earnings_per_share,
+            "value_trimmed_mean": trimmed_mean * earnings_per_share,
+        }
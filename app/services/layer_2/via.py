@@ -1,20 +1,135 @@
 import numpy as np
+import pandas as pd
 import math
+from collections import Counter
 from sklearn.ensemble import RandomForestRegressor, IsolationForest
 from sklearn.neural_network import MLPRegressor
 from sklearn.preprocessing import StandardScaler
+from sklearn.base import clone
 import random
+from app.services.layer_2.anomaly import AbnormalFeatureExtractor, AnomalyScorer
+from app.services.layer_2.consistency import ModelConsistencyEngine
+from app.services.layer_2.simulation import MonteCarloEngine
+from app.services.layer_2.valuation import BatchValuation
+from app.services.layer_3.forecasting import AutoregressiveForecaster
+from app.services.layer_3.sectors import SectorIndex
 
 
 class VIA:
-    def __init__(self):
+    # Các giá trị forecast_model chọn mô hình AR dạng đóng thay cho RandomForest
+    AUTOREGRESSIVE_MODELS = ("autoregressive", "ar")
+
+    # Các khoảng quét của chế độ kịch bản WACC
+    WACC_SCENARIO_RANGES = ("debt_to_equity_range", "beta_range", "tax_rate_range")
+
+    # Giới hạn kích thước lưới độ nhạy / kịch bản (số điểm mỗi trục, số ô của lưới)
+    SENSITIVITY_MAX_POINTS = 500
+    SENSITIVITY_MAX_CELLS = 50000
+
+    # Tên các đặc trưng của phân tích bất thường (dùng khi mô hình không có metadata)
+    ABNORMAL_FEATURES = (
+        "price_volatility",
+        "price_momentum",
+        "volume_change",
+        "pe_difference",
+        "pe_ratio",
+        "pb_ratio",
+        "debt_to_equity",
+    )
+
+    # Mô hình PE huấn luyện trên lược đồ example/training/pe.csv
+    PE_TARGET_COLUMN = "target_pe"
+
+    # Giá trị mặc định của các cột PE (giống các lời gọi .get của bản từng request)
+    PE_DEFAULTS = {
+        # Giá thiếu hoặc không phải số không được thay bằng 0: dòng đó không đánh giá
+        "price": np.nan,
+        "earnings": 0.0,
+        "revenue_growth": 0.0,
+        "earnings_growth": 0.0,
+        "projected_growth": 0.0,
+        "sector_avg_pe": 15.0,
+        "sector_avg_growth": 0.05,
+        "sector_high_pe": 25.0,
+        "sector_low_pe": 10.0,
+        "debt_to_equity": 1.0,
+        "current_ratio": 1.5,
+        "roe": 0.1,
+        "market_avg_pe": 18.0,
+    }
+
+    # Tên cột thay thế (lược đồ pe.csv) cho các cột PE
+    PE_COLUMN_ALIASES = {
+        "earnings": ("earnings", "earnings_per_share"),
+        "earnings_growth": ("earnings_growth", "earnings_growth_rate"),
+        "roe": ("roe", "return_on_equity"),
+    }
+
+    # Đặc trưng của mô hình PE -> cột PE tương ứng khi bảng không có sẵn đặc trưng đó
+    PE_MODEL_SOURCES = {
+        "earnings_per_share": "earnings",
+        "earnings_growth_rate": "earnings_growth",
+        "sector_avg_pe": "sector_avg_pe",
+        "market_avg_pe": "market_avg_pe",
+        "debt_to_equity": "debt_to_equity",
+        "return_on_equity": "roe",
+    }
+
+    def __init__(
+        self, model_registry=None, anomaly_model=None, pe_model=None, sector_index=None
+    ):
         self.scaler = StandardScaler()
+        # Registry các mô hình huấn luyện offline (layer 3), chỉ dùng để suy luận
+        self.model_registry = model_registry
+        # Thống kê ngành dựng từ thư mục data (layer 3), thay cho sector_data mặc định
+        self.sector_index = sector_index
         # Khởi tạo các model
         self.pe_neural_model = MLPRegressor(
             hidden_layer_sizes=(32, 16), activation="relu", max_iter=1000
         )
         self.dcf_model = RandomForestRegressor(n_estimators=100, random_state=42)
         self.abnormal_model = IsolationForest(contamination=0.1, random_state=42)
+        # Mô hình bất thường đã fit được nạp một lần khi khởi tạo (nếu có)
+        self.anomaly_scorer = None
+        self.anomaly_model_name = None
+        self.load_anomaly_model(anomaly_model)
+        # Mô hình PE đã huấn luyện (nếu có); nếu không, fair PE theo quy tắc tăng trưởng
+        self.pe_model_name = None
+        self.pe_feature_columns = None
+        self.pe_model_confidence = None
+        self.load_pe_model(pe_model)
+        self.feature_extractor = AbnormalFeatureExtractor()
+        self.monte_carlo = MonteCarloEngine()
+        self.valuation = BatchValuation()
+        self.consistency_engine = ModelConsistencyEngine()
+
+    def _sector_data(self, sector):
+        """Thống kê ngành (avg_pe, high_pe, low_pe, avg_growth, ...) từ sector index."""
+        if self.sector_index is None or sector is None or pd.isna(sector):
+            return {}
+        return self.sector_index.sector_data(sector)
+
+    def _fill_sector_columns(self, df, columns):
+        """
+        Điền các cột ngành còn thiếu (columns: tên cột -> khóa của _sector_data) theo
+        cột sector/industry, mỗi ngành chỉ tra cứu một lần.
+        """
+        key = next((c for c in ("sector", "industry") if c in df.columns), None)
+        if self.sector_index is None or key is None:
+            return df
+        lookup = {
+            sector: self._sector_data(sector) for sector in df[key].dropna().unique()
+        }
+        df = df.copy()
+        for column, stat in columns.items():
+            values = df[key].map(lambda sector: lookup.get(sector, {}).get(stat))
+            values = pd.to_numeric(values, errors="coerce")
+            df[column] = (
+                pd.to_numeric(df[column], errors="coerce").fillna(values)
+                if column in df.columns
+                else values
+            )
+        return df
 
     def run_abnormal(self, data):
         """
@@ -30,6 +145,30 @@ class VIA:
         abnormal_score = max(abs(x - mean) for x in values) / std if std > 0 else 0.0
         return round(abnormal_score, 4)
 
+    def run_abnormal_batch(self, df):
+        """
+        run_abnormal cho cả bảng: mọi ô số của mỗi dòng tạo thành một ma trận float
+        (ô không phải số là NaN), trung bình/độ lệch chuẩn/độ lệch lớn nhất được tính
+        theo dòng bằng NumPy. Trả về mảng điểm bất thường, giống run_abnormal từng dòng.
+        """
+        matrix = (
+            df.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+            if len(df.columns)
+            else np.empty((len(df), 0))
+        )
+        observed = ~np.isnan(matrix)
+        count = observed.sum(axis=1)
+        filled = np.where(observed, matrix, 0.0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = filled.sum(axis=1) / count
+            deviation = np.where(observed, np.abs(matrix - mean[:, None]), 0.0)
+            std = np.sqrt((deviation**2).sum(axis=1) / count)
+            score = np.where(
+                (count > 0) & (std > 0), deviation.max(axis=1, initial=0.0) / std, 0.0
+            )
+        return np.round(score, 4)
+
     def run_ai_driven_abnormal_finding(self, data):
         """
         Task 3: Phân tích bất thường dựa trên AI (Isolation Forest)
@@ -45,125 +184,300 @@ class VIA:
         phân loại mức độ và khuyến nghị
         """
         try:
-            # Trích xuất các đặc trưng
-            features = []
+            features = self._abnormal_features(data)
+            if "error" in features:
+                return features
+            if self.anomaly_scorer is None:
+                return {"error": "Chưa có mô hình phát hiện bất thường đã huấn luyện"}
 
-            # Giá và khối lượng
-            price_data = data.get("historical_prices", [])
-            volume_data = data.get("trading_volumes", [])
+            scores, labels = self.anomaly_scorer.score([features])
+            return self._abnormal_result(features, scores[0], labels[0])
 
-            if not price_data or len(price_data) < 10:
-                return {"error": "Không đủ dữ liệu giá lịch sử"}
+        except Exception as e:
+            return {"error": f"Lỗi khi phân tích bất thường: {str(e)}"}
 
-            # Tính các chỉ số kỹ thuật
-            price_changes = [
-                price_data[i + 1] - price_data[i] for i in range(len(price_data) - 1)
-            ]
-            price_volatility = np.std(price_changes) if price_changes else 0
-            price_momentum = sum(price_changes[-5:]) if len(price_changes) >= 5 else 0
-
-            # Volume anomalies
-            avg_volume = np.mean(volume_data) if volume_data else 0
-            recent_volume = volume_data[-1] if volume_data else 0
-            volume_change = (recent_volume / avg_volume - 1) if avg_volume > 0 else 0
-
-            # Tỷ lệ tài chính
-            financial_ratios = data.get("financial_ratios", {})
-            pe_ratio = financial_ratios.get("pe_ratio", 0)
-            pb_ratio = financial_ratios.get("pb_ratio", 0)
-            debt_to_equity = financial_ratios.get("debt_to_equity", 0)
-
-            # Dữ liệu ngành và thị trường để so sánh
-            sector_metrics = data.get("sector_metrics", {})
-            market_indicators = data.get("market_indicators", {})
-
-            sector_pe = sector_metrics.get("avg_pe", 15)
-            pe_difference = (
-                (pe_ratio / sector_pe - 1) if sector_pe > 0 and pe_ratio > 0 else 0
-            )
-
-            # Tạo vector đặc trưng
-            features = [
-                price_volatility,
-                price_momentum,
-                volume_change,
-                pe_difference,
-                pe_ratio,
-                pb_ratio,
-                debt_to_equity,
-            ]
+    async def run_ai_driven_abnormal_finding_async(self, data):
+        """
+        Giống run_ai_driven_abnormal_finding nhưng chấm điểm qua micro-batcher: các
+        request đồng thời dùng chung một lần gọi decision_function.
+        """
+        try:
+            features = self._abnormal_features(data)
+            if "error" in features:
+                return features
+            if self.anomaly_scorer is None:
+                return {"error": "Chưa có mô hình phát hiện bất thường đã huấn luyện"}
 
-            # Chuẩn hóa dữ liệu
-            features_array = np.array(features).reshape(1, -1)
+            score, label = await self.anomaly_scorer.score_async(features)
+            return self._abnormal_result(features, score, label)
 
-            # Phát hiện bất thường bằng Isolation Forest
-            anomaly_score = (
-                -1 * self.abnormal_model.decision_function(features_array)[0]
-            )
-            anomaly_label = self.abnormal_model.predict(features_array)[0]
+        except Exception as e:
+            return {"error": f"Lỗi khi phân tích bất thường: {str(e)}"}
 
-            # Phân loại mức độ bất thường
-            if anomaly_score > 0.8:
-                severity = "Cao"
-                recommendation = (
-                    "Cần theo dõi chặt chẽ và xem xét điều chỉnh chiến lược đầu tư"
-                )
-            elif anomaly_score > 0.6:
-                severity = "Trung bình"
-                recommendation = "Theo dõi sát và chuẩn bị các kịch bản dự phòng"
-            elif anomaly_score > 0.4:
-                severity = "Thấp"
-                recommendation = "Theo dõi các chỉ số trong danh sách bất thường"
+    async def run_streaming_abnormal_tick(self, detector, tick):
+        """
+        Phân tích bất thường cho một tick trong luồng: cập nhật trạng thái cửa sổ trượt
+        của mã (StreamingAnomalyDetector) và chấm điểm bằng cùng bộ đặc trưng với
+        run_ai_driven_abnormal_finding qua micro-batcher.
+        """
+        if tick.get("sector") and not tick.get("sector_metrics"):
+            tick = {**tick, "sector_metrics": self._sector_data(tick["sector"])}
+        try:
+            state, features = detector.push(tick)
+        except (KeyError, TypeError, ValueError) as e:
+            return {"error": f"Tick không hợp lệ: {str(e)}"}
+
+        ticker = tick["ticker"]
+        if features is None:
+            return {"ticker": ticker, "ticks": state.ticks, "status": "warming_up"}
+        if self.anomaly_scorer is None:
+            return {
+                "ticker": ticker,
+                "error": "Chưa có mô hình phát hiện bất thường đã huấn luyện",
+            }
+
+        try:
+            score, label = await self.anomaly_scorer.score_async(features)
+            return {
+                "ticker": ticker,
+                "ticks": state.ticks,
+                **self._abnormal_result(features, score, label),
+            }
+        except Exception as e:
+            return {
+                "ticker": ticker,
+                "error": f"Lỗi khi phân tích bất thường: {str(e)}",
+            }
+
+    def load_anomaly_model(self, model_name=None):
+        """
+        Nạp mô hình IsolationForest đã huấn luyện từ registry và giữ thường trú. Chỉ
+        nhận mô hình có feature_columns nằm trong bộ đặc trưng của request
+        (ABNORMAL_FEATURES): mô hình chỉ định theo tên mà không khớp sẽ báo lỗi, mặc
+        định lấy mô hình khớp mới nhất. Trả về tên mô hình hoặc None.
+        """
+        if self.model_registry is None:
+            return None
+        if model_name is None:
+            for candidate in self.model_registry.names("IsolationForest"):
+                if not self._anomaly_model_mismatch(candidate):
+                    model_name = candidate
+                    break
             else:
-                severity = "Không đáng kể"
-                recommendation = "Không cần hành động đặc biệt"
+                return None
+        else:
+            mismatch = self._anomaly_model_mismatch(model_name)
+            if mismatch:
+                raise ValueError(f"Mô hình {model_name} không dùng được: {mismatch}")
+
+        model = self.model_registry.get(model_name)
+        self.abnormal_model = model
+        self.anomaly_scorer = AnomalyScorer(
+            model, self._anomaly_feature_columns(model_name)
+        )
+        self.anomaly_model_name = model_name
+        return model_name
+
+    def _anomaly_feature_columns(self, model_name):
+        metadata = self.model_registry.metadata(model_name)
+        return metadata.get("feature_columns") or list(self.ABNORMAL_FEATURES)
+
+    def _anomaly_model_mismatch(self, model_name):
+        """Lý do mô hình không khớp với bộ đặc trưng của request, hoặc None."""
+        feature_columns = self._anomaly_feature_columns(model_name)
+        missing = [c for c in feature_columns if c not in self.ABNORMAL_FEATURES]
+        if missing:
+            return f"Missing feature columns: {missing}"
+        n_features = getattr(
+            self.model_registry.get(model_name), "n_features_in_", None
+        )
+        if n_features is not None and n_features != len(feature_columns):
+            return (
+                f"mô hình cần {n_features} đặc trưng, metadata có "
+                f"{len(feature_columns)}"
+            )
+        return None
 
-            # Xác định các loại bất thường cụ thể
-            anomalies_detected = []
+    def _abnormal_features(self, data):
+        """Trích xuất vector đặc trưng (theo tên) cho phân tích bất thường."""
+        price_data = data.get("historical_prices", [])
+        if not price_data or len(price_data) < 10:
+            return {"error": "Không đủ dữ liệu giá lịch sử"}
 
-            if price_volatility > np.mean(price_data) * 0.15:
-                anomalies_detected.append(
-                    {
-                        "type": "Biến động giá bất thường",
-                        "value": round(price_volatility, 4),
-                        "threshold": round(np.mean(price_data) * 0.15, 4),
-                    }
-                )
+        features = self._abnormal_feature_batch([data])
+        return {name: values[0].item() for name, values in features.items()}
 
-            if volume_change > 0.5:
-                anomalies_detected.append(
-                    {
-                        "type": "Khối lượng giao dịch bất thường",
-                        "value": round(volume_change, 4),
-                        "threshold": 0.5,
-                    }
+    def _abnormal_feature_batch(self, records):
+        """Đặc trưng bất thường cho danh sách dữ liệu (mỗi phần tử một mã)."""
+        prices, price_offsets = self.feature_extractor.ragged(
+            [r.get("historical_prices") or [] for r in records]
+        )
+        volumes, volume_offsets = self.feature_extractor.ragged(
+            [r.get("trading_volumes") or [] for r in records]
+        )
+        ratios = [r.get("financial_ratios", {}) for r in records]
+        return self.feature_extractor.extract(
+            prices,
+            price_offsets,
+            volumes,
+            volume_offsets,
+            pe_ratio=[f.get("pe_ratio", 0) for f in ratios],
+            pb_ratio=[f.get("pb_ratio", 0) for f in ratios],
+            debt_to_equity=[f.get("debt_to_equity", 0) for f in ratios],
+            sector_pe=[
+                r.get("sector_metrics", {}).get(
+                    "avg_pe", self._sector_data(r.get("sector")).get("avg_pe", 15)
                 )
+                for r in records
+            ],
+        )
 
-            if pe_difference > 0.3 or pe_difference < -0.3:
-                anomalies_detected.append(
-                    {
-                        "type": "Chênh lệch P/E so với ngành",
-                        "value": round(pe_difference, 4),
-                        "threshold": "±0.3",
-                    }
-                )
+    def run_ai_driven_abnormal_finding_batch(self, records):
+        """
+        Phân tích bất thường AI cho nhiều mã: trích xuất đặc trưng vector hóa cho toàn
+        bộ danh sách và chấm điểm bằng một lần gọi decision_function.
+        """
+        if self.anomaly_scorer is None:
+            return [
+                {"error": "Chưa có mô hình phát hiện bất thường đã huấn luyện"}
+            ] * len(records)
+        return self._score_abnormal_features(self._abnormal_feature_batch(records))
 
-            return {
-                "anomaly_score": round(anomaly_score, 4),
-                "is_anomaly": anomaly_label == -1,
-                "severity": severity,
-                "recommendation": recommendation,
-                "anomalies_detected": anomalies_detected,
-                "features_analyzed": {
-                    "price_volatility": round(price_volatility, 4),
-                    "price_momentum": round(price_momentum, 4),
-                    "volume_change": round(volume_change, 4),
-                    "pe_difference": round(pe_difference, 4),
-                },
-            }
+    def run_abnormal_table(self, df):
+        """
+        Phân tích bất thường AI cho bảng dạng dài: mỗi dòng là một phiên của một mã
+        (cột ticker, price, volume; tùy chọn pe_ratio, pb_ratio, debt_to_equity,
+        sector_pe lấy từ dòng đầu tiên của mỗi mã). Trả về một kết quả cho mỗi mã.
+        """
+        if self.anomaly_scorer is None:
+            return [{"error": "Chưa có mô hình phát hiện bất thường đã huấn luyện"}]
 
-        except Exception as e:
-            return {"error": f"Lỗi khi phân tích bất thường: {str(e)}"}
+        codes, tickers = pd.factorize(df["ticker"])
+        firsts = self._fill_sector_columns(
+            df.groupby(codes, sort=True).first(), {"sector_pe": "avg_pe"}
+        )
+        order = np.argsort(codes, kind="stable")  # giữ thứ tự thời gian trong mỗi mã
+        codes = codes[order]
+        n = len(tickers)
+
+        def ragged(column):
+            if column not in df.columns:
+                return np.empty(0), np.zeros(n + 1, dtype=np.int64)
+            values = pd.to_numeric(df[column], errors="coerce").to_numpy()[order]
+            observed = ~np.isnan(values)
+            counts = np.bincount(codes[observed], minlength=n)
+            return values[observed], np.concatenate([[0], np.cumsum(counts)])
+
+        def ratio(column, default):
+            if column not in firsts.columns:
+                return default
+            return pd.to_numeric(firsts[column], errors="coerce").fillna(default)
+
+        features = self.feature_extractor.extract(
+            *ragged("price"),
+            *ragged("volume"),
+            pe_ratio=ratio("pe_ratio", 0.0),
+            pb_ratio=ratio("pb_ratio", 0.0),
+            debt_to_equity=ratio("debt_to_equity", 0.0),
+            sector_pe=ratio("sector_pe", 15.0),
+        )
+        results = self._score_abnormal_features(features)
+        return [
+            {"ticker": ticker, **result} for ticker, result in zip(tickers, results)
+        ]
+
+    def _score_abnormal_features(self, features):
+        """Chấm điểm các mã đủ dữ liệu (>= 10 giá) trong một lần gọi mô hình."""
+        missing = self.anomaly_scorer.missing_features(features)
+        if missing:
+            return [{"error": f"Missing feature columns: {missing}"}] * len(
+                features["num_prices"]
+            )
+        valid = features["num_prices"] >= 10
+        scores = np.zeros(len(valid))
+        labels = np.ones(len(valid), dtype=int)
+        if valid.any():
+            X = self.anomaly_scorer.vectorize_columns(
+                {name: values[valid] for name, values in features.items()}
+            )
+            scores[valid], labels[valid] = self.anomaly_scorer.score_matrix(X)
+
+        results = []
+        for i in range(len(valid)):
+            if not valid[i]:
+                results.append({"error": "Không đủ dữ liệu giá lịch sử"})
+                continue
+            row = {name: values[i].item() for name, values in features.items()}
+            results.append(self._abnormal_result(row, scores[i], labels[i]))
+        return results
+
+    def _abnormal_result(self, features, anomaly_score, anomaly_label):
+        """Diễn giải điểm bất thường thành mức độ, khuyến nghị và các bất thường cụ thể."""
+        mean_price = features["mean_price"]
+        price_volatility = features["price_volatility"]
+        volume_change = features["volume_change"]
+        pe_difference = features["pe_difference"]
+
+        # Phân loại mức độ bất thường
+        if anomaly_score > 0.8:
+            severity = "Cao"
+            recommendation = (
+                "Cần theo dõi chặt chẽ và xem xét điều chỉnh chiến lược đầu tư"
+            )
+        elif anomaly_score > 0.6:
+            severity = "Trung bình"
+            recommendation = "Theo dõi sát và chuẩn bị các kịch bản dự phòng"
+        elif anomaly_score > 0.4:
+            severity = "Thấp"
+            recommendation = "Theo dõi các chỉ số trong danh sách bất thường"
+        else:
+            severity = "Không đáng kể"
+            recommendation = "Không cần hành động đặc biệt"
+
+        # Xác định các loại bất thường cụ thể
+        anomalies_detected = []
+
+        if price_volatility > mean_price * 0.15:
+            anomalies_detected.append(
+                {
+                    "type": "Biến động giá bất thường",
+                    "value": round(price_volatility, 4),
+                    "threshold": round(mean_price * 0.15, 4),
+                }
+            )
+
+        if volume_change > 0.5:
+            anomalies_detected.append(
+                {
+                    "type": "Khối lượng giao dịch bất thường",
+                    "value": round(volume_change, 4),
+                    "threshold": 0.5,
+                }
+            )
+
+        if pe_difference > 0.3 or pe_difference < -0.3:
+            anomalies_detected.append(
+                {
+                    "type": "Chênh lệch P/E so với ngành",
+                    "value": round(pe_difference, 4),
+                    "threshold": "±0.3",
+                }
+            )
+
+        return {
+            "anomaly_score": round(float(anomaly_score), 4),
+            "is_anomaly": bool(anomaly_label == -1),
+            "severity": severity,
+            "recommendation": recommendation,
+            "anomalies_detected": anomalies_detected,
+            "features_analyzed": {
+                "price_volatility": round(price_volatility, 4),
+                "price_momentum": round(features["price_momentum"], 4),
+                "volume_change": round(volume_change, 4),
+                "pe_difference": round(pe_difference, 4),
+            },
+            "model_name": self.anomaly_model_name,
+        }
 
     def run_consistency(self, data):
         """
@@ -172,10 +486,66 @@ class VIA:
         values = [v for v in data.values() if isinstance(v, (int, float, str))]
         if not values:
             return 1.0
-        most_common = max(set(values), key=values.count)
-        consistency_index = values.count(most_common) / len(values)
+        # Đếm tần suất bằng bảng băm, O(n)
+        _, most_common_count = Counter(values).most_common(1)[0]
+        consistency_index = most_common_count / len(values)
         return round(consistency_index, 4)
 
+    def run_consistency_batch(self, df, exclude_comparables=True):
+        """
+        run_consistency cho cả bảng: mỗi ô được mã hóa thành số nguyên (số và chuỗi
+        được mã hóa riêng, ô trống là chuỗi rỗng như khi đọc CSV từng dòng), sau đó
+        sắp xếp từng dòng và lấy độ dài dãy giá trị bằng nhau dài nhất làm tần suất
+        của mode. Trả về mảng chỉ số consistency.
+
+        exclude_comparables: bỏ các cột comparable_name_* / comparable_pe_* như task
+        Consistency từng dòng (đã gom chúng thành danh sách); task Model Consistency
+        từng dòng giữ chúng như mọi cột khác.
+        """
+        columns = [
+            c
+            for c in df.columns
+            if not self._is_consistency_metadata(c, exclude_comparables)
+        ]
+        n, width = len(df), len(columns)
+        if width == 0:
+            return np.ones(n)
+
+        numbers = np.full((n, width), np.nan)
+        strings = np.empty((n, width), dtype=object)
+        for j, column in enumerate(columns):
+            series = df[column]
+            if pd.api.types.is_bool_dtype(series):
+                # CSV từng dòng giữ "True"/"False" dưới dạng chuỗi
+                strings[:, j] = series.astype(str).to_numpy()
+                continue
+            numeric = pd.to_numeric(series, errors="coerce").to_numpy(dtype=float)
+            numbers[:, j] = numeric
+            strings[:, j] = series.fillna("").astype(str).to_numpy()
+
+        is_number = ~np.isnan(numbers)
+        codes = np.empty((n, width), dtype=np.int64)
+        number_codes, number_uniques = pd.factorize(numbers[is_number])
+        codes[is_number] = number_codes
+        codes[~is_number] = pd.factorize(strings[~is_number])[0] + len(number_uniques)
+
+        # Tần suất mode của mỗi dòng = độ dài dãy bằng nhau dài nhất sau khi sắp xếp
+        ordered = np.sort(codes, axis=1)
+        index = np.arange(width)
+        starts = np.ones((n, width), dtype=bool)
+        starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+        run_start = np.maximum.accumulate(np.where(starts, index, 0), axis=1)
+        mode_count = (index - run_start + 1).max(axis=1)
+        return np.round(mode_count / width, 4)
+
+    def _is_consistency_metadata(self, column, exclude_comparables=True):
+        # Cột metadata của request không được tính vào consistency
+        name = str(column)
+        return name in ("task", "model_type") or (
+            exclude_comparables
+            and name.startswith(("comparable_name_", "comparable_pe_"))
+        )
+
     def run_ai_driven_model_consistency(self, data):
         """
         Task 4: Tính toán AI driven cho Model Consistency
@@ -216,8 +586,9 @@ class VIA:
             for model, predictions in model_predictions.items():
                 # Tính điểm dựa trên độ đồng nhất nội bộ mô hình
                 if isinstance(predictions, list) and len(predictions) > 1:
+                    mean = np.mean(predictions)
                     internal_consistency = 1.0 - np.std(predictions) / (
-                        np.mean(predictions) if np.mean(predictions) != 0 else 1
+                        mean if mean != 0 else 1
                     )
                 else:
                     internal_consistency = 1.0
@@ -292,6 +663,101 @@ class VIA:
         except Exception as e:
             return {"error": f"Lỗi khi phân tích độ đồng nhất mô hình: {str(e)}"}
 
+    def run_model_consistency_batch(self, data):
+        """
+        Model Consistency cho nhiều mã cùng lúc.
+
+        Đầu vào:
+        - prediction_tensor: dự đoán dạng (mã × mô hình × kỳ dự báo)
+        - models: tên các mô hình theo trục thứ hai
+        - instruments: tên các mã theo trục thứ nhất (tùy chọn)
+        - model_weights, historical_accuracy: dict theo tên mô hình hoặc list theo
+          thứ tự models
+        - metric_values: {chỉ tiêu: {mô hình: [giá trị theo mã]}} (tùy chọn)
+        - market_conditions: Điều kiện thị trường hiện tại
+
+        Đầu ra: kết quả cho từng mã cùng định dạng run_ai_driven_model_consistency,
+        cộng thêm dự đoán có trọng số theo từng kỳ.
+        """
+        try:
+            predictions = np.asarray(data.get("prediction_tensor", []), dtype=float)
+            if predictions.ndim == 2:
+                predictions = predictions[:, :, np.newaxis]
+            if predictions.ndim != 3 or predictions.size == 0:
+                return {
+                    "error": "prediction_tensor phải có dạng (mã × mô hình × kỳ dự báo)"
+                }
+            num_instruments, num_models, _ = predictions.shape
+
+            models = list(
+                data.get("models") or [f"model_{i}" for i in range(num_models)]
+            )
+            if len(models) != num_models:
+                return {"error": "Số tên mô hình không khớp với prediction_tensor"}
+            instruments = list(data.get("instruments") or range(num_instruments))
+
+            def per_model(values, default):
+                if isinstance(values, dict):
+                    return [values.get(model, default) for model in models]
+                return values if values else None
+
+            metric_values = {
+                metric: np.column_stack(
+                    [
+                        np.asarray(
+                            by_model.get(model, np.full(num_instruments, np.nan)),
+                            dtype=float,
+                        )
+                        for model in models
+                    ]
+                )
+                for metric, by_model in (data.get("metric_values") or {}).items()
+            }
+
+            result = self.consistency_engine.evaluate(
+                predictions,
+                weights=per_model(data.get("model_weights"), 1.0),
+                historical_accuracy=per_model(data.get("historical_accuracy"), np.nan),
+                metric_values=metric_values,
+            )
+            overall = result["overall_consistency"]
+            recommendations = self.consistency_engine.recommend(overall)
+            scores = np.round(result["model_scores"], 4)
+            horizons = np.round(result["weighted_horizons"], 4)
+            metrics = {
+                name: np.round(values, 4)
+                for name, values in result["weighted_metrics"].items()
+            }
+            market_conditions = data.get("market_conditions", "neutral")
+
+            def clean(value):
+                return None if np.isnan(value) else float(value)
+
+            return {
+                "models": models,
+                "model_weights": dict(zip(models, result["weights"].round(4).tolist())),
+                "results": [
+                    {
+                        "instrument": instruments[i],
+                        "overall_consistency_score": clean(round(overall[i], 4)),
+                        "model_scores": dict(zip(models, scores[i].tolist())),
+                        "best_model": models[result["best_model"][i]],
+                        "weighted_predictions": {
+                            name: clean(values[i])
+                            for name, values in metrics.items()
+                            if not np.isnan(values[i])
+                        },
+                        "weighted_horizon_predictions": [clean(v) for v in horizons[i]],
+                        "recommendation": str(recommendations[i]),
+                        "market_conditions": market_conditions,
+                    }
+                    for i in range(num_instruments)
+                ],
+            }
+
+        except Exception as e:
+            return {"error": f"Lỗi khi phân tích độ đồng nhất mô hình: {str(e)}"}
+
     def run_dcf(self, data):
         """
         Xử lý DCF: Tính giá trị hiện tại ròng (Discounted Cash Flow).
@@ -306,6 +772,242 @@ class VIA:
         )
         return round(dcf, 2)
 
+    def run_dcf_batch(self, df):
+        """
+        Xử lý DCF theo lô: mỗi dòng của DataFrame là một công ty.
+        Dòng tiền lấy từ cột cash_flows/free_cash_flow (list hoặc số) hoặc các cột
+        fcf_1..fcf_T; cùng với discount_rate, terminal_growth_rate,
+        shares_outstanding, net_debt. Toàn bộ bảng được tính trong một lần gọi kernel.
+
+        Nếu có cột forecast_years, dòng tiền của mỗi công ty được nối thêm số năm dự
+        báo tương ứng từ mô hình đã đăng ký (theo cột sector nếu có), dự báo cho cả
+        bảng trong một lần gọi predict cho mỗi ngành. Dòng có forecast_model là
+        "autoregressive" dùng hệ số của mô hình AR panel đã huấn luyện cho mã (cột
+        ticker) nếu có, nếu không thì mô hình AR dạng đóng fit trên chính lịch sử.
+        """
+        inputs = self.valuation.dcf_inputs(df)
+        if "forecast_years" in df.columns:
+            inputs["cash_flows"] = self._extend_with_forecast(inputs["cash_flows"], df)
+        values = self.valuation.dcf(**inputs)
+
+        results = []
+        for i in range(len(df)):
+            result = {}
+            for key, column in values.items():
+                value = column[i]
+                result[key] = round(float(value), 2) if np.isfinite(value) else None
+            results.append(result)
+        return results
+
+    def _autoregressive_panel(self, ticker):
+        """Mô hình AR panel mới nhất đã huấn luyện cho mã ticker, hoặc None."""
+        if self.model_registry is None or ticker is None or pd.isna(ticker):
+            return None
+        return self.model_registry.get_panel(ticker)
+
+    def _extend_with_forecast(self, cash_flows, df):
+        """
+        Nối dòng tiền dự báo vào ma trận dòng tiền (N x T) theo forecast_years của
+        từng dòng. Dòng không có mô hình hoặc không đủ lịch sử giữ nguyên.
+        """
+        years = (
+            pd.to_numeric(df["forecast_years"], errors="coerce")
+            .fillna(0)
+            .clip(lower=0)
+            .astype(int)
+            .to_numpy()
+        )
+        steps = int(years.max(initial=0))
+        if steps == 0:
+            return cash_flows
+
+        # Dồn dữ liệu về bên trái để lấy cửa sổ lịch sử gần nhất của từng dòng
+        observed = ~np.isnan(cash_flows)
+        order = np.argsort(~observed, axis=1, kind="stable")
+        packed = np.take_along_axis(cash_flows, order, axis=1)
+
+        forecast = np.full((len(cash_flows), steps), np.nan)
+        models = (
+            df["forecast_model"].fillna("random_forest").astype(str).str.lower()
+            if "forecast_model" in df.columns
+            else pd.Series("random_forest", index=df.index)
+        ).to_numpy()
+        autoregressive = np.isin(models, self.AUTOREGRESSIVE_MODELS)
+        if autoregressive.any():
+            rows = np.flatnonzero(autoregressive)
+            tickers = (
+                df["ticker"].to_numpy()[rows]
+                if "ticker" in df.columns
+                else np.full(len(rows), None)
+            )
+            # Mã đã có trong mô hình AR panel đã huấn luyện dùng hệ số đã lưu,
+            # gom theo mô hình để dự báo mỗi panel trong một lần gọi
+            panels = {}
+            for i, ticker in enumerate(tickers):
+                panel = self._autoregressive_panel(ticker)
+                if panel is not None:
+                    panels.setdefault(id(panel), (panel, []))[1].append(i)
+            served = np.zeros(len(rows), dtype=bool)
+            for panel, members in panels.values():
+                members = np.asarray(members)
+                projection, r2 = panel.forecast_histories(
+                    packed[rows[members]], tickers[members], steps
+                )
+                fitted = ~np.isnan(r2)
+                forecast[rows[members[fitted]]] = projection[fitted]
+                served[members[fitted]] = True
+            # Các dòng AR còn lại được fit và dự báo cùng lúc
+            refit = rows[~served]
+            if len(refit):
+                forecast[refit] = AutoregressiveForecaster().fit_forecast(
+                    packed[refit], steps
+                )[0]
+
+        sectors = (
+            df["sector"].fillna("default").astype(str).to_numpy()
+            if "sector" in df.columns
+            else np.full(len(df), "default")
+        )
+        for sector in np.unique(sectors[~autoregressive]):
+            forecaster = (
+                self.model_registry.best_forecaster(sector, steps=steps)
+                if self.model_registry is not None
+                else None
+            )
+            if forecaster is None:
+                continue
+            rows = np.flatnonzero((sectors == sector) & ~autoregressive)
+            forecast[rows] = forecaster.forecast_batch(packed[rows], steps=steps)
+
+        # Chỉ giữ số năm dự báo mà từng dòng yêu cầu
+        forecast[np.arange(steps)[None, :] >= years[:, None]] = np.nan
+
+        # Dự báo nối tiếp ngay sau kỳ cuối cùng có dữ liệu của từng dòng
+        periods = cash_flows.shape[1]
+        last_index = periods - 1 - np.argmax(observed[:, ::-1], axis=1)
+        extended = np.hstack([cash_flows, np.full((len(cash_flows), steps), np.nan)])
+        columns = last_index[:, None] + 1 + np.arange(steps)
+        np.put_along_axis(extended, columns, forecast, axis=1)
+        return extended
+
+    def run_dcf_sensitivity(self, data):
+        """
+        Bảng độ nhạy DCF theo WACC và tăng trưởng dài hạn
+
+        Đầu vào:
+        - Dữ liệu DCF như task DCF: historical_cash_flows + financial_statements (dự
+          phóng bằng run_ai_driven_dcf) hoặc cash_flows/free_cash_flow (dùng trực tiếp)
+        - wacc_range, growth_range (tùy chọn): {"start", "stop", "step"} hoặc danh sách
+          giá trị; mặc định là WACC cơ sở ± 2% và tăng trưởng cơ sở ± 1%
+        - market_price (tùy chọn): Giá thị trường mỗi cổ phiếu để tính đường hòa vốn
+
+        Đầu ra: JSON chứa ma trận giá trị (WACC x tăng trưởng) và đường hòa vốn
+        """
+        try:
+            if data.get("historical_cash_flows") and data.get("financial_statements"):
+                # Dự phóng dòng tiền một lần, dùng chung cho toàn bộ lưới
+                projection = self.run_ai_driven_dcf(data)
+                if "error" in projection:
+                    return projection
+                cash_flows = projection["projected_cash_flows"]
+                base_wacc = projection["wacc"]
+                base_growth = data.get("industry_data", {}).get(
+                    "long_term_growth", 0.02
+                )
+                balance_sheet = data.get("balance_sheet", {})
+                net_debt = balance_sheet.get("total_debt", 0) - balance_sheet.get(
+                    "cash_equivalents", 0
+                )
+                shares = balance_sheet.get("outstanding_shares", 1000000)
+                methodology = projection["methodology"]
+            else:
+                cash_flows = data.get("cash_flows", data.get("free_cash_flow", []))
+                if not isinstance(cash_flows, list) or not cash_flows:
+                    return {"error": "Không có dữ liệu dòng tiền"}
+                base_wacc = data.get("discount_rate", 0.1)
+                base_growth = data.get("terminal_growth_rate", 0.02)
+                net_debt = data.get("net_debt", 0)
+                shares = data.get("shares_outstanding")
+                methodology = "Traditional DCF"
+
+            try:
+                wacc_values = self._sensitivity_axis(
+                    data.get("wacc_range"), base_wacc, 0.02, 0.005
+                )
+                growth_values = self._sensitivity_axis(
+                    data.get("growth_range"), base_growth, 0.01, 0.0025
+                )
+                self._check_grid_size(wacc_values, growth_values)
+            except ValueError as e:
+                return {"error": str(e)}
+            grid = self.valuation.dcf_sensitivity(
+                cash_flows, wacc_values, growth_values, net_debt, shares
+            )
+
+            def to_matrix(values):
+                if values is None:
+                    return None
+                return [
+                    [round(float(v), 2) if np.isfinite(v) else None for v in row]
+                    for row in values
+                ]
+
+            result = {
+                "wacc_values": [round(float(w), 6) for w in wacc_values],
+                "terminal_growth_values": [round(float(g), 6) for g in growth_values],
+                "projected_cash_flows": [round(float(cf), 2) for cf in cash_flows],
+                "enterprise_value": to_matrix(grid["enterprise_value"]),
+                "equity_value_per_share": to_matrix(grid["equity_value_per_share"]),
+                "base_case": {"wacc": base_wacc, "terminal_growth": base_growth},
+                "methodology": methodology,
+            }
+
+            market_price = data.get("market_price")
+            if market_price is not None and grid["equity_value_per_share"] is not None:
+                result["breakeven_contour"] = self.valuation.breakeven_contour(
+                    grid["equity_value_per_share"],
+                    wacc_values,
+                    growth_values,
+                    market_price,
+                )
+            return result
+
+        except Exception as e:
+            return {"error": f"Lỗi khi tính độ nhạy DCF: {str(e)}"}
+
+    def _sensitivity_axis(self, spec, base, half_width, step):
+        """
+        Tạo trục giá trị của lưới độ nhạy từ danh sách hoặc {"start", "stop", "step"}.
+        Trục có quá SENSITIVITY_MAX_POINTS điểm bị từ chối trước khi cấp phát.
+        """
+        if isinstance(spec, list) and spec:
+            count = len(spec)
+        else:
+            spec = spec or {}
+            start = float(spec.get("start", base - half_width))
+            stop = float(spec.get("stop", base + half_width))
+            step = float(spec.get("step", step))
+            if not np.isfinite([start, stop, step]).all() or step <= 0 or stop < start:
+                raise ValueError("Khoảng giá trị độ nhạy không hợp lệ")
+            count = int(round((stop - start) / step)) + 1
+        if count > self.SENSITIVITY_MAX_POINTS:
+            raise ValueError(
+                f"Trục độ nhạy có {count} điểm, vượt quá giới hạn "
+                f"{self.SENSITIVITY_MAX_POINTS} điểm"
+            )
+        if isinstance(spec, list):
+            return np.asarray(spec, dtype=float)
+        return start + step * np.arange(count)
+
+    def _check_grid_size(self, *axes):
+        """Từ chối lưới có quá SENSITIVITY_MAX_CELLS ô (tích số điểm các trục)."""
+        cells = math.prod(len(axis) for axis in axes)
+        if cells > self.SENSITIVITY_MAX_CELLS:
+            raise ValueError(
+                f"Lưới độ nhạy có {cells} ô, vượt quá giới hạn "
+                f"{self.SENSITIVITY_MAX_CELLS} ô"
+            )
+
     def calculate_wacc(self, data):
         """
         Tính Weighted Average Cost of Capital (WACC)
@@ -346,6 +1048,133 @@ class VIA:
 
         return round(wacc, 4)
 
+    def run_wacc(self, data):
+        """
+        Task WACC: Tính WACC và các thành phần của nó
+
+        Đầu vào: Các trường như calculate_wacc (equity_value, debt_value, risk_free_rate,
+        market_return, beta, cost_of_debt, tax_rate) và tùy chọn chế độ kịch bản:
+        - scenario: True để quét cấu trúc vốn và tìm cấu trúc có WACC nhỏ nhất
+        - debt_to_equity_range, beta_range (beta không vay nợ), tax_rate_range:
+          {"start", "stop", "step"} hoặc danh sách giá trị
+        - debt_spread_curve: {"debt_to_equity": [...], "spread": [...]}
+
+        Đầu ra: JSON chứa WACC, các thành phần và (nếu có) kết quả kịch bản
+        """
+        try:
+            result = self.run_wacc_batch(pd.DataFrame([data]))[0]
+            if data.get("scenario") or any(
+                key in data for key in self.WACC_SCENARIO_RANGES
+            ):
+                result["scenario"] = self.run_capital_structure_scenarios(data)
+            return result
+        except Exception as e:
+            return {"error": f"Lỗi khi tính WACC: {str(e)}"}
+
+    def run_wacc_batch(self, df):
+        """
+        Xử lý WACC theo lô: mỗi dòng của DataFrame là một công ty, tính trong một lần
+        gọi kernel. Dòng có optimize_structure khác 0 được bổ sung cấu trúc vốn tối ưu
+        (quét D/E mặc định, beta tái đòn bẩy theo Hamada).
+        """
+        inputs = self.valuation.wacc_inputs(df)
+        values = self.valuation.wacc(**inputs)
+
+        results = []
+        for i in range(len(df)):
+            results.append(
+                {
+                    key: round(float(column[i]), 4) if np.isfinite(column[i]) else None
+                    for key, column in values.items()
+                }
+            )
+
+        if "optimize_structure" in df.columns:
+            flags = pd.to_numeric(df["optimize_structure"], errors="coerce")
+            rows = np.flatnonzero(flags.fillna(0).to_numpy() != 0)
+            if rows.size:
+                equity, debt = inputs["equity_value"], inputs["debt_value"]
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    current = np.where(equity > 0, debt / equity, 0.0)
+                beta_u = self.valuation.unlevered_beta(
+                    inputs["beta"], current, inputs["tax_rate"]
+                )
+                best = self.valuation.optimal_capital_structure(
+                    self._sensitivity_axis(None, 1.5, 1.5, 0.05),
+                    beta_u[rows],
+                    inputs["tax_rate"][rows],
+                    inputs["risk_free_rate"][rows],
+                    inputs["market_return"][rows],
+                )
+                for j, i in enumerate(rows):
+                    results[i]["optimal_structure"] = self._structure_record(best, j)
+        return results
+
+    def run_capital_structure_scenarios(self, data):
+        """
+        Quét cấu trúc vốn: với mỗi cặp (beta không vay nợ, thuế suất), tìm tỷ lệ D/E
+        có WACC nhỏ nhất. Toàn bộ lưới D/E x beta x thuế được tính trong một lần gọi.
+        """
+        inputs = {
+            key: float(data.get(key, default))
+            for key, default in self.valuation.WACC_DEFAULTS.items()
+        }
+        equity, debt = inputs["equity_value"], inputs["debt_value"]
+        tax = inputs["tax_rate"]
+        current = debt / equity if equity > 0 else 0.0
+        base_beta_u = float(self.valuation.unlevered_beta(inputs["beta"], current, tax))
+
+        de_values = self._sensitivity_axis(
+            data.get("debt_to_equity_range"), 1.5, 1.5, 0.05
+        )
+        if (de_values < 0).any():
+            raise ValueError("Tỷ lệ D/E không được âm")
+        beta_values = self._sensitivity_axis(
+            data.get("beta_range"), base_beta_u, 0.2, 0.1
+        )
+        tax_values = self._sensitivity_axis(data.get("tax_rate_range"), tax, 0.0, 0.01)
+        self._check_grid_size(de_values, beta_values, tax_values)
+
+        # Dòng 0 là kịch bản cơ sở, các dòng sau là tích Descartes beta x thuế
+        betas, taxes = np.meshgrid(beta_values, tax_values, indexing="ij")
+        best = self.valuation.optimal_capital_structure(
+            de_values,
+            np.concatenate([[base_beta_u], betas.ravel()]),
+            np.concatenate([[tax], taxes.ravel()]),
+            inputs["risk_free_rate"],
+            inputs["market_return"],
+            data.get("debt_spread_curve"),
+        )
+
+        return {
+            "current_debt_to_equity": round(current, 4),
+            "unlevered_beta": round(base_beta_u, 4),
+            "debt_to_equity_values": [round(float(v), 6) for v in de_values],
+            "wacc_curve": [round(float(w), 6) for w in best["wacc_curve"][0]],
+            "optimal_structure": self._structure_record(best, 0),
+            "scenarios": [
+                {
+                    "unlevered_beta": round(float(b), 6),
+                    "tax_rate": round(float(t), 6),
+                    **self._structure_record(best, i + 1),
+                }
+                for i, (b, t) in enumerate(zip(betas.ravel(), taxes.ravel()))
+            ],
+        }
+
+    def _structure_record(self, best, i):
+        return {
+            key: round(float(best[key][i]), 4)
+            for key in (
+                "debt_to_equity",
+                "debt_weight",
+                "levered_beta",
+                "cost_of_equity",
+                "cost_of_debt",
+                "wacc",
+            )
+        }
+
     def run_ai_driven_dcf(self, data):
         """
         Task 1: Tính toán AI driven DCF và WACC
@@ -357,6 +1186,13 @@ class VIA:
         - industry_data: Dữ liệu ngành
         - market_data: Dữ liệu thị trường
         - balance_sheet: Bảng cân đối kế toán
+        - sector (tùy chọn): Ngành, dùng để chọn mô hình dự báo đã đăng ký
+        - fit_per_request (tùy chọn): True để fit mô hình ngay trong request thay vì
+          dùng mô hình huấn luyện sẵn
+        - forecast_model (tùy chọn): "random_forest" (mặc định) hoặc "autoregressive"
+          (mô hình AR bình phương tối thiểu, ar_order mặc định 1)
+        - ticker (tùy chọn): Mã cổ phiếu; với forecast_model="autoregressive", hệ số
+          của mô hình AR panel đã huấn luyện cho mã này được dùng thay vì fit lại
 
         Đầu ra: JSON chứa thông tin về DCF, WACC, và dự báo dòng tiền
         """
@@ -385,34 +1221,61 @@ class VIA:
 
             wacc = self.calculate_wacc(wacc_data)
 
-            # Tạo các features cho AI model
-            features = []
-            target = []
-
-            # Chuẩn bị dữ liệu cho mô hình học
-            for i in range(len(historical_cash_flows) - 1):
-                # Lấy 3 giá trị dòng tiền liên tiếp làm đặc trưng
-                if i + 3 <= len(historical_cash_flows):
-                    feature = [
-                        historical_cash_flows[i],
-                        historical_cash_flows[i + 1],
-                        historical_cash_flows[i + 2],
-                    ]
-
-                    # Thêm các đặc trưng khác
-                    feature.append(growth_rates.get("revenue_growth", 0.05))
-                    feature.append(growth_rates.get("profit_margin", 0.1))
-                    feature.append(industry_data.get("industry_growth", 0.03))
-                    feature.append(market_data.get("gdp_growth", 0.02))
-
-                    features.append(feature)
-
-                    # Giá trị tiếp theo là mục tiêu dự đoán
-                    if i + 3 < len(historical_cash_flows):
-                        target.append(historical_cash_flows[i + 3])
+            # Chọn cách dự báo dòng tiền: AR dạng đóng (forecast_model="autoregressive"),
+            # mô hình huấn luyện sẵn (mặc định), fit trong request (chỉ khi được yêu cầu
+            # rõ ràng) hoặc tăng trưởng truyền thống
+            forecast_model = str(data.get("forecast_model", "random_forest")).lower()
+            fit_per_request = bool(data.get("fit_per_request", False))
+            sector = data.get("sector", industry_data.get("sector", "default"))
+            forecaster = None
+            if (
+                forecast_model not in self.AUTOREGRESSIVE_MODELS
+                and not fit_per_request
+                and self.model_registry is not None
+            ):
+                forecaster = self.model_registry.best_forecaster(sector, steps=5)
+
+            forecast_mode = "growth"
+            if forecast_model in self.AUTOREGRESSIVE_MODELS:
+                # Hệ số đã huấn luyện cho mã (AutoregressivePanel) nếu có, nếu không
+                # thì fit AR trên chính lịch sử của request
+                ticker = data.get("ticker")
+                panel = self._autoregressive_panel(ticker)
+                r2 = [np.nan]
+                if panel is not None:
+                    projection, r2 = panel.forecast_histories(
+                        [historical_cash_flows], [ticker], 5
+                    )
+                    ar_mode = "autoregressive_panel"
+                if np.isnan(r2[0]):
+                    ar_model = AutoregressiveForecaster(
+                        order=int(data.get("ar_order", 1))
+                    )
+                    projection, r2 = ar_model.fit_forecast([historical_cash_flows], 5)
+                    ar_mode = "autoregressive"
+                if not np.isnan(r2[0]):
+                    projected_cash_flows = [round(float(cf), 2) for cf in projection[0]]
+                    ai_confidence = float(r2[0])
+                    forecast_mode = ar_mode
+            elif forecaster is not None and len(historical_cash_flows) >= (
+                forecaster.window
+            ):
+                # Chỉ suy luận trên mô hình đã nạp sẵn, không thay đổi trạng thái mô hình
+                projected_cash_flows = [
+                    round(cf, 2)
+                    for cf in forecaster.forecast(historical_cash_flows, steps=5)
+                ]
+                ai_confidence = forecaster.metrics.get("r2_score", 0)
+                forecast_mode = "pretrained"
+            elif fit_per_request:
+                projected_cash_flows, ai_confidence = self._fit_and_forecast_dcf(
+                    historical_cash_flows, growth_rates, industry_data, market_data
+                )
+                if projected_cash_flows is not None:
+                    forecast_mode = "per_request_fit"
 
-            if not features or not target:
-                # Nếu không đủ dữ liệu cho AI, sử dụng phương pháp truyền thống
+            if forecast_mode == "growth":
+                # Nếu không có mô hình AI, sử dụng phương pháp truyền thống
                 last_cash_flow = historical_cash_flows[-1]
                 projected_growth = growth_rates.get("projected_growth", 0.05)
 
@@ -422,61 +1285,23 @@ class VIA:
                     projected_cf = last_cash_flow * (1 + projected_growth) ** i
                     projected_cash_flows.append(round(projected_cf, 2))
 
-                # Tính terminal value (Gordon Growth Model)
-                terminal_growth = industry_data.get("long_term_growth", 0.02)
-                terminal_value = (
-                    projected_cash_flows[-1]
-                    * (1 + terminal_growth)
-                    / (wacc - terminal_growth)
-                )
-
-                # Tính DCF
-                dcf_value = 0
-                for i, cf in enumerate(projected_cash_flows, start=1):
-                    dcf_value += cf / ((1 + wacc) ** i)
-
-                # Thêm terminal value
-                dcf_value += terminal_value / ((1 + wacc) ** len(projected_cash_flows))
-
                 ai_confidence = 0  # Không dùng AI
-            else:
-                # Huấn luyện mô hình
-                self.dcf_model.fit(features, target)
-
-                # Dự báo dòng tiền tương lai
-                last_features = features[-1][1:] + [
-                    growth_rates.get("projected_growth", 0.05)
-                ]
-
-                projected_cash_flows = []
-                current_feature = last_features
-
-                for i in range(5):  # Dự đoán 5 năm tiếp theo
-                    prediction = self.dcf_model.predict([current_feature])[0]
-                    projected_cash_flows.append(round(prediction, 2))
 
-                    # Cập nhật features cho lần dự đoán tiếp theo
-                    current_feature = current_feature[1:] + [prediction]
-
-                # Tính terminal value
-                terminal_growth = industry_data.get("long_term_growth", 0.02)
-                terminal_value = (
-                    projected_cash_flows[-1]
-                    * (1 + terminal_growth)
-                    / (wacc - terminal_growth)
-                )
-
-                # Tính DCF
-                dcf_value = 0
-                for i, cf in enumerate(projected_cash_flows, start=1):
-                    dcf_value += cf / ((1 + wacc) ** i)
+            # Tính terminal value (Gordon Growth Model)
+            terminal_growth = industry_data.get("long_term_growth", 0.02)
+            terminal_value = (
+                projected_cash_flows[-1]
+                * (1 + terminal_growth)
+                / (wacc - terminal_growth)
+            )
 
-                # Thêm terminal value
-                dcf_value += terminal_value / ((1 + wacc) ** len(projected_cash_flows))
+            # Tính DCF
+            dcf_value = 0
+            for i, cf in enumerate(projected_cash_flows, start=1):
+                dcf_value += cf / ((1 + wacc) ** i)
 
-                # Đánh giá độ tin cậy của mô hình
-                # Đối với RandomForestRegressor, ta có thể dùng R²
-                ai_confidence = self.dcf_model.score(features, target)
+            # Thêm terminal value
+            dcf_value += terminal_value / ((1 + wacc) ** len(projected_cash_flows))
 
             # Tính tổng giá trị công ty
             outstanding_shares = balance_sheet.get("outstanding_shares", 1000000)
@@ -507,13 +1332,74 @@ class VIA:
                     for i in range(1, len(projected_cash_flows) + 1)
                 ],
                 "methodology": (
-                    "AI-driven DCF" if ai_confidence > 0 else "Traditional DCF"
+                    "AI-driven DCF" if forecast_mode != "growth" else "Traditional DCF"
                 ),
+                "forecast_mode": forecast_mode,
             }
 
         except Exception as e:
             return {"error": f"Lỗi khi tính DCF: {str(e)}"}
 
+    def _fit_and_forecast_dcf(
+        self, historical_cash_flows, growth_rates, industry_data, market_data
+    ):
+        """
+        Fit mô hình ngay trong request (chế độ fit_per_request). Mỗi request dùng một
+        bản sao riêng của dcf_model nên không ảnh hưởng tới các request đồng thời.
+        Trả về (dòng tiền dự báo, R²) hoặc (None, 0) nếu không đủ dữ liệu.
+        """
+        # Tạo các features cho AI model
+        features = []
+        target = []
+
+        # Chuẩn bị dữ liệu cho mô hình học
+        for i in range(len(historical_cash_flows) - 1):
+            # Lấy 3 giá trị dòng tiền liên tiếp làm đặc trưng
+            if i + 3 <= len(historical_cash_flows):
+                feature = [
+                    historical_cash_flows[i],
+                    historical_cash_flows[i + 1],
+                    historical_cash_flows[i + 2],
+                ]
+
+                # Thêm các đặc trưng khác
+                feature.append(growth_rates.get("revenue_growth", 0.05))
+                feature.append(growth_rates.get("profit_margin", 0.1))
+                feature.append(industry_data.get("industry_growth", 0.03))
+                feature.append(market_data.get("gdp_growth", 0.02))
+
+                features.append(feature)
+
+                # Giá trị tiếp theo là mục tiêu dự đoán
+                if i + 3 < len(historical_cash_flows):
+                    target.append(historical_cash_flows[i + 3])
+
+        if not features or not target:
+            return None, 0
+
+        # Huấn luyện mô hình trên bản sao riêng của request
+        # Cửa sổ cuối cùng chưa có giá trị mục tiêu, chỉ dùng để dự báo
+        model = clone(self.dcf_model)
+        model.fit(features[: len(target)], target)
+
+        # Dự báo dòng tiền tương lai
+        last_features = features[-1][1:] + [growth_rates.get("projected_growth", 0.05)]
+
+        projected_cash_flows = []
+        current_feature = last_features
+
+        for i in range(5):  # Dự đoán 5 năm tiếp theo
+            prediction = model.predict([current_feature])[0]
+            projected_cash_flows.append(round(prediction, 2))
+
+            # Cập nhật features cho lần dự đoán tiếp theo
+            current_feature = current_feature[1:] + [prediction]
+
+        # Đánh giá độ tin cậy của mô hình
+        # Đối với RandomForestRegressor, ta có thể dùng R²
+        ai_confidence = model.score(features[: len(target)], target)
+        return projected_cash_flows, ai_confidence
+
     def run_pe_analysis(self, data):
         """
         Phân tích tỉ số P/E (Price-to-Earnings) và đánh giá định giá cổ phiếu.
@@ -523,7 +1409,13 @@ class VIA:
         """
         price = data.get("price", 0)
         earnings = data.get("earnings", 0)
-        sector_avg_pe = data.get("sector_avg_pe", 15.0)  # PE trung bình ngành mặc định
+        # PE trung bình ngành: từ request, từ sector index hoặc mặc định
+        sector_avg_pe = data.get(
+            "sector_avg_pe",
+            self._sector_data(data.get("sector") or data.get("industry")).get(
+                "avg_pe", 15.0
+            ),
+        )
         market_avg_pe = data.get(
             "market_avg_pe", 18.0
         )  # PE trung bình thị trường mặc định
@@ -576,164 +1468,358 @@ class VIA:
         - sector_data: Dữ liệu ngành
         - growth_metrics: Chỉ số tăng trưởng
         - financial_health: Sức khỏe tài chính
+        - industry, market_avg_pe (tùy chọn): Đặc trưng của mô hình PE đã huấn luyện
 
         Đầu ra: JSON chứa phân tích PE được tăng cường bởi neural network
         """
         try:
-            # Trích xuất dữ liệu
-            price = data.get("price", 0)
-            earnings = data.get("earnings", 0)
-            historical_pe = data.get("historical_pe", [])
-            sector_data = data.get("sector_data", {})
-            growth_metrics = data.get("growth_metrics", {})
-            financial_health = data.get("financial_health", {})
-
-            # Các chỉ số tăng trưởng
-            revenue_growth = growth_metrics.get("revenue_growth", 0)
-            earnings_growth = growth_metrics.get("earnings_growth", 0)
-            projected_growth = growth_metrics.get("projected_growth", 0)
-
-            # Dữ liệu ngành
-            sector_avg_pe = sector_data.get("avg_pe", 15)
-            sector_avg_growth = sector_data.get("avg_growth", 0.05)
-            sector_high_pe = sector_data.get("high_pe", 25)
-            sector_low_pe = sector_data.get("low_pe", 10)
-
-            # Sức khỏe tài chính
-            debt_to_equity = financial_health.get("debt_to_equity", 1.0)
-            current_ratio = financial_health.get("current_ratio", 1.5)
-            return_on_equity = financial_health.get("roe", 0.1)
-
-            if earnings <= 0:
-                return {
-                    "pe_ratio": None,
-                    "adjusted_pe": None,
-                    "fair_pe": None,
-                    "evaluation": "Không thể đánh giá (EPS không dương)",
-                    "price_targets": None,
-                    "confidence": 0,
-                }
+            return self.run_neural_pe_batch(pd.DataFrame([self._pe_record(data)]))[0]
+        except Exception as e:
+            return {"error": f"Lỗi khi phân tích PE: {str(e)}"}
 
-            # Tính PE cơ bản
-            pe_ratio = price / earnings if earnings > 0 else None
-
-            # Chuẩn bị features cho neural network
-            features = [
-                pe_ratio if pe_ratio is not None else 0,
-                sector_avg_pe,
-                revenue_growth,
-                earnings_growth,
-                projected_growth,
-                debt_to_equity,
-                current_ratio,
-                return_on_equity,
-                np.mean(historical_pe) if historical_pe else pe_ratio or 0,
-                (
-                    np.std(historical_pe)
-                    if historical_pe and len(historical_pe) > 1
-                    else 0
-                ),
-            ]
+    def _pe_record(self, data):
+        """Làm phẳng request PE (các dict con) thành một dòng của bảng batch."""
+        sector_data = data.get("sector_data", {})
+        record = {
+            key: data[key]
+            for key in ("price", "earnings", "historical_pe", "market_avg_pe", "sector")
+            if key in data
+        }
+        record.update(data.get("growth_metrics", {}))
+        record.update(data.get("financial_health", {}))
+        for key in ("avg_pe", "avg_growth", "high_pe", "low_pe"):
+            if key in sector_data:
+                record[f"sector_{key}"] = sector_data[key]
+        industry = data.get("industry") or sector_data.get("industry")
+        if industry:
+            record["industry"] = industry
+        return record
+
+    def load_pe_model(self, model_name=None):
+        """
+        Nạp pipeline PE (scaler + MLP) huấn luyện bởi ModelTrainer.train_neural_network
+        trên lược đồ pe.csv (mặc định là mô hình mới nhất có target_pe). Trả về tên
+        mô hình hoặc None.
+        """
+        if self.model_registry is None:
+            return None
+        model_name = model_name or self.model_registry.latest(
+            "MLPRegressor", target_column=self.PE_TARGET_COLUMN
+        )
+        if model_name is None:
+            return None
+
+        self.pe_neural_model = self.model_registry.get(model_name)
+        metadata = self.model_registry.metadata(model_name)
+        self.pe_feature_columns = metadata.get("feature_columns")
+        r2 = metadata.get("metrics", {}).get("r2_score")
+        self.pe_model_confidence = (
+            float(np.clip(r2, 0.0, 1.0)) if r2 is not None else None
+        )
+        self.pe_model_name = model_name
+        return model_name
+
+    def _pe_column(self, df, name):
+        for column in self.PE_COLUMN_ALIASES.get(name, (name,)):
+            if column in df.columns:
+                return (
+                    pd.to_numeric(df[column], errors="coerce")
+                    .fillna(self.PE_DEFAULTS[name])
+                    .to_numpy(dtype=float)
+                )
+        return np.full(len(df), self.PE_DEFAULTS[name], dtype=float)
+
+    def _pe_model_features(self, df, columns):
+        """Ma trận đặc trưng theo thứ tự feature_columns của mô hình PE."""
+        # One-hot ngành từ cột industry: khớp đúng khóa ("Consumer Goods" ->
+        # industry_consumer_goods), nếu không thì khóa dài nhất là tiền tố của ngành
+        # ("Technology" -> industry_tech), như SectorIndex.get; mỗi dòng một ngành
+        keys = [
+            feature[len("industry_") :]
+            for feature in self.pe_feature_columns
+            if feature.startswith("industry_") and feature not in df.columns
+        ]
+        industry = (
+            df["industry"].fillna("").map(SectorIndex.normalize)
+            if "industry" in df.columns
+            else pd.Series("", index=df.index)
+        )
+        matched = industry.map(
+            {
+                value: (
+                    value
+                    if value in keys
+                    else max(
+                        (k for k in keys if value.startswith(k)), key=len, default=None
+                    )
+                )
+                for value in industry.unique()
+            }
+        )
+        features = np.zeros((len(df), len(self.pe_feature_columns)))
+        for j, feature in enumerate(self.pe_feature_columns):
+            if feature in df.columns:
+                features[:, j] = pd.to_numeric(df[feature], errors="coerce").fillna(0)
+            elif feature.startswith("industry_"):
+                features[:, j] = matched == feature[len("industry_") :]
+            elif self.PE_MODEL_SOURCES.get(feature) in columns:
+                features[:, j] = columns[self.PE_MODEL_SOURCES[feature]]
+        return pd.DataFrame(features, columns=self.pe_feature_columns)
+
+    def run_neural_pe_batch(self, df):
+        """
+        Phân tích PE neural cho cả bảng, mỗi dòng một công ty (cột phẳng: price,
+        earnings, *_growth, sector_avg_pe, sector_avg_growth, sector_high_pe,
+        sector_low_pe, debt_to_equity, current_ratio, roe, market_avg_pe, industry).
 
-            # Chuẩn hóa features
-            features_array = np.array(features).reshape(1, -1)
+        Fair PE cơ sở lấy từ mô hình PE đã huấn luyện (một lần predict cho cả bảng),
+        hoặc từ quy tắc tăng trưởng khi chưa có mô hình; sau đó được điều chỉnh bởi
+        hệ số rủi ro tài chính và giới hạn theo ngành, tất cả tính theo cột.
+        """
+        df = self._fill_sector_columns(
+            df,
+            {
+                "sector_avg_pe": "avg_pe",
+                "sector_avg_growth": "avg_growth",
+                "sector_high_pe": "high_pe",
+                "sector_low_pe": "low_pe",
+            },
+        )
+        columns = {name: self._pe_column(df, name) for name in self.PE_DEFAULTS}
+        price, earnings = columns["price"], columns["earnings"]
+        projected_growth = columns["projected_growth"]
+        sector_avg_pe = columns["sector_avg_pe"]
+        debt_to_equity = columns["debt_to_equity"]
+        current_ratio = columns["current_ratio"]
+        valid_price = price > 0
+        valid = (earnings > 0) & valid_price
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pe_ratio = np.where(valid, price / earnings, np.nan)
+            # PEG ratio (PE/Growth) - chỉ số đánh giá PE theo tăng trưởng
+            peg_ratio = np.where(
+                projected_growth > 0, pe_ratio / projected_growth, np.nan
+            )
 
-            # Trong thực tế, mô hình neural network sẽ được huấn luyện trước
-            # Ở đây, chúng ta sẽ mô phỏng kết quả từ neural network
+        # Fair PE theo tăng trưởng: Sector Avg PE * (1 + (Growth - Sector Avg Growth))
+        growth_adjustment = 1 + (projected_growth - columns["sector_avg_growth"])
+        if self.pe_model_name is not None and valid.any():
+            model_pe = np.full(len(df), np.nan)
+            model_pe[valid] = self.pe_neural_model.predict(
+                self._pe_model_features(
+                    df[valid], {k: v[valid] for k, v in columns.items()}
+                )
+            )
+            base_pe = model_pe
+        else:
+            model_pe = None
+            base_pe = sector_avg_pe * growth_adjustment
+
+        # Điều chỉnh theo rủi ro tài chính (nợ, thanh khoản, ROE)
+        risk_factor = (
+            1.0
+            + np.select([debt_to_equity > 2, debt_to_equity < 0.5], [-0.2, 0.1], 0.0)
+            + np.select([current_ratio < 1.0, current_ratio > 2.0], [-0.1, 0.05], 0.0)
+            + np.where(columns["roe"] > 0.2, 0.15, 0.0)
+        )
 
-            # Mô phỏng fair P/E dựa trên đặc điểm của công ty
-            # Công thức: PE cơ bản được điều chỉnh theo tăng trưởng và rủi ro
+        # Fair PE cuối cùng, giới hạn trong khoảng hợp lý của ngành
+        fair_pe = np.maximum(
+            columns["sector_low_pe"] * 0.8,
+            np.minimum(base_pe * risk_factor, columns["sector_high_pe"] * 1.2),
+        )
 
-            # PEG ratio (PE/Growth) - chỉ số đánh giá PE theo tăng trưởng
-            peg_ratio = pe_ratio / projected_growth if projected_growth > 0 else None
-
-            # Tính fair PE dựa trên mô hình tăng trưởng (PE ~ Growth Rate)
-            # Mô hình đơn giản: Fair PE = Sector Avg PE * (1 + (Growth - Sector Avg Growth))
-            growth_adjustment = 1 + (projected_growth - sector_avg_growth)
-            fair_pe_by_growth = sector_avg_pe * growth_adjustment
-
-            # Điều chỉnh theo rủi ro tài chính
-            risk_factor = 1.0
-            if debt_to_equity > 2:
-                risk_factor -= 0.2  # Giảm PE nếu nợ cao
-            elif debt_to_equity < 0.5:
-                risk_factor += 0.1  # Tăng PE nếu nợ thấp
-
-            if current_ratio < 1.0:
-                risk_factor -= 0.1  # Giảm PE nếu thanh khoản thấp
-            elif current_ratio > 2.0:
-                risk_factor += 0.05  # Tăng PE nếu thanh khoản cao
-
-            if return_on_equity > 0.2:
-                risk_factor += 0.15  # Tăng PE nếu ROE cao
-
-            # Fair PE cuối cùng
-            fair_pe = fair_pe_by_growth * risk_factor
-
-            # Giới hạn fair PE trong khoảng hợp lý
-            fair_pe = max(sector_low_pe * 0.8, min(fair_pe, sector_high_pe * 1.2))
-
-            # Đánh giá định giá dựa trên PE so với fair PE
-            if pe_ratio is None:
-                evaluation = "Không thể đánh giá"
-            elif pe_ratio < fair_pe * 0.8:
-                evaluation = "Định giá thấp (tiềm năng tăng giá)"
-            elif pe_ratio < fair_pe * 0.95:
-                evaluation = "Định giá hợp lý (thấp hơn giá trị hợp lý)"
-            elif pe_ratio < fair_pe * 1.05:
-                evaluation = "Định giá hợp lý (gần giá trị hợp lý)"
-            elif pe_ratio < fair_pe * 1.2:
-                evaluation = "Định giá hợp lý (cao hơn giá trị hợp lý)"
-            else:
-                evaluation = "Định giá cao (có thể điều chỉnh giảm)"
+        # Đánh giá định giá dựa trên PE so với fair PE
+        evaluation = np.select(
+            [
+                pe_ratio < fair_pe * 0.8,
+                pe_ratio < fair_pe * 0.95,
+                pe_ratio < fair_pe * 1.05,
+                pe_ratio < fair_pe * 1.2,
+            ],
+            [
+                "Định giá thấp (tiềm năng tăng giá)",
+                "Định giá hợp lý (thấp hơn giá trị hợp lý)",
+                "Định giá hợp lý (gần giá trị hợp lý)",
+                "Định giá hợp lý (cao hơn giá trị hợp lý)",
+            ],
+            default="Định giá cao (có thể điều chỉnh giảm)",
+        )
 
-            # Tính các mức giá mục tiêu
-            fair_price = fair_pe * earnings
-            upside_price = fair_pe * earnings * 1.1  # 10% trên giá trị hợp lý
-            downside_price = fair_pe * earnings * 0.9  # 10% dưới giá trị hợp lý
+        # Các mức giá mục tiêu (±10% quanh giá trị hợp lý)
+        fair_price = fair_pe * earnings
+        with np.errstate(divide="ignore", invalid="ignore"):
+            potential_return = np.where(
+                price > 0, (fair_price / price - 1) * 100, np.nan
+            )
+            difference = np.where(
+                sector_avg_pe > 0, (pe_ratio / sector_avg_pe - 1) * 100, np.nan
+            )
 
-            # Độ tin cậy của mô hình
-            # Trong thực tế, độ tin cậy sẽ được tính từ kết quả của mô hình neural
-            confidence = 0.75  # Giá trị mô phỏng
+        # Độ tin cậy: R² kiểm định của mô hình nếu có, giảm khi thiếu dữ liệu
+        if model_pe is not None and self.pe_model_confidence is not None:
+            base_confidence = self.pe_model_confidence
+        else:
+            base_confidence = 0.75  # Giá trị mô phỏng của quy tắc
+        if "historical_pe" in df.columns:
+            has_history = (
+                df["historical_pe"]
+                .map(lambda v: isinstance(v, (list, tuple)) and len(v) > 0)
+                .to_numpy()
+            )
+        else:
+            has_history = np.zeros(len(df), dtype=bool)
+        confidence = (
+            base_confidence
+            * np.where(has_history, 1.0, 0.8)
+            * np.where(projected_growth == 0, 0.9, 1.0)
+        )
 
-            # Nếu không có đủ dữ liệu, giảm độ tin cậy
-            if not historical_pe:
-                confidence *= 0.8
-            if projected_growth == 0:
-                confidence *= 0.9
+        def rounded(values, i):
+            return None if np.isnan(values[i]) else round(float(values[i]), 2)
 
-            return {
-                "pe_ratio": round(pe_ratio, 2) if pe_ratio is not None else None,
-                "fair_pe": round(fair_pe, 2),
-                "peg_ratio": round(peg_ratio, 2) if peg_ratio is not None else None,
-                "evaluation": evaluation,
-                "price_targets": {
-                    "current_price": price,
-                    "fair_price": round(fair_price, 2),
-                    "upside_target": round(upside_price, 2),
-                    "downside_risk": round(downside_price, 2),
-                    "potential_return": (
-                        round((fair_price / price - 1) * 100, 2) if price > 0 else None
-                    ),
-                },
-                "neural_factors": {
-                    "growth_adjustment": round(growth_adjustment, 2),
-                    "risk_factor": round(risk_factor, 2),
-                },
-                "confidence": round(confidence, 2),
-                "sector_comparison": {
-                    "company_pe": round(pe_ratio, 2) if pe_ratio is not None else None,
-                    "sector_avg_pe": round(sector_avg_pe, 2),
-                    "difference_percent": (
-                        round((pe_ratio / sector_avg_pe - 1) * 100, 2)
-                        if pe_ratio is not None and sector_avg_pe > 0
-                        else None
-                    ),
-                },
+        results = []
+        for i in range(len(df)):
+            if not valid[i]:
+                results.append(
+                    {
+                        "pe_ratio": None,
+                        "adjusted_pe": None,
+                        "fair_pe": None,
+                        "evaluation": (
+                            "Không thể đánh giá (giá không hợp lệ)"
+                            if not valid_price[i]
+                            else "Không thể đánh giá (EPS không dương)"
+                        ),
+                        "price_targets": None,
+                        "confidence": 0,
+                    }
+                )
+                continue
+            neural_factors = {
+                "growth_adjustment": round(float(growth_adjustment[i]), 2),
+                "risk_factor": round(float(risk_factor[i]), 2),
             }
+            if model_pe is not None:
+                neural_factors["model_pe"] = rounded(model_pe, i)
+                neural_factors["model_name"] = self.pe_model_name
+            results.append(
+                {
+                    "pe_ratio": rounded(pe_ratio, i),
+                    "fair_pe": rounded(fair_pe, i),
+                    "peg_ratio": rounded(peg_ratio, i),
+                    "evaluation": str(evaluation[i]),
+                    "price_targets": {
+                        "current_price": float(price[i]),
+                        "fair_price": rounded(fair_price, i),
+                        "upside_target": round(float(fair_price[i] * 1.1), 2),
+                        "downside_risk": round(float(fair_price[i] * 0.9), 2),
+                        "potential_return": rounded(potential_return, i),
+                    },
+                    "neural_factors": neural_factors,
+                    "confidence": round(float(confidence[i]), 2),
+                    "sector_comparison": {
+                        "company_pe": rounded(pe_ratio, i),
+                        "sector_avg_pe": round(float(sector_avg_pe[i]), 2),
+                        "difference_percent": rounded(difference, i),
+                    },
+                }
+            )
+        return results
+
+    def run_comparables(self, data):
+        """
+        Định giá so sánh (Comparables) cho một công ty.
+
+        Đầu vào:
+        - comparable_companies: Danh sách {name, pe_ratio} của các công ty cùng ngành
+        - company_earnings, shares_outstanding (hoặc earnings_per_share): Thu nhập
+        - price (tùy chọn): Giá hiện tại, để tính mức chênh lệch với giá trị ước tính
+        - trim_fraction (tùy chọn): Tỷ lệ peer bị loại ở mỗi đầu khi tính trimmed mean
 
+        Đầu ra: JSON chứa PE peer (median/mean/trimmed mean) và giá trị mỗi cổ phiếu
+        """
+        try:
+            peers = pd.DataFrame(
+                data.get("comparable_companies") or [], columns=["name", "pe_ratio"]
+            )
+            peers["row"] = 0
+            company = {k: v for k, v in data.items() if k != "comparable_companies"}
+            return self.run_comparables_batch(pd.DataFrame([company]), peers)[0]
         except Exception as e:
-            return {"error": f"Lỗi khi phân tích PE: {str(e)}"}
+            return {"error": f"Lỗi khi định giá so sánh: {str(e)}"}
+
+    def run_comparables_batch(self, df, peers):
+        """
+        Định giá so sánh cho cả bảng: df mỗi dòng một công ty, peers là bảng peer dạng
+        dài (row, name, pe_ratio) như DataTransformer.comparables_to_long. Thống kê PE
+        của mọi công ty được tính trong một lần (BatchValuation.comparables).
+        """
+
+        def column(*names, default=np.nan):
+            name = next((n for n in names if n in df.columns), None)
+            if name is None:
+                return np.full(len(df), default, dtype=float)
+            return pd.to_numeric(df[name], errors="coerce").to_numpy(dtype=float)
+
+        # EPS: cột có sẵn, hoặc thu nhập công ty / số cổ phiếu
+        shares = column("shares_outstanding")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            eps = np.where(
+                shares > 0, column("company_earnings", "earnings") / shares, np.nan
+            )
+        if "earnings_per_share" in df.columns or "eps" in df.columns:
+            given = column("earnings_per_share", "eps")
+            eps = np.where(np.isnan(given), eps, given)
+        price = column("price")
+        # Ô trim_fraction trống dùng mặc định; giá trị ngoài [0, 0.5] bị giới hạn lại
+        trim_fraction = column("trim_fraction")
+        trim_fraction = np.where(np.isnan(trim_fraction), 0.2, trim_fraction)
+
+        result = self.valuation.comparables(
+            pd.to_numeric(peers["row"]).to_numpy(),
+            pd.to_numeric(peers["pe_ratio"], errors="coerce").to_numpy(),
+            len(df),
+            eps,
+            trim_fraction=trim_fraction,
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            upside = np.where(
+                price > 0, (result["value_median"] / price - 1) * 100, np.nan
+            )
+
+        def rounded(values):
+            # Làm tròn cả vector một lần; NaN/inf -> None
+            return [
+                v if math.isfinite(v) else None
+                for v in np.round(np.asarray(values, dtype=float), 2).tolist()
+            ]
+
+        peer_pe = {
+            key: rounded(result[f"{key}_pe"])
+            for key in ("median", "mean", "trimmed_mean", "min", "max")
+        }
+        values = {
+            key: rounded(result[f"value_{key}"])
+            for key in ("median", "mean", "trimmed_mean")
+        }
+        columns = {
+            "peer_count": result["peer_count"].tolist(),
+            "earnings_per_share": rounded(eps),
+            "implied_equity_value": rounded(result["value_median"] * shares),
+            "upside_percent": rounded(upside),
+        }
+        return [
+            {
+                "peer_count": columns["peer_count"][i],
+                "peer_pe": {key: v[i] for key, v in peer_pe.items()},
+                "earnings_per_share": columns["earnings_per_share"][i],
+                "implied_value_per_share": {key: v[i] for key, v in values.items()},
+                "implied_equity_value": columns["implied_equity_value"][i],
+                "upside_percent": columns["upside_percent"][i],
+            }
+            for i in range(len(df))
+        ]
 
     def run_risk_mitigation(self, data):
         """
@@ -744,6 +1830,16 @@ class VIA:
         - stock_price_history: Lịch sử giá cổ phiếu
         - market_data: Dữ liệu thị trường
         - macro_indicators: Chỉ số vĩ mô
+        - num_simulations, days (tùy chọn): Số đường mô phỏng và số ngày mô phỏng
+        - random_seed (tùy chọn): Seed để tái lập kết quả mô phỏng
+        - simulation_mode (tùy chọn): "vectorized" (mặc định), "parallel", "streaming"
+          hoặc "adaptive"
+        - num_workers (tùy chọn): Số process khi chạy chế độ "parallel"
+        - chunk_size (tùy chọn): Số đường mỗi chunk khi chạy chế độ "streaming"
+        - variance_reduction (tùy chọn): "none", "plain" (kèm sai số chuẩn),
+          "antithetic", "control_variate" hoặc "sobol" (chế độ "vectorized")
+        - target_relative_error, time_budget_seconds, max_simulations, batch_size
+          (tùy chọn): Điều kiện dừng của chế độ "adaptive"
 
         Đầu ra: JSON chứa phân tích rủi ro, Z-score, kết quả Monte Carlo và khuyến nghị
         """
@@ -846,63 +1942,67 @@ class VIA:
 
             # 3. Mô phỏng Monte Carlo cho dự đoán giá cổ phiếu
             if price_history and len(price_history) > 30:
-                # Tính lợi suất lịch sử
-                returns = [
-                    (price_history[i] / price_history[i - 1] - 1)
-                    for i in range(1, len(price_history))
-                ]
-                mu = np.mean(returns)  # Lợi suất trung bình
-                sigma = np.std(returns)  # Độ biến động
-
-                current_price = price_history[-1]
-                days = 252  # Số ngày giao dịch trong năm
-                num_simulations = 1000
-
-                # Thực hiện mô phỏng Monte Carlo
-                simulation_results = []
-                for _ in range(num_simulations):
-                    price_series = [current_price]
-                    for _ in range(days):
-                        # Mô hình Chuyển động Brown hình học
-                        daily_return = np.random.normal(mu, sigma)
-                        price_series.append(price_series[-1] * (1 + daily_return))
-                    simulation_results.append(price_series[-1])
-
-                # Phân tích kết quả mô phỏng
-                mean_price = np.mean(simulation_results)
-                median_price = np.median(simulation_results)
-                std_dev = np.std(simulation_results)
-
-                # Tính VaR (Value at Risk) và CVaR (Conditional VaR)
-                confidence_level = 0.05  # 95% confidence
-                var_95 = np.percentile(simulation_results, confidence_level * 100)
-                cvar_95 = np.mean([x for x in simulation_results if x <= var_95])
-
-                # Xác suất giảm giá
-                downside_prob = (
-                    len([x for x in simulation_results if x < current_price])
-                    / num_simulations
-                )
-
-                # Định giá rủi ro
-                risk_reward_ratio = (
-                    (mean_price - current_price) / (current_price - var_95)
-                    if current_price != var_95
-                    else 0
-                )
-
-                monte_carlo_results = {
-                    "expected_price": round(mean_price, 2),
-                    "median_price": round(median_price, 2),
-                    "current_price": round(current_price, 2),
-                    "price_volatility": round(std_dev / mean_price, 4),
-                    "var_95": round(var_95, 2),
-                    "cvar_95": round(cvar_95, 2),
-                    "downside_probability": round(downside_prob, 4),
-                    "risk_reward_ratio": round(risk_reward_ratio, 2),
-                    "max_price": round(max(simulation_results), 2),
-                    "min_price": round(min(simulation_results), 2),
-                }
+                days = int(data.get("days", 252))  # Số ngày giao dịch trong năm
+                num_simulations = int(data.get("num_simulations", 1000))
+                if days <= 0 or num_simulations <= 0:
+                    return {"error": "num_simulations và days phải lớn hơn 0"}
+
+                if data.get("simulation_mode") == "parallel":
+                    # Chế độ song song cho số lượng đường lớn (100k+)
+                    num_workers = data.get("num_workers")
+                    if num_workers is not None:
+                        num_workers = int(num_workers)
+                        if num_workers <= 0:
+                            return {"error": "num_workers phải lớn hơn 0"}
+                    monte_carlo_results = self.monte_carlo.run_parallel(
+                        price_history,
+                        num_simulations=num_simulations,
+                        days=days,
+                        seed=data.get("random_seed"),
+                        max_workers=num_workers,
+                    )
+                elif data.get("simulation_mode") == "streaming":
+                    # Chế độ chunk với bộ nhớ O(1) cho hàng triệu đường
+                    chunk_size = int(data.get("chunk_size", 10000))
+                    if chunk_size <= 0:
+                        return {"error": "chunk_size phải lớn hơn 0"}
+                    monte_carlo_results = self.monte_carlo.run_streaming(
+                        price_history,
+                        num_simulations=num_simulations,
+                        days=days,
+                        seed=data.get("random_seed"),
+                        chunk_size=chunk_size,
+                    )
+                elif data.get("simulation_mode") == "adaptive":
+                    # Mô phỏng theo lô cho đến khi đạt sai số tương đối mục tiêu
+                    batch_size = int(data.get("batch_size", 1000))
+                    max_simulations = int(data.get("max_simulations", 1000000))
+                    time_budget = data.get("time_budget_seconds")
+                    if time_budget is not None:
+                        time_budget = float(time_budget)
+                    if batch_size <= 0 or max_simulations <= 0:
+                        return {"error": "batch_size và max_simulations phải lớn hơn 0"}
+                    if time_budget is not None and not time_budget > 0:
+                        return {"error": "time_budget_seconds phải lớn hơn 0"}
+                    monte_carlo_results = self.monte_carlo.run_adaptive(
+                        price_history,
+                        target_relative_error=float(
+                            data.get("target_relative_error", 0.01)
+                        ),
+                        time_budget=time_budget,
+                        days=days,
+                        seed=data.get("random_seed"),
+                        batch_size=batch_size,
+                        max_simulations=max_simulations,
+                    )
+                else:
+                    monte_carlo_results = self.monte_carlo.run(
+                        price_history,
+                        num_simulations=num_simulations,
+                        days=days,
+                        seed=data.get("random_seed"),
+                        variance_reduction=data.get("variance_reduction", "none"),
+                    )
             else:
                 monte_carlo_results = {
                     "error": "Không đủ dữ liệu giá để thực hiện mô phỏng Monte Carlo"
@@ -983,3 +2083,60 @@ class VIA:
 
         except Exception as e:
             return {"error": f"Lỗi khi phân tích rủi ro: {str(e)}"}
+
+    def run_portfolio_risk(self, data):
+        """
+        Phân tích rủi ro danh mục nhiều tài sản bằng Monte Carlo có tương quan
+
+        Đầu vào:
+        - positions: Danh sách vị thế, mỗi vị thế gồm ticker, stock_price_history, weight
+          (tỷ trọng không âm, được chuẩn hóa về tổng bằng 1)
+        - portfolio_value (tùy chọn): Giá trị danh mục hiện tại (mặc định 1.0)
+        - num_simulations, days, random_seed (tùy chọn): Tham số mô phỏng
+
+        Đầu ra: JSON chứa VaR/CVaR danh mục và đóng góp rủi ro của từng vị thế
+        """
+        try:
+            positions = data.get("positions", [])
+            if not positions or len(positions) < 2:
+                return {"error": "Danh mục cần ít nhất 2 vị thế"}
+
+            price_histories = [p.get("stock_price_history", []) for p in positions]
+            if any(len(history) <= 30 for history in price_histories):
+                return {
+                    "error": "Không đủ dữ liệu giá để thực hiện mô phỏng Monte Carlo"
+                }
+
+            try:
+                weights = np.array([float(p.get("weight", 1.0)) for p in positions])
+                portfolio_value = float(data.get("portfolio_value", 1.0))
+            except (TypeError, ValueError):
+                return {"error": "weight và portfolio_value phải là số"}
+            # Danh mục chỉ mua (long-only): không nhận tỷ trọng âm hoặc không hữu hạn
+            if not np.isfinite(weights).all() or (weights < 0).any():
+                return {"error": "Tỷ trọng danh mục phải là số hữu hạn và không âm"}
+            if weights.sum() <= 0:
+                return {"error": "Tổng tỷ trọng danh mục phải lớn hơn 0"}
+            if not np.isfinite(portfolio_value) or portfolio_value <= 0:
+                return {"error": "portfolio_value phải lớn hơn 0"}
+            weights = weights / weights.sum()
+
+            days = int(data.get("days", 252))
+            num_simulations = int(data.get("num_simulations", 1000))
+            if days <= 0 or num_simulations <= 0:
+                return {"error": "num_simulations và days phải lớn hơn 0"}
+
+            result = self.monte_carlo.run_portfolio(
+                price_histories,
+                weights,
+                num_simulations=num_simulations,
+                days=days,
+                seed=data.get("random_seed"),
+                portfolio_value=portfolio_value,
+            )
+            for position, summary in zip(positions, result["positions"]):
+                summary["ticker"] = position.get("ticker")
+            return result
+
+        except Exception as e:
+            return {"error": f"Lỗi khi phân tích rủi ro danh mục: {str(e)}"}
@@ -0,0 +1,241 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import numpy as np
+
+
+class AccuracyStore:
+    """
+    Append-only SQLite store of model predictions and realized actuals.
+
+    Each prediction is scored once, when its actual becomes available, and the
+    per-model error metrics are updated incrementally (running MAE/MAPE plus an
+    exponentially weighted rolling APE). Reading historical accuracy is a
+    primary-key lookup on the metrics table, never a scan of the history.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS predictions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            model TEXT NOT NULL,
+            instrument TEXT NOT NULL,
+            period TEXT NOT NULL,
+            predicted REAL NOT NULL,
+            created_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS predictions_key
+            ON predictions (instrument, period);
+        CREATE TABLE IF NOT EXISTS actuals (
+            instrument TEXT NOT NULL,
+            period TEXT NOT NULL,
+            actual REAL NOT NULL,
+            recorded_at TEXT NOT NULL,
+            PRIMARY KEY (instrument, period)
+        );
+        CREATE TABLE IF NOT EXISTS errors (
+            prediction_id INTEGER PRIMARY KEY,
+            model TEXT NOT NULL,
+            abs_error REAL NOT NULL,
+            abs_pct_error REAL NOT NULL,
+            scored_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS model_metrics (
+            model TEXT PRIMARY KEY,
+            count INTEGER NOT NULL,
+            mae REAL NOT NULL,
+            mape REAL NOT NULL,
+            rolling_ape REAL NOT NULL,
+            accuracy REAL NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, db_path=os.path.join("data", "accuracy.db"), window=50):
+        self.db_path = db_path
+        # Rolling metric is an EWMA with the span of `window` scored predictions
+        self.alpha = 2.0 / (window + 1)
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._connection.executescript(self.SCHEMA)
+        return self._connection
+
+    def record_predictions(self, records):
+        """
+        Append predictions: iterable of dicts with model, instrument, period and
+        predicted. Predictions whose actual is already known are scored at once.
+        Returns the number of predictions that were scored.
+        """
+        now = datetime.now().isoformat()
+        rows = [
+            (
+                str(r["model"]),
+                str(r["instrument"]),
+                str(r["period"]),
+                float(r["predicted"]),
+                now,
+            )
+            for r in records
+        ]
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                (last_id,) = connection.execute(
+                    "SELECT COALESCE(MAX(id), 0) FROM predictions"
+                ).fetchone()
+                connection.executemany(
+                    "INSERT INTO predictions (model, instrument, period, predicted,"
+                    " created_at) VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                matched = connection.execute(
+                    """
+                    SELECT p.id, p.model, p.predicted, a.actual
+                    FROM predictions p
+                    JOIN actuals a
+                        ON a.instrument = p.instrument AND a.period = p.period
+                    WHERE p.id > ?
+                    ORDER BY p.id
+                    """,
+                    (last_id,),
+                ).fetchall()
+                return self._score(connection, matched)
+
+    def record_actuals(self, records):
+        """
+        Append realized actuals: iterable of dicts with instrument, period and
+        actual. The first actual recorded for an (instrument, period) is kept.
+        Returns the number of pending predictions that were scored.
+        """
+        now = datetime.now().isoformat()
+        rows = [
+            (str(r["instrument"]), str(r["period"]), float(r["actual"]), now)
+            for r in records
+        ]
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO actuals (instrument, period, actual,"
+                    " recorded_at) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                # Only predictions for the keys just realized are looked at
+                connection.execute(
+                    "CREATE TEMP TABLE IF NOT EXISTS pending"
+                    " (instrument TEXT, period TEXT)"
+                )
+                connection.execute("DELETE FROM pending")
+                connection.executemany(
+                    "INSERT INTO pending VALUES (?, ?)",
+                    [row[:2] for row in rows],
+                )
+                matched = connection.execute("""
+                    SELECT DISTINCT p.id, p.model, p.predicted, a.actual
+                    FROM pending k
+                    JOIN predictions p
+                        ON p.instrument = k.instrument AND p.period = k.period
+                    JOIN actuals a
+                        ON a.instrument = p.instrument AND a.period = p.period
+                    LEFT JOIN errors e ON e.prediction_id = p.id
+                    WHERE e.prediction_id IS NULL
+                    ORDER BY p.id
+                    """).fetchall()
+                return self._score(connection, matched)
+
+    def _score(self, connection, matched):
+        if not matched:
+            return 0
+        now = datetime.now().isoformat()
+        ids, models, predicted, actual = zip(*matched)
+        predicted = np.asarray(predicted, dtype=float)
+        actual = np.asarray(actual, dtype=float)
+        abs_error = np.abs(predicted - actual)
+        abs_pct_error = abs_error / np.where(actual != 0, np.abs(actual), 1.0)
+        connection.executemany(
+            "INSERT INTO errors (prediction_id, model, abs_error, abs_pct_error,"
+            " scored_at) VALUES (?, ?, ?, ?, ?)",
+            zip(
+                ids,
+                models,
+                abs_error.tolist(),
+                abs_pct_error.tolist(),
+                [now] * len(ids),
+            ),
+        )
+
+        models = np.asarray(models)
+        for model in np.unique(models):
+            mask = models == model
+            self._update_metrics(
+                connection, str(model), abs_error[mask], abs_pct_error[mask], now
+            )
+        return len(ids)
+
+    def _update_metrics(self, connection, model, abs_error, abs_pct_error, now):
+        row = connection.execute(
+            "SELECT count, mae, mape, rolling_ape FROM model_metrics WHERE model = ?",
+            (model,),
+        ).fetchone()
+        count, mae, mape, rolling = row if row else (0, 0.0, 0.0, None)
+        if rolling is None:
+            rolling, abs_pct_error_tail = abs_pct_error[0], abs_pct_error[1:]
+        else:
+            abs_pct_error_tail = abs_pct_error
+
+        new_count = count + len(abs_error)
+        mae = (mae * count + abs_error.sum()) / new_count
+        mape = (mape * count + abs_pct_error.sum()) / new_count
+        # EWMA over the new errors in arrival order, in closed form
+        k = len(abs_pct_error_tail)
+        decay = (1 - self.alpha) ** np.arange(k - 1, -1, -1)
+        rolling = (1 - self.alpha) ** k * rolling + self.alpha * (
+            decay @ abs_pct_error_tail
+        )
+        accuracy = float(np.clip(1.0 - rolling, 0.0, 1.0))
+
+        connection.execute(
+            """
+            INSERT INTO model_metrics
+                (model, count, mae, mape, rolling_ape, accuracy, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(model) DO UPDATE SET
+                count = excluded.count, mae = excluded.mae, mape = excluded.mape,
+                rolling_ape = excluded.rolling_ape, accuracy = excluded.accuracy,
+                updated_at = excluded.updated_at
+            """,
+            (model, new_count, float(mae), float(mape), float(rolling), accuracy, now),
+        )
+
+    def metrics(self, models=None):
+        """Per-model error metrics, for the given models or all of them."""
+        if models is not None and not len(models):
+            return {}
+        with self._lock:
+            connection = self._connect()
+            if models is None:
+                rows = connection.execute("SELECT * FROM model_metrics").fetchall()
+            else:
+                models = [str(m) for m in models]
+                rows = connection.execute(
+                    "SELECT * FROM model_metrics WHERE model IN"
+                    f" ({', '.join('?' * len(models))})",
+                    models,
+                ).fetchall()
+        columns = ("count", "mae", "mape", "rolling_ape", "accuracy", "updated_at")
+        return {row[0]: dict(zip(columns, row[1:])) for row in rows}
+
+    def historical_accuracy(self, models):
+        """{model: accuracy} for the models that have scored predictions."""
+        return {
+            model: round(values["accuracy"], 4)
+            for model, values in self.metrics(models).items()
+        }
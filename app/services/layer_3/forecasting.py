@@ -0,0 +1,358 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def history_matrix(histories):
+    """
+    Stack cash-flow histories into an N x T float matrix padded with trailing NaN.
+    Accepts a ragged list of sequences or an existing 2-D array.
+    """
+    if isinstance(histories, np.ndarray) and histories.ndim == 2:
+        return histories.astype(float)
+    rows = [np.asarray(h, dtype=float).ravel() for h in histories]
+    matrix = np.full((len(rows), max((len(r) for r in rows), default=0)), np.nan)
+    for i, row in enumerate(rows):
+        matrix[i, : len(row)] = row
+    return matrix
+
+
+def tail_windows(histories, size):
+    """
+    Last `size` observed values of each history (N x size), skipping NaN wherever it
+    occurs, and the mask of rows with at least `size` observations. Rows that are too
+    short are NaN.
+    """
+    matrix = history_matrix(histories)
+    observed = ~np.isnan(matrix)
+    valid = observed.sum(axis=1) >= size
+    if matrix.shape[1] < size:
+        return np.full((len(matrix), size), np.nan), valid
+    # A stable sort moves the observed values to the end, keeping their order
+    order = np.argsort(observed, axis=1, kind="stable")
+    windows = np.take_along_axis(matrix, order[:, matrix.shape[1] - size :], axis=1)
+    windows[~valid] = np.nan
+    return windows, valid
+
+
+class CashFlowForecaster:
+    """
+    Cash-flow forecaster trained offline and used read-only on the request path.
+
+    Each sample is a window of consecutive cash flows scaled by the magnitude of the
+    most recent value, so one model can serve companies of very different size.
+    The wrapped estimator predicts the next `horizon` scaled values in one call
+    (multi-output when horizon > 1); longer forecasts roll forward block by block.
+    """
+
+    def __init__(self, estimator, window=3, horizon=1, sector="default", metrics=None):
+        self.estimator = estimator
+        self.window = window
+        self.horizon = horizon
+        self.sector = sector
+        self.metrics = metrics or {}
+
+    @staticmethod
+    def scale_of(windows):
+        """Per-row scale: |last value|, falling back to the mean magnitude."""
+        windows = np.atleast_2d(windows)
+        scale = np.abs(windows[:, -1])
+        fallback = np.abs(windows).mean(axis=1)
+        scale = np.where(scale > 0, scale, fallback)
+        return np.where(scale > 0, scale, 1.0)
+
+    def build_dataset(self, series_list):
+        """
+        Build (features, targets) from a list of cash-flow series with sliding windows.
+        Targets are the next `horizon` values, scaled like the window.
+        """
+        features, targets = [], []
+        span = self.window + self.horizon
+        for series in series_list:
+            series = np.asarray(series, dtype=float)
+            series = series[~np.isnan(series)]
+            if len(series) < span:
+                continue
+            blocks = sliding_window_view(series, span)
+            windows, future = blocks[:, : self.window], blocks[:, self.window :]
+            scale = self.scale_of(windows)[:, None]
+            features.append(windows / scale)
+            targets.append(future / scale)
+        if not features:
+            return np.empty((0, self.window)), np.empty((0, self.horizon))
+        return np.vstack(features), np.vstack(targets)
+
+    def fit(self, series_list):
+        X, y = self.build_dataset(series_list)
+        if len(X) == 0:
+            raise ValueError("Not enough cash-flow history to build training windows")
+        self.estimator.fit(X, y.ravel() if self.horizon == 1 else y)
+        return self
+
+    def update_tails(self, histories, new_periods=1):
+        """
+        Trailing values of each history needed to form the windows that end in the
+        last `new_periods` periods (window + horizon - 1 + new_periods values).
+        """
+        matrix = history_matrix(histories)
+        observed = ~np.isnan(matrix)
+        packed = np.take_along_axis(
+            matrix, np.argsort(~observed, axis=1, kind="stable"), axis=1
+        )
+        lengths = observed.sum(axis=1)
+        span = self.window + self.horizon - 1 + new_periods
+        return [row[max(0, n - span) : n] for row, n in zip(packed, lengths)]
+
+    def partial_fit(self, series_list, n_estimators=10):
+        """
+        Incremental update: grow `n_estimators` extra trees on the windows built from
+        `series_list` only (pass update_tails() of the new periods), keeping every
+        existing tree. Requires an estimator with warm_start (e.g. RandomForest).
+        """
+        params = self.estimator.get_params()
+        if "warm_start" not in params or "n_estimators" not in params:
+            raise ValueError(
+                f"{type(self.estimator).__name__} does not support incremental updates"
+            )
+        X, y = self.build_dataset(series_list)
+        if len(X) == 0:
+            raise ValueError("No new cash-flow windows to update the forecaster with")
+        self.estimator.set_params(
+            warm_start=True, n_estimators=params["n_estimators"] + n_estimators
+        )
+        self.estimator.fit(X, y.ravel() if self.horizon == 1 else y)
+        return self
+
+    def predict_horizons(self, windows):
+        """
+        Predict all `horizon` future values for each row of an (N x window) matrix
+        with a single estimator call (direct multi-output forecast).
+        """
+        windows = np.atleast_2d(np.asarray(windows, dtype=float))
+        scale = self.scale_of(windows)
+        prediction = np.asarray(self.estimator.predict(windows / scale[:, None]))
+        return prediction.reshape(len(windows), -1) * scale[:, None]
+
+    def predict_next(self, windows):
+        """Predict the next value for each row of an (N x window) matrix."""
+        return self.predict_horizons(windows)[:, 0]
+
+    def last_windows(self, histories):
+        """
+        Last `window` observed values of each history. Histories may be a ragged list
+        or an N x T matrix; missing periods (NaN anywhere, not only trailing padding)
+        are dropped before the window is taken. Rows that are too short are NaN.
+        """
+        return tail_windows(histories, self.window)
+
+    def forecast_batch(self, histories, steps=5):
+        """
+        Forecast `steps` values for many companies at once (N x steps, NaN for rows
+        without enough history). Each estimator call predicts `horizon` steps for every
+        company, so a model with horizon >= steps needs exactly one call.
+        """
+        windows, valid = self.last_windows(histories)
+        projected = np.full((len(windows), steps), np.nan)
+        if not valid.any():
+            return projected
+
+        current = windows[valid]
+        blocks = []
+        produced = 0
+        while produced < steps:
+            block = self.predict_horizons(current)
+            blocks.append(block)
+            produced += block.shape[1]
+            current = np.hstack([current, block])[:, -self.window :]
+        projected[valid] = np.hstack(blocks)[:, :steps]
+        return projected
+
+    def forecast(self, history, steps=5):
+        """Multi-step forecast for a single company."""
+        history = np.asarray(history, dtype=float)
+        if np.count_nonzero(~np.isnan(history)) < self.window:
+            raise ValueError(f"At least {self.window} cash flows are required")
+        return self.forecast_batch([history], steps)[0].tolist()
+
+
+class AutoregressiveForecaster:
+    """
+    Closed-form AR(p) cash-flow model fitted per company, for short histories where a
+    tree ensemble is overkill:
+
+        cf[t] = c + a1 * cf[t-1] + ... + ap * cf[t-p]
+
+    Every company in a batch is fitted at once by least squares on its own history
+    (scaled by its largest magnitude). The in-sample R² per company is reported as a
+    fit-quality metric comparable to the RandomForest score.
+
+    The per-company sufficient statistics and inverse Gram matrices are kept, so new
+    periods are folded in by recursive least squares (update) at a cost that depends
+    on the new data only.
+    """
+
+    def __init__(self, order=1):
+        self.order = order
+        self.coef_ = None
+        self.r2_ = None
+        self.ids_ = None
+        self._windows = None
+        self._scale = None
+        self._theta = None
+        self._inverse = None
+        self._xtx = None
+        self._xty = None
+        self._yty = None
+        self._ysum = None
+        self._count = None
+
+    def design(self, histories):
+        """
+        Lagged design tensors: X (N x M x p+1, intercept last), y (N x M) and the mask
+        of usable rows. Windows that touch padding are zeroed so they drop out of the
+        normal equations.
+        """
+        matrix = history_matrix(histories)
+        n, t = matrix.shape
+        p = self.order
+        if t <= p:
+            return np.zeros((n, 0, p + 1)), np.zeros((n, 0)), np.zeros((n, 0), bool)
+
+        blocks = sliding_window_view(matrix, p + 1, axis=1)  # N x (T-p) x (p+1)
+        mask = ~np.isnan(blocks).any(axis=2)
+        lags = np.where(mask[..., None], blocks[..., :p], 0.0)
+        X = np.concatenate([lags, mask[..., None].astype(float)], axis=2)
+        y = np.where(mask, blocks[..., p], 0.0)
+        return X, y, mask
+
+    def fit(self, histories, ids=None):
+        matrix = history_matrix(histories)
+        scale = np.nanmax(np.abs(matrix), axis=1, initial=0.0)
+        scale = np.where(scale > 0, scale, 1.0)
+        scaled = matrix / scale[:, None]
+
+        X, y, mask = self.design(scaled)
+        if len(scaled) == 1:
+            coef = np.linalg.lstsq(X[0], y[0], rcond=None)[0][None, :]
+        else:
+            # lstsq does not broadcast over a stack; pinv does and returns the same
+            # minimum-norm least-squares solution for each company
+            coef = np.einsum("nkm,nm->nk", np.linalg.pinv(X), y)
+
+        self._theta = coef
+        self._xtx = np.einsum("nmi,nmj->nij", X, X)
+        self._xty = np.einsum("nmk,nm->nk", X, y)
+        self._yty = (y**2).sum(axis=1)
+        self._ysum = y.sum(axis=1)
+        self._count = mask.sum(axis=1)
+        self._inverse = np.linalg.pinv(self._xtx)
+        self._refresh_fit_quality()
+
+        self._windows = tail_windows(scaled, self.order)[0]
+        self._scale = scale
+        self.ids_ = None if ids is None else list(ids)
+        return self
+
+    def _refresh_fit_quality(self):
+        """coef_ and R² from the sufficient statistics (no pass over the history)."""
+        theta, count = self._theta, self._count
+        quadratic = np.einsum("ni,nij,nj->n", theta, self._xtx, theta)
+        ss_res = self._yty - 2 * (theta * self._xty).sum(axis=1) + quadratic
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ss_tot = self._yty - self._ysum**2 / count
+            r2 = np.where(ss_tot > 1e-12, 1 - ss_res / ss_tot, 0.0)
+        # Fewer observations than parameters: no meaningful fit
+        enough = count > self.order + 1
+        self.coef_ = np.where(enough[:, None], theta, np.nan)
+        self.r2_ = np.where(enough, r2, np.nan)
+
+    def update(self, new_values):
+        """
+        Append new periods (N x m matrix, NaN where a company has no new value) and
+        update every company's coefficients by recursive least squares. Companies that
+        did not yet have enough observations are re-solved from their statistics.
+        """
+        if self._theta is None:
+            raise ValueError("Model is not fitted")
+        new_values = np.asarray(new_values, dtype=float).reshape(len(self._theta), -1)
+        scaled = new_values / self._scale[:, None]
+
+        for column in scaled.T:
+            has = ~np.isnan(column)
+            y = np.where(has, column, 0.0)
+            x = np.hstack([self._windows, np.ones((len(y), 1))])
+            x = np.where(has[:, None] & ~np.isnan(x), x, 0.0)
+            warm = has & (self._count > self.order + 1)
+
+            # RLS: theta += K (y - x·theta), P -= K (P x)^T with K = P x / (1 + x^T P x)
+            px = np.einsum("nij,nj->ni", self._inverse, x)
+            gain = px / (1 + (x * px).sum(axis=1))[:, None]
+            error = y - (x * self._theta).sum(axis=1)
+            self._theta = np.where(
+                warm[:, None], self._theta + gain * error[:, None], self._theta
+            )
+            self._inverse = np.where(
+                warm[:, None, None],
+                self._inverse - np.einsum("ni,nj->nij", gain, px),
+                self._inverse,
+            )
+
+            self._xtx += np.einsum("ni,nj->nij", x, x)
+            self._xty += x * y[:, None]
+            self._yty += y**2
+            self._ysum += y
+            self._count += has
+
+            cold = has & ~warm & (self._count > self.order + 1)
+            if cold.any():
+                self._inverse[cold] = np.linalg.pinv(self._xtx[cold])
+                self._theta[cold] = np.einsum(
+                    "nij,nj->ni", self._inverse[cold], self._xty[cold]
+                )
+
+            rolled = np.hstack([self._windows[:, 1:], column[:, None]])
+            self._windows = np.where(has[:, None], rolled, self._windows)
+
+        self._refresh_fit_quality()
+        return self
+
+    def _roll(self, window, coef, steps):
+        lags, intercept = coef[:, : self.order], coef[:, self.order]
+        projected = np.empty((len(window), steps))
+        for step in range(steps):
+            value = (window * lags).sum(axis=1) + intercept
+            projected[:, step] = value
+            window = np.hstack([window[:, 1:], value[:, None]])
+        return projected
+
+    def forecast(self, steps=5):
+        """Roll every fitted company forward `steps` periods (N x steps)."""
+        if self.coef_ is None:
+            raise ValueError("Model is not fitted")
+        return self._roll(self._windows, self.coef_, steps) * self._scale[:, None]
+
+    def forecast_histories(self, histories, ids, steps=5):
+        """
+        Forecast new histories with the saved coefficients (and scale) of the companies
+        `ids` instead of refitting. Returns (forecast N x steps, R² per row); rows whose
+        company is unknown or has no fit, or whose history is shorter than the order,
+        are NaN.
+        """
+        if self.coef_ is None or self.ids_ is None:
+            raise ValueError("Model is not fitted with company ids")
+        position = {company: i for i, company in enumerate(self.ids_)}
+        rows = np.array([position.get(str(c), -1) for c in ids], dtype=np.int64)
+        known = rows >= 0
+        rows = np.where(known, rows, 0)
+
+        windows, valid = tail_windows(histories, self.order)
+        coef = np.where((known & valid)[:, None], self.coef_[rows], np.nan)
+        scale = self._scale[rows]
+        projected = self._roll(windows / scale[:, None], coef, steps)
+        return projected * scale[:, None], np.where(
+            known & valid, self.r2_[rows], np.nan
+        )
+
+    def fit_forecast(self, histories, steps=5):
+        """Fit a batch of histories and return (forecast N x steps, R² per company)."""
+        self.fit(histories)
+        return self.forecast(steps), self.r2_
@@ -0,0 +1,230 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+
+INDEX_SUFFIX = ".index.json"
+
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+def write_model_index(model_path, metadata, timestamp, ids=None):
+    """
+    Write the metadata sidecar of a saved model (<name>.index.json next to
+    <name>.joblib) so the registry can index it without unpickling the model.
+    """
+    index = {"metadata": metadata, "timestamp": timestamp}
+    if ids is not None:
+        index["ids"] = [str(company) for company in ids]
+    with open(model_path[: -len(".joblib")] + INDEX_SUFFIX, "w") as f:
+        json.dump(index, f, default=_to_json)
+
+
+class ModelRegistry:
+    """
+    Read-only registry of models saved by ModelTrainer.
+
+    Only metadata is indexed (from the .index.json sidecar, or by loading the model
+    once for files saved without one); models are loaded on first use and at most
+    `max_resident` of them are kept, least recently used first out. Every refresh
+    stats the model files, so deleted or overwritten models are dropped from the
+    index and the cache. Callers must treat returned models as immutable
+    (inference only).
+    """
+
+    def __init__(self, models_dir="models", max_resident=8):
+        self.models_dir = models_dir
+        self.max_resident = max_resident
+        self._lock = threading.Lock()
+        self._loaded = OrderedDict()
+        self._metadata = {}
+        self._ids = {}
+        self._mtimes = {}
+        self._forecasters = {}
+        self._panels = {}
+
+    def _model_path(self, name):
+        return os.path.join(self.models_dir, f"{name}.joblib")
+
+    def refresh(self, force=False):
+        """Re-index models whose files were added, replaced or deleted."""
+        mtimes = {}
+        if os.path.isdir(self.models_dir):
+            for f in os.listdir(self.models_dir):
+                if not f.endswith(".joblib"):
+                    continue
+                try:
+                    mtimes[f[: -len(".joblib")]] = os.stat(
+                        os.path.join(self.models_dir, f)
+                    ).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+        if not force and mtimes == self._mtimes:
+            return
+
+        with self._lock:
+            for name in set(self._mtimes) - set(mtimes):
+                self._forget(name)
+            for name, mtime in mtimes.items():
+                if force or self._mtimes.get(name) != mtime:
+                    self._forget(name)
+                    self._index(name)
+            self._mtimes = mtimes
+            self._rebuild_forecaster_index()
+            self._rebuild_panel_index()
+
+    def _forget(self, name):
+        self._loaded.pop(name, None)
+        self._metadata.pop(name, None)
+        self._ids.pop(name, None)
+
+    def _index(self, name):
+        sidecar = os.path.join(self.models_dir, f"{name}{INDEX_SUFFIX}")
+        if os.path.exists(sidecar):
+            with open(sidecar) as f:
+                index = json.load(f)
+            self._metadata[name] = {
+                **index["metadata"],
+                "timestamp": index.get("timestamp", ""),
+            }
+            self._ids[name] = index.get("ids")
+            return
+
+        # Saved without a sidecar: read the metadata once, do not keep the model
+        saved = joblib.load(self._model_path(name))
+        model = saved
+        if isinstance(saved, dict) and "metadata" in saved:
+            model = saved["model"]
+            self._metadata[name] = {
+                **saved["metadata"],
+                "timestamp": saved.get("timestamp", ""),
+            }
+        else:
+            self._metadata[name] = {}
+        ids = getattr(model, "ids_", None)
+        self._ids[name] = [str(company) for company in ids] if ids else None
+
+    def _load(self, name):
+        """Model `name` from the cache, loading (and evicting) as needed."""
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                return self._loaded[name]
+            saved = joblib.load(self._model_path(name))
+            model = (
+                saved["model"]
+                if isinstance(saved, dict) and "metadata" in saved
+                else saved
+            )
+            self._loaded[name] = model
+            while len(self._loaded) > max(1, self.max_resident):
+                self._loaded.popitem(last=False)
+            return model
+
+    def _rebuild_forecaster_index(self):
+        index = {}
+        for name, metadata in self._metadata.items():
+            if metadata.get("algorithm") != "CashFlowForecaster":
+                continue
+            key = (metadata.get("sector", "default"), metadata.get("horizon", 1))
+            current = index.get(key)
+            if current is None or metadata["timestamp"] > current[0]:
+                index[key] = (metadata["timestamp"], name)
+        self._forecasters = {key: name for key, (_, name) in index.items()}
+
+    def _rebuild_panel_index(self):
+        # Each company is served by the newest AR panel that contains it
+        panels = sorted(
+            (
+                (metadata["timestamp"], name)
+                for name, metadata in self._metadata.items()
+                if metadata.get("algorithm") == "AutoregressivePanel"
+            ),
+            reverse=True,
+        )
+        index = {}
+        for _, name in panels:
+            for company in self._ids.get(name) or ():
+                index.setdefault(company, name)
+        self._panels = index
+
+    def get(self, model_name):
+        """Return a model by name, loading it on first use."""
+        self.refresh()
+        if model_name not in self._metadata:
+            raise FileNotFoundError(f"Model {model_name} not found")
+        return self._load(model_name)
+
+    def metadata(self, model_name):
+        self.refresh()
+        return self._metadata.get(model_name, {})
+
+    def names(self, algorithm, **match):
+        """
+        Names of the saved models with the given algorithm (and metadata values equal
+        to `match`, e.g. target_column="target_pe"), newest first.
+        """
+        self.refresh()
+        candidates = [
+            (metadata.get("timestamp", ""), name)
+            for name, metadata in self._metadata.items()
+            if metadata.get("algorithm") == algorithm
+            and all(metadata.get(key) == value for key, value in match.items())
+        ]
+        return [name for _, name in sorted(candidates, reverse=True)]
+
+    def latest(self, algorithm, **match):
+        """Name of the most recently saved model matching `names`, or None."""
+        names = self.names(algorithm, **match)
+        return names[0] if names else None
+
+    def get_forecaster(self, sector="default", horizon=1):
+        """
+        Latest cash-flow forecaster registered for (sector, horizon), falling back
+        to the "default" sector. Returns None if nothing is registered.
+        """
+        self.refresh()
+        name = self._forecasters.get((sector, horizon)) or self._forecasters.get(
+            ("default", horizon)
+        )
+        return self._load(name) if name else None
+
+    def get_panel(self, company):
+        """
+        Latest AR panel model (AutoregressivePanel) fitted on `company`, or None.
+        """
+        self.refresh()
+        name = self._panels.get(str(company))
+        return self._load(name) if name else None
+
+    def best_forecaster(self, sector="default", steps=5):
+        """
+        Forecaster best suited to a `steps`-ahead projection: the shortest horizon
+        that covers all steps in one call, otherwise the longest available horizon.
+        Sector-specific models take precedence over "default".
+        """
+        self.refresh()
+        for candidate in (sector, "default"):
+            horizons = sorted(h for s, h in self._forecasters if s == candidate)
+            if not horizons:
+                continue
+            covering = [h for h in horizons if h >= steps]
+            horizon = covering[0] if covering else horizons[-1]
+            return self._load(self._forecasters[(candidate, horizon)])
+        return None
+
+    def list_forecasters(self):
+        self.refresh()
+        return [
+            {"sector": sector, "horizon": horizon, "model_name": name}
+            for (sector, horizon), name in sorted(self._forecasters.items())
+        ]
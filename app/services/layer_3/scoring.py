@@ -0,0 +1,82 @@
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+
+# Model loaded once per worker process by the pool initializer
+_worker_model = None
+
+
+def init_scoring_worker(model_path):
+    """Process-pool initializer: load the saved model once per worker."""
+    global _worker_model
+    saved = joblib.load(model_path)
+    _worker_model = saved["model"] if isinstance(saved, dict) else saved
+
+
+def score_chunk(X, model=None):
+    """
+    Score one feature matrix: anomaly score (-decision_function, higher is more
+    anomalous) and label (-1 anomaly, 1 normal), as IsolationForest.predict would.
+    """
+    model = model if model is not None else _worker_model
+    decision = model.decision_function(X)
+    return -decision, np.where(decision < 0, -1, 1)
+
+
+def iter_table_chunks(path, chunk_size):
+    """
+    Yield (DataFrame chunk, fraction of the input consumed) from a CSV or Parquet
+    file without loading it whole. Parquet requires pyarrow.
+    """
+    if path.lower().endswith((".parquet", ".pq")):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        total = max(parquet_file.metadata.num_rows, 1)
+        done = 0
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            chunk = batch.to_pandas()
+            done += len(chunk)
+            yield chunk, done / total
+        return
+
+    total = max(os.path.getsize(path), 1)
+    with open(path, "rb") as handle:
+        for chunk in pd.read_csv(handle, chunksize=chunk_size):
+            # Buffered position, so the fraction is approximate until the end
+            yield chunk, min(handle.tell() / total, 1.0)
+
+
+class ChunkWriter:
+    """Append scored chunks to a CSV or Parquet output file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.lower().endswith((".parquet", ".pq"))
+        self._writer = None
+        self._started = False
+
+    def write(self, chunk):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            chunk.to_csv(
+                self.path,
+                mode="a" if self._started else "w",
+                header=not self._started,
+                index=False,
+            )
+        self._started = True
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
@@ -0,0 +1,193 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class SectorIndex:
+    """
+    Per-sector PE, growth and leverage statistics built from the CSV files in the
+    data directory.
+
+    Each file's per-sector values are cached with the file's (mtime, size); a
+    refresh re-reads only new or changed files and recomputes only the sectors they
+    touch. Lookups are dictionary hits on precomputed statistics.
+    """
+
+    SECTOR_COLUMNS = ("sector", "industry")
+    METRIC_COLUMNS = {
+        "pe": ("pe_ratio", "pe", "target_pe"),
+        "growth": (
+            "earnings_growth_rate",
+            "earnings_growth",
+            "projected_growth",
+            "revenue_growth",
+        ),
+        "debt_to_equity": ("debt_to_equity",),
+    }
+    # PE is derived from price / EPS when no PE column exists
+    PRICE_COLUMNS = ("price",)
+    EARNINGS_COLUMNS = ("earnings_per_share", "eps", "earnings")
+    PERCENTILES = (10, 25, 50, 75, 90)
+
+    def __init__(self, data_dir="data"):
+        self.data_dir = data_dir
+        self._lock = threading.Lock()
+        self._files = {}
+        self._stats = {}
+
+    @staticmethod
+    def normalize(sector):
+        """Sector key: lower-case, words joined by underscores."""
+        return "_".join(str(sector).strip().lower().replace("-", " ").split())
+
+    def refresh(self, force=False):
+        """
+        Re-read new or changed CSV files and recompute the sectors they touch.
+        Every CSV entry is stat-ed (a file rewritten in place does not change the
+        directory); `force` re-reads all files regardless of their (mtime, size).
+        """
+        if not os.path.isdir(self.data_dir):
+            return
+
+        with self._lock:
+            current = {}
+            for name in os.listdir(self.data_dir):
+                if name.endswith(".csv"):
+                    stat = os.stat(os.path.join(self.data_dir, name))
+                    current[name] = (stat.st_mtime, stat.st_size)
+
+            affected = set()
+            for name in set(self._files) - set(current):
+                affected.update(self._files.pop(name)[1])
+            for name, signature in current.items():
+                cached = self._files.get(name)
+                if not force and cached is not None and cached[0] == signature:
+                    continue
+                if cached is not None:
+                    affected.update(cached[1])
+                values = self._read_file(os.path.join(self.data_dir, name))
+                self._files[name] = (signature, values)
+                affected.update(values)
+
+            for sector in affected:
+                self._recompute(sector)
+
+    def _read_file(self, path):
+        """{sector: {metric: values}} for one CSV (empty if it has no sector data)."""
+        try:
+            header = pd.read_csv(path, nrows=0).columns
+        except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError):
+            return {}
+
+        sector_column = next((c for c in self.SECTOR_COLUMNS if c in header), None)
+        one_hot = [c for c in header if c.startswith("industry_")]
+        if sector_column is None and not one_hot:
+            return {}
+        wanted = {sector_column, *one_hot, *self.PRICE_COLUMNS, *self.EARNINGS_COLUMNS}
+        for candidates in self.METRIC_COLUMNS.values():
+            wanted.update(candidates)
+        df = pd.read_csv(path, usecols=[c for c in header if c in wanted])
+
+        if sector_column is not None:
+            sectors = df[sector_column].map(
+                lambda v: self.normalize(v) if pd.notna(v) else None
+            )
+        else:
+            # One-hot industry columns (pe.csv schema): industry_tech -> "tech"
+            flags = df[one_hot].apply(pd.to_numeric, errors="coerce").fillna(0)
+            sectors = (
+                flags.idxmax(axis=1)
+                .str[len("industry_") :]
+                .where(flags.max(axis=1) > 0)
+            )
+
+        metrics = {}
+        for metric, candidates in self.METRIC_COLUMNS.items():
+            column = next((c for c in candidates if c in df.columns), None)
+            if column is not None:
+                metrics[metric] = pd.to_numeric(df[column], errors="coerce")
+        if "pe" not in metrics:
+            price = next((c for c in self.PRICE_COLUMNS if c in df.columns), None)
+            earnings = next((c for c in self.EARNINGS_COLUMNS if c in df.columns), None)
+            if price and earnings:
+                eps = pd.to_numeric(df[earnings], errors="coerce")
+                metrics["pe"] = pd.to_numeric(df[price], errors="coerce") / eps.where(
+                    eps > 0
+                )
+        if "pe" in metrics:
+            # Only meaningful (positive, finite) PE ratios enter the statistics
+            pe = metrics["pe"]
+            metrics["pe"] = pe.where((pe > 0) & np.isfinite(pe))
+
+        result = {}
+        for sector, rows in sectors.groupby(sectors).groups.items():
+            result[sector] = {
+                metric: values.loc[rows].dropna().to_numpy(dtype=float)
+                for metric, values in metrics.items()
+            }
+        return result
+
+    def _recompute(self, sector):
+        parts = [
+            values[sector] for _, values in self._files.values() if sector in values
+        ]
+        if not parts:
+            self._stats.pop(sector, None)
+            return
+        stats = {}
+        for metric in self.METRIC_COLUMNS:
+            values = np.concatenate([p.get(metric, np.empty(0)) for p in parts])
+            if len(values) == 0:
+                continue
+            percentiles = np.percentile(values, self.PERCENTILES)
+            stats[metric] = {
+                "count": int(len(values)),
+                "mean": float(values.mean()),
+                **{f"p{q}": float(v) for q, v in zip(self.PERCENTILES, percentiles)},
+            }
+        if stats:
+            self._stats[sector] = stats
+        else:
+            self._stats.pop(sector, None)
+
+    def get(self, sector):
+        """Statistics of one sector, or None if the sector is unknown."""
+        if sector is None:
+            return None
+        self.refresh()
+        key = self.normalize(sector)
+        if key in self._stats:
+            return self._stats[key]
+        # Abbreviated keys from one-hot columns: "technology" -> "tech"; the longest
+        # matching key wins so the result does not depend on file order
+        prefix = max(
+            (s for s in self._stats if key.startswith(s)), key=len, default=None
+        )
+        return self._stats[prefix] if prefix else None
+
+    def sector_data(self, sector):
+        """
+        Sector statistics in the sector_data / sector_metrics request format
+        (avg_pe, high_pe, low_pe, avg_growth, avg_debt_to_equity); empty if unknown.
+        """
+        stats = self.get(sector)
+        if not stats:
+            return {}
+        data = {}
+        if "pe" in stats:
+            data.update(
+                avg_pe=stats["pe"]["mean"],
+                high_pe=stats["pe"]["p90"],
+                low_pe=stats["pe"]["p10"],
+            )
+        if "growth" in stats:
+            data["avg_growth"] = stats["growth"]["mean"]
+        if "debt_to_equity" in stats:
+            data["avg_debt_to_equity"] = stats["debt_to_equity"]["mean"]
+        return data
+
+    def sectors(self):
+        self.refresh()
+        return dict(sorted(self._stats.items()))
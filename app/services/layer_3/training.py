@@ -1,4 +1,7 @@
 import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import joblib
@@ -11,9 +14,22 @@ from sklearn.linear_model import LinearRegression, Ridge, Lasso
 from sklearn.pipeline import Pipeline
 import matplotlib.pyplot as plt
 from datetime import datetime
+from app.services.layer_3.forecasting import (
+    AutoregressiveForecaster,
+    CashFlowForecaster,
+)
+from app.services.layer_3.registry import INDEX_SUFFIX, write_model_index
+from app.services.layer_3.scoring import (
+    ChunkWriter,
+    init_scoring_worker,
+    iter_table_chunks,
+    score_chunk,
+)
 
 
 class ModelTrainer:
+    SCORING_OUTPUT_SUFFIXES = (".csv", ".parquet")
+
     def __init__(self, data_dir="data", models_dir="models"):
         self.data_dir = data_dir
         self.models_dir = models_dir
@@ -40,6 +56,8 @@ class ModelTrainer:
         """Save a trained model with optional metadata."""
         model_path = os.path.join(self.models_dir, f"{model_name}.joblib")
 
+        index_path = os.path.join(self.models_dir, f"{model_name}{INDEX_SUFFIX}")
+
         # If metadata provided, store it with the model
         if metadata:
             save_data = {
@@ -48,8 +66,17 @@ class ModelTrainer:
                 "timestamp": datetime.now().isoformat(),
             }
             joblib.dump(save_data, model_path)
+            # Sidecar for ModelRegistry, which indexes without loading models
+            write_model_index(
+                model_path,
+                metadata,
+                save_data["timestamp"],
+                ids=getattr(model, "ids_", None),
+            )
         else:
             joblib.dump(model, model_path)
+            if os.path.exists(index_path):
+                os.remove(index_path)
 
         return model_path
 
@@ -234,6 +261,324 @@ class ModelTrainer:
 
         return model, metadata, outliers
 
+    def scoring_output_filename(self, filename, output_filename=None):
+        """
+        Name of the scoring output file inside the data directory. Client-given names
+        are reduced to their base name, must end in .csv or .parquet and must not
+        name an existing file.
+        """
+        if output_filename is None:
+            stem = os.path.splitext(os.path.basename(filename))[0]
+            return f"{stem}_scores_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        output_filename = os.path.basename(output_filename)
+        if not output_filename.lower().endswith(self.SCORING_OUTPUT_SUFFIXES):
+            raise ValueError(
+                f"Output file {output_filename} must end with "
+                f"{' or '.join(self.SCORING_OUTPUT_SUFFIXES)}"
+            )
+        if os.path.exists(os.path.join(self.data_dir, output_filename)):
+            raise FileExistsError(f"Output file {output_filename} already exists")
+        return output_filename
+
+    def score_anomaly_file(
+        self,
+        model_name,
+        filename,
+        output_filename=None,
+        chunk_size=100000,
+        max_workers=None,
+        progress_callback=None,
+    ):
+        """
+        Score a CSV/Parquet file from the data directory against a saved Isolation
+        Forest without loading it into memory. Chunks are scored across a process
+        pool (the model is loaded once per worker) and appended in input order to an
+        output file with anomaly_score and is_anomaly columns. At most two chunks per
+        worker are in flight, so memory stays bounded by chunk_size.
+
+        progress_callback, if given, is called after each chunk with a dict of
+        rows_scored, num_outliers, chunks and progress (fraction of the input).
+        """
+        saved = self.load_model(model_name)
+        metadata = saved.get("metadata", {}) if isinstance(saved, dict) else {}
+        if metadata.get("algorithm") != "IsolationForest":
+            raise ValueError(f"Model {model_name} is not an anomaly detection model")
+        feature_columns = metadata["feature_columns"]
+
+        input_path = os.path.join(self.data_dir, filename)
+        if not os.path.exists(input_path):
+            raise FileNotFoundError(f"File {filename} not found")
+        output_filename = self.scoring_output_filename(filename, output_filename)
+        output_path = os.path.join(self.data_dir, output_filename)
+        model_path = os.path.join(self.models_dir, f"{model_name}.joblib")
+
+        status = {"rows_scored": 0, "num_outliers": 0, "chunks": 0, "progress": 0.0}
+        writer = ChunkWriter(output_path)
+
+        def features(chunk):
+            missing = [c for c in feature_columns if c not in chunk.columns]
+            if missing:
+                raise ValueError(f"Missing feature columns: {missing}")
+            return (
+                chunk[feature_columns]
+                .apply(pd.to_numeric, errors="coerce")
+                .fillna(0.0)
+                .to_numpy(dtype=float)
+            )
+
+        def write(chunk, fraction, scores, labels):
+            writer.write(chunk.assign(anomaly_score=scores, is_anomaly=labels == -1))
+            status["rows_scored"] += len(chunk)
+            status["num_outliers"] += int((labels == -1).sum())
+            status["chunks"] += 1
+            status["progress"] = fraction
+            if progress_callback is not None:
+                progress_callback(dict(status))
+
+        max_workers = max_workers or os.cpu_count() or 1
+        chunks = iter_table_chunks(input_path, chunk_size)
+        try:
+            if max_workers > 1:
+                with ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    initializer=init_scoring_worker,
+                    initargs=(model_path,),
+                ) as executor:
+                    pending = deque()
+                    for chunk, fraction in chunks:
+                        future = executor.submit(score_chunk, features(chunk))
+                        pending.append((chunk, fraction, future))
+                        if len(pending) >= 2 * max_workers:
+                            chunk, fraction, future = pending.popleft()
+                            write(chunk, fraction, *future.result())
+                    while pending:
+                        chunk, fraction, future = pending.popleft()
+                        write(chunk, fraction, *future.result())
+            else:
+                model = saved["model"]
+                for chunk, fraction in chunks:
+                    write(chunk, fraction, *score_chunk(features(chunk), model))
+        finally:
+            writer.close()
+
+        rows = status["rows_scored"]
+        return {
+            "output_filename": output_filename,
+            "rows_scored": rows,
+            "num_outliers": status["num_outliers"],
+            "outlier_percentage": (status["num_outliers"] / rows) * 100 if rows else 0,
+            "chunks": status["chunks"],
+        }
+
+    def _cash_flow_series(self, df, cash_flow_columns=None):
+        """Extract per-company cash-flow series from fcf_1..fcf_T style columns."""
+        if cash_flow_columns is None:
+            pattern = re.compile(r"^(?:fcf|free_cash_flow|cash_flow)_(\d+)$")
+            numbered = sorted(
+                (int(m.group(1)), c) for c in df.columns if (m := pattern.match(c))
+            )
+            cash_flow_columns = [c for _, c in numbered]
+        if not cash_flow_columns:
+            raise ValueError("No cash-flow columns (fcf_1..fcf_T) found")
+        return df[cash_flow_columns].to_numpy(dtype=float), cash_flow_columns
+
+    def train_cash_flow_forecaster(
+        self,
+        filename,
+        sector="default",
+        horizon=1,
+        window=3,
+        cash_flow_columns=None,
+        hyperparams=None,
+        save=True,
+    ):
+        """
+        Train a CashFlowForecaster offline on a CSV of cash-flow series (one company
+        per row, columns fcf_1..fcf_T) and register it by sector/horizon.
+        If the file has a "sector" column, only that sector's rows are used
+        (all rows for sector "default").
+        """
+        df = self.load_data(filename)
+        if sector != "default" and "sector" in df.columns:
+            df = df[df["sector"] == sector]
+        series, cash_flow_columns = self._cash_flow_series(df, cash_flow_columns)
+
+        if hyperparams is None:
+            hyperparams = {"n_estimators": 100, "random_state": 42}
+
+        forecaster = CashFlowForecaster(
+            RandomForestRegressor(**hyperparams),
+            window=window,
+            horizon=horizon,
+            sector=sector,
+        )
+        X, y = forecaster.build_dataset(series)
+        if len(X) < 2:
+            raise ValueError("Not enough cash-flow windows to train a forecaster")
+
+        # Hold out companies, not windows, so the score reflects unseen series
+        train_rows, test_rows = train_test_split(
+            np.arange(len(series)), test_size=0.2, random_state=42
+        )
+        X_train, y_train = forecaster.build_dataset(series[train_rows])
+        X_test, y_test = forecaster.build_dataset(series[test_rows])
+        if len(X_test) == 0 or len(X_train) == 0:
+            X_train, y_train, X_test, y_test = X, y, X, y
+
+        forecaster.estimator.fit(X_train, y_train.ravel() if horizon == 1 else y_train)
+        y_pred = forecaster.estimator.predict(X_test)
+        y_true = y_test.ravel() if horizon == 1 else y_test
+        metrics = {
+            "r2_score": r2_score(y_true, y_pred) if len(X_test) > 1 else 0.0,
+            "mse": mean_squared_error(y_true, y_pred),
+            "num_windows": int(len(X)),
+        }
+
+        # Refit on every window before registering
+        forecaster.fit(series)
+        forecaster.metrics = metrics
+
+        metadata = {
+            "algorithm": "CashFlowForecaster",
+            "filename": filename,
+            "sector": sector,
+            "horizon": horizon,
+            "window": window,
+            "hyperparameters": hyperparams,
+            "feature_columns": cash_flow_columns,
+            "metrics": metrics,
+        }
+
+        model_name = (
+            f"cf_{sector}_h{horizon}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        )
+        self.training_history[model_name] = metadata
+
+        if save:
+            self.save_model(forecaster, model_name, metadata)
+
+        return forecaster, metadata
+
+    def train_autoregressive_panel(
+        self, filename, id_column="ticker", order=1, cash_flow_columns=None, save=True
+    ):
+        """
+        Fit a closed-form AR model for every company in a CSV (one company per row,
+        identified by id_column) so later periods can be folded in incrementally.
+        """
+        df = self.load_data(filename)
+        if id_column not in df.columns:
+            raise ValueError(f"ID column '{id_column}' not found in {filename}")
+        series, cash_flow_columns = self._cash_flow_series(df, cash_flow_columns)
+
+        panel = AutoregressiveForecaster(order=order).fit(
+            series, ids=df[id_column].astype(str)
+        )
+        metadata = {
+            "algorithm": "AutoregressivePanel",
+            "filename": filename,
+            "id_column": id_column,
+            "order": order,
+            "feature_columns": cash_flow_columns,
+            "metrics": self._panel_metrics(panel),
+        }
+
+        model_name = f"ar_panel_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self.training_history[model_name] = metadata
+
+        if save:
+            self.save_model(panel, model_name, metadata)
+
+        return panel, metadata
+
+    def _panel_metrics(self, panel):
+        fitted = ~np.isnan(panel.r2_)
+        return {
+            "num_companies": int(len(panel.r2_)),
+            "num_fitted": int(fitted.sum()),
+            "mean_r2_score": float(panel.r2_[fitted].mean()) if fitted.any() else 0.0,
+        }
+
+    def update_cash_flow_forecaster(
+        self,
+        model_name,
+        filename,
+        new_periods=1,
+        n_estimators=10,
+        cash_flow_columns=None,
+        save=True,
+    ):
+        """
+        Fold newly arrived cash-flow periods into a saved forecaster instead of
+        retraining from scratch, and save the result as a new version.
+
+        - CashFlowForecaster: grows n_estimators extra trees (warm_start) on the
+          windows ending in the last new_periods columns of the file only.
+        - AutoregressivePanel: the file holds only the new period columns per company
+          (matched on the panel's id_column); coefficients are updated by recursive
+          least squares.
+        """
+        saved = self.load_model(model_name)
+        if not isinstance(saved, dict) or "metadata" not in saved:
+            raise ValueError(f"Model {model_name} has no metadata")
+        model, metadata = saved["model"], dict(saved["metadata"])
+        df = self.load_data(filename)
+
+        if metadata.get("algorithm") == "CashFlowForecaster":
+            if (
+                metadata.get("sector", "default") != "default"
+                and "sector" in df.columns
+            ):
+                df = df[df["sector"] == metadata["sector"]]
+            series, _ = self._cash_flow_series(df, cash_flow_columns)
+            tails = model.update_tails(series, new_periods)
+            X_new, _ = model.build_dataset(tails)
+            model.partial_fit(tails, n_estimators=n_estimators)
+            metrics = {
+                **metadata.get("metrics", {}),
+                "num_windows": metadata.get("metrics", {}).get("num_windows", 0)
+                + int(len(X_new)),
+                "n_estimators": int(model.estimator.n_estimators),
+            }
+            model.metrics = metrics
+            new_name = (
+                f"cf_{metadata['sector']}_h{metadata['horizon']}_"
+                f"{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            )
+        elif metadata.get("algorithm") == "AutoregressivePanel":
+            id_column = metadata["id_column"]
+            if id_column not in df.columns:
+                raise ValueError(f"ID column '{id_column}' not found in {filename}")
+            values, _ = self._cash_flow_series(df, cash_flow_columns)
+            position = {company: i for i, company in enumerate(model.ids_)}
+            rows = df[id_column].astype(str).map(position)
+            known = rows.notna().to_numpy()
+
+            new_values = np.full((len(model.ids_), values.shape[1]), np.nan)
+            new_values[rows[known].astype(int).to_numpy()] = values[known]
+            model.update(new_values)
+            metrics = {
+                **self._panel_metrics(model),
+                "num_unknown_ids": int((~known).sum()),
+            }
+            new_name = f"ar_panel_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        else:
+            raise ValueError(f"Model {model_name} does not support incremental updates")
+
+        # Never overwrite a saved version (the registry indexes models by name)
+        if os.path.exists(os.path.join(self.models_dir, f"{new_name}.joblib")):
+            new_name = f"{new_name}_{datetime.now().strftime('%f')}"
+
+        metadata.update(
+            {"metrics": metrics, "updated_from": model_name, "update_file": filename}
+        )
+        self.training_history[new_name] = metadata
+
+        if save:
+            self.save_model(model, new_name, metadata)
+
+        return model, metadata
+
     def hyperparameter_tuning(self, filename, target_column, model_type="rf"):
         """
         Perform hyperparameter tuning for the selected model type.
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.layer_3.accuracy import AccuracyStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AccuracyStore(str(tmp_path / "accuracy.db"), window=5)
+
+
+def _expected(predicted, actual, window):
+    predicted, actual = np.asarray(predicted), np.asarray(actual)
+    abs_error = np.abs(predicted - actual)
+    ape = abs_error / np.abs(actual)
+    rolling = pd.Series(ape).ewm(span=window, adjust=False).mean().iloc[-1]
+    return abs_error.mean(), ape.mean(), rolling
+
+
+def test_scores_predictions_when_actuals_arrive(store):
+    predicted = [10.0, 12.0, 9.0, 15.0, 11.0, 8.0, 14.0]
+    actual = [11.0, 10.0, 9.5, 12.0, 11.0, 10.0, 13.0]
+    periods = [f"2024Q{i}" for i in range(len(predicted))]
+
+    store.record_predictions(
+        {"model": "m", "instrument": "AAA", "period": p, "predicted": v}
+        for p, v in zip(periods[:4], predicted[:4])
+    )
+    # Actuals first for the last periods: scored when the predictions arrive
+    assert (
+        store.record_actuals(
+            {"instrument": "AAA", "period": p, "actual": v}
+            for p, v in zip(periods, actual)
+        )
+        == 4
+    )
+    assert (
+        store.record_predictions(
+            {"model": "m", "instrument": "AAA", "period": p, "predicted": v}
+            for p, v in zip(periods[4:], predicted[4:])
+        )
+        == 3
+    )
+
+    metrics = store.metrics(["m"])["m"]
+    mae, mape, rolling = _expected(predicted, actual, window=5)
+    assert metrics["count"] == 7
+    assert metrics["mae"] == pytest.approx(mae)
+    assert metrics["mape"] == pytest.approx(mape)
+    assert metrics["rolling_ape"] == pytest.approx(rolling)
+    assert store.historical_accuracy(["m", "unknown"]) == {"m": round(1 - rolling, 4)}
+
+
+def test_each_prediction_is_scored_once(store):
+    store.record_predictions(
+        [{"model": "m", "instrument": "AAA", "period": "p1", "predicted": 5.0}]
+    )
+    assert store.record_actuals([{"instrument": "AAA", "period": "p1", "actual": 4.0}])
+    # A repeated actual neither replaces the first one nor rescores
+    assert (
+        store.record_actuals([{"instrument": "AAA", "period": "p1", "actual": 8.0}])
+        == 0
+    )
+    assert store.metrics()["m"]["mae"] == 1.0
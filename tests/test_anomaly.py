@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import IsolationForest
+
+from app.services.layer_2.anomaly import AnomalyScorer
+from app.services.layer_2.via import VIA
+from app.services.layer_3.registry import ModelRegistry
+from app.services.layer_3.training import ModelTrainer
+
+REQUEST_FEATURES = list(VIA.ABNORMAL_FEATURES)
+
+
+def _save_forest(trainer, name, columns):
+    model = IsolationForest(random_state=0).fit(
+        np.random.default_rng(0).normal(size=(50, len(columns)))
+    )
+    trainer.save_model(
+        model,
+        name,
+        {"algorithm": "IsolationForest", "feature_columns": list(columns)},
+    )
+
+
+def test_scorer_rejects_missing_features():
+    model = IsolationForest(random_state=0).fit(np.zeros((10, 2)))
+    scorer = AnomalyScorer(model, ["a", "b"])
+    with pytest.raises(ValueError, match="Missing feature columns"):
+        scorer.vectorize([{"a": 1.0}])
+    with pytest.raises(ValueError, match="Missing feature columns"):
+        scorer.vectorize_columns({"a": np.ones(3)})
+    assert scorer.vectorize([{"a": 1.0, "b": 2.0}]).tolist() == [[1.0, 2.0]]
+
+
+def test_only_request_compatible_models_are_served(tmp_path):
+    trainer = ModelTrainer(str(tmp_path / "data"), str(tmp_path / "models"))
+    _save_forest(trainer, "anomaly_features", REQUEST_FEATURES)
+    _save_forest(trainer, "anomaly_raw", ["price", "volume", "beta"])
+
+    via = VIA(model_registry=ModelRegistry(str(tmp_path / "models")))
+    # The newest forest uses other columns, so the compatible one is served
+    assert via.anomaly_model_name == "anomaly_features"
+    with pytest.raises(ValueError, match="Missing feature columns"):
+        via.load_anomaly_model("anomaly_raw")
+
+
+def test_batch_paths_report_schema_mismatch(tmp_path):
+    trainer = ModelTrainer(str(tmp_path / "data"), str(tmp_path / "models"))
+    _save_forest(trainer, "anomaly_features", REQUEST_FEATURES)
+    via = VIA(model_registry=ModelRegistry(str(tmp_path / "models")))
+    prices = list(100 + np.arange(20.0))
+    table = pd.DataFrame({"ticker": ["A"] * 20, "price": prices, "volume": 1000.0})
+
+    assert "anomaly_score" in via.run_abnormal_table(table)[0]
+    # A scorer expecting a feature the extractor does not produce is refused
+    via.anomaly_scorer.feature_columns.append("beta")
+    records = [{"historical_prices": prices, "trading_volumes": [1000.0] * 20}]
+    error = {"error": "Missing feature columns: ['beta']"}
+    assert via.run_abnormal_table(table) == [{"ticker": "A", **error}]
+    assert via.run_ai_driven_abnormal_finding_batch(records) == [error]
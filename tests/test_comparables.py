@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from scipy.stats import trim_mean
+
+from app.services.layer_2.valuation import BatchValuation
+from app.services.layer_2.via import VIA
+from app.services.layer_3.registry import ModelRegistry
+
+
+@pytest.fixture(scope="module")
+def via(tmp_path_factory):
+    return VIA(model_registry=ModelRegistry(str(tmp_path_factory.mktemp("models"))))
+
+
+def test_batch_statistics_match_numpy():
+    rng = np.random.default_rng(3)
+    groups = [rng.uniform(1, 40, size=n) for n in (1, 2, 5, 10, 17)]
+    rows = np.concatenate([[i] * len(g) for i, g in enumerate(groups)])
+    order = rng.permutation(len(rows))
+    eps = np.arange(1.0, len(groups) + 1)
+
+    result = BatchValuation().comparables(
+        rows[order], np.concatenate(groups)[order], len(groups), eps
+    )
+
+    for i, pe in enumerate(groups):
+        assert result["peer_count"][i] == len(pe)
+        assert result["median_pe"][i] == pytest.approx(np.median(pe))
+        assert result["mean_pe"][i] == pytest.approx(pe.mean())
+        assert result["min_pe"][i] == pe.min()
+        assert result["max_pe"][i] == pe.max()
+        expected = trim_mean(pe, 0.2) if len(pe) > 2 else pe.mean()
+        assert result["trimmed_mean_pe"][i] == pytest.approx(expected)
+        assert result["value_median"][i] == pytest.approx(np.median(pe) * eps[i])
+
+
+def test_company_without_peers_has_no_values():
+    result = BatchValuation().comparables([1, 1], [10.0, 20.0], 2, [2.0, 2.0])
+    for key in ("median", "mean", "trimmed_mean"):
+        assert np.isnan(result[f"{key}_pe"][0])
+        assert np.isnan(result[f"value_{key}"][0])
+    assert result["value_trimmed_mean"][1] == 30.0
+
+
+@pytest.mark.parametrize("trim_fraction, expected", [(-0.3, 5.5), (0.9, 5.5)])
+def test_trim_fraction_is_clipped(trim_fraction, expected):
+    result = BatchValuation().comparables(
+        [0] * 10, np.arange(1.0, 11.0), 1, [1.0], trim_fraction=trim_fraction
+    )
+    assert result["trimmed_mean_pe"][0] == pytest.approx(expected)
+
+
+def test_run_comparables_without_peers(via):
+    result = via.run_comparables({"comparable_companies": [], "earnings_per_share": 2})
+    assert result["peer_count"] == 0
+    assert set(result["implied_value_per_share"].values()) == {None}
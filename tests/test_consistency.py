@@ -0,0 +1,33 @@
+import asyncio
+import io
+
+import pytest
+
+from app.services.layer_1.analysis import AnalysisService
+
+CSV = (
+    "a,b,c,comparable_name_1,comparable_pe_1,comparable_name_2,comparable_pe_2\n"
+    "1,1,2,X,15,Y,15\n"
+    "3,4,5,X,,Y,\n"
+    "7,7,7,Z,7,W,7\n"
+)
+
+
+@pytest.fixture(scope="module")
+def service():
+    return AnalysisService()
+
+
+@pytest.mark.parametrize("task", ["Consistency", "Model Consistency"])
+def test_table_batch_matches_per_row_path(service, task):
+    # Per-row /analyze-csv parsing of the same CSV (see routes/api.py)
+    if task == "Consistency":
+        rows = service.transformer.csv_to_json_consistency(io.StringIO(CSV))
+    else:
+        rows = service.transformer.csv_to_json_abnormal(io.StringIO(CSV))
+    expected = [service.via.run_consistency(row) for row in rows]
+
+    results = asyncio.run(
+        service.handle_table_batch(task, "RandomForest", CSV.encode(), "cases.csv")
+    )
+    assert [r["consistency_index"] for r in results] == expected
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.layer_2.via import VIA
+from app.services.layer_3.forecasting import (
+    AutoregressiveForecaster,
+    CashFlowForecaster,
+    tail_windows,
+)
+from app.services.layer_3.registry import ModelRegistry
+from app.services.layer_3.training import ModelTrainer
+
+HISTORIES = {
+    "AAA": [100.0, 110.0, 119.0, 131.0, 140.0, 152.0],
+    "BBB": [50.0, 48.0, 47.0, 45.0, 44.0, 42.0],
+}
+
+
+class _LastValue:
+    """Estimator stub: predicts the last (scaled) value of each window."""
+
+    def predict(self, X):
+        return X[:, -1]
+
+
+@pytest.fixture
+def panel_setup(tmp_path):
+    trainer = ModelTrainer(str(tmp_path / "data"), str(tmp_path / "models"))
+    pd.DataFrame(
+        [
+            {"ticker": t, **{f"fcf_{i + 1}": v for i, v in enumerate(h)}}
+            for t, h in HISTORIES.items()
+        ]
+    ).to_csv(tmp_path / "data" / "panel.csv", index=False)
+    panel, _ = trainer.train_autoregressive_panel("panel.csv")
+    via = VIA(model_registry=ModelRegistry(str(tmp_path / "models")))
+    return panel, via
+
+
+def _dcf_request(**extra):
+    return {
+        "historical_cash_flows": [120.0, 128.0, 139.0, 150.0],
+        "balance_sheet": {"total_equity": 1000, "total_debt": 500},
+        "forecast_model": "autoregressive",
+        **extra,
+    }
+
+
+def test_tail_windows_skip_interior_gaps():
+    windows, valid = tail_windows([[1.0, 2.0, np.nan, 3.0], [np.nan, 4.0]], 2)
+    assert valid.tolist() == [True, False]
+    assert windows[0].tolist() == [2.0, 3.0]
+    assert np.isnan(windows[1]).all()
+
+
+def test_panel_forecast_uses_saved_coefficients():
+    panel = AutoregressiveForecaster().fit(list(HISTORIES.values()), ids=HISTORIES)
+    projection, r2 = panel.forecast_histories(
+        [HISTORIES["BBB"], [1.0, 2.0]], ["BBB", "ZZZ"], steps=3
+    )
+    np.testing.assert_allclose(projection[0], panel.forecast(3)[1])
+    assert r2[0] == panel.r2_[1]
+    assert np.isnan(projection[1]).all() and np.isnan(r2[1])
+
+
+def test_dcf_serves_trained_panel(panel_setup):
+    panel, via = panel_setup
+    result = via.run_ai_driven_dcf(_dcf_request(ticker="AAA"))
+    expected, r2 = panel.forecast_histories(
+        [_dcf_request()["historical_cash_flows"]], ["AAA"], 5
+    )
+    assert result["forecast_mode"] == "autoregressive_panel"
+    assert result["projected_cash_flows"] == [round(v, 2) for v in expected[0]]
+
+    # Unknown tickers still get a per-request fit
+    result = via.run_ai_driven_dcf(_dcf_request(ticker="ZZZ"))
+    assert result["forecast_mode"] == "autoregressive"
+
+
+def test_dcf_batch_serves_trained_panel(panel_setup):
+    panel, via = panel_setup
+    history = _dcf_request()["historical_cash_flows"]
+    df = pd.DataFrame(
+        {
+            "ticker": ["BBB", "ZZZ"],
+            **{f"fcf_{i + 1}": [v, v] for i, v in enumerate(history)},
+            "discount_rate": 0.1,
+            "terminal_growth_rate": 0.02,
+            "forecast_years": 2,
+            "forecast_model": "autoregressive",
+        }
+    )
+    served = via.run_dcf_batch(df)
+    refit = via.run_dcf_batch(df.assign(ticker=["YYY", "ZZZ"]))
+    assert served[1] == refit[1]
+    assert served[0] != refit[0]
+
+
+def test_forecasts_roll_forward_from_last_observed_values():
+    gapped = [1.0, 2.0, np.nan, 3.0, 4.0]
+    compact = [1.0, 2.0, 3.0, 4.0]
+
+    forecaster = CashFlowForecaster(_LastValue(), window=2)
+    np.testing.assert_array_equal(
+        forecaster.forecast_batch([gapped, compact], steps=2)[0], [4.0, 4.0]
+    )
+
+    ar = AutoregressiveForecaster().fit([gapped + [np.nan], compact])
+    np.testing.assert_array_equal(ar._windows[:, -1] * ar._scale, [4.0, 4.0])
@@ -0,0 +1,81 @@
+import shutil
+
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import app.routes.training as training_routes
+from app import create_app
+from app.routes.dependencies import service
+from app.services.layer_2.via import VIA
+from app.services.layer_3.registry import ModelRegistry
+from app.services.layer_3.training import ModelTrainer
+
+REQUEST = {
+    "earnings": 2.0,
+    "growth_metrics": {"projected_growth": 0.1},
+    "sector_data": {"avg_pe": 15, "avg_growth": 0.05, "high_pe": 25, "low_pe": 10},
+}
+
+
+@pytest.fixture
+def via(tmp_path):
+    return VIA(model_registry=ModelRegistry(str(tmp_path)))
+
+
+@pytest.mark.parametrize("price", ["abc", None, 0])
+def test_invalid_price_is_not_evaluated(via, price):
+    result = via.run_neural_pe_analysis({**REQUEST, "price": price})
+    assert result["pe_ratio"] is None
+    assert result["evaluation"] == "Không thể đánh giá (giá không hợp lệ)"
+
+
+def test_valid_price_is_evaluated(via):
+    result = via.run_neural_pe_analysis({**REQUEST, "price": 30.0})
+    assert result["pe_ratio"] == 15.0
+
+
+def test_trained_pe_model_is_served(tmp_path, monkeypatch):
+    trainer = ModelTrainer(str(tmp_path / "data"), str(tmp_path / "models"))
+    shutil.copy("example/training/pe.csv", tmp_path / "data" / "pe.csv")
+    monkeypatch.setattr(training_routes, "trainer", trainer)
+    monkeypatch.setattr(
+        service.via, "model_registry", ModelRegistry(str(tmp_path / "models"))
+    )
+    # Restored after the test so the shared service keeps its own PE model
+    for attribute in (
+        "pe_model_name",
+        "pe_neural_model",
+        "pe_feature_columns",
+        "pe_model_confidence",
+    ):
+        monkeypatch.setattr(service.via, attribute, None)
+
+    response = TestClient(create_app()).post(
+        "/train",
+        json={
+            "model_type": "nn",
+            "csv_filename": "pe.csv",
+            "target_column": "target_pe",
+        },
+    )
+    assert response.status_code == 200
+    assert service.via.pe_model_name == response.json()["model_name"]
+
+
+def test_industry_one_hot_prefers_the_exact_key(via):
+    via.pe_feature_columns = [
+        "industry_tech",
+        "industry_technology",
+        "industry_consumer_goods",
+    ]
+    df = pd.DataFrame(
+        {"industry": ["Technology", "Tech Hardware", "Consumer Goods", None]}
+    )
+    features = via._pe_model_features(df, {})
+    assert features.to_numpy().tolist() == [
+        [0.0, 1.0, 0.0],
+        [1.0, 0.0, 0.0],
+        [0.0, 0.0, 1.0],
+        [0.0, 0.0, 0.0],
+    ]
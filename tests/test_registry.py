@@ -0,0 +1,98 @@
+import os
+
+import joblib
+import pytest
+
+from app.services.layer_3 import registry as registry_module
+from app.services.layer_3.forecasting import AutoregressiveForecaster
+from app.services.layer_3.registry import ModelRegistry
+from app.services.layer_3.training import ModelTrainer
+
+
+@pytest.fixture
+def trainer(tmp_path):
+    return ModelTrainer(str(tmp_path / "data"), str(tmp_path / "models"))
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    calls = []
+    original = registry_module.joblib.load
+
+    def recording_load(path):
+        calls.append(os.path.basename(path))
+        return original(path)
+
+    monkeypatch.setattr(registry_module.joblib, "load", recording_load)
+    return calls
+
+
+def _save(trainer, name, **metadata):
+    trainer.save_model({"name": name}, name, {"algorithm": "Stub", **metadata})
+
+
+def test_refresh_indexes_sidecars_without_loading_models(trainer, loads):
+    _save(trainer, "a", target_column="x")
+    _save(trainer, "b", target_column="y")
+    registry = ModelRegistry(trainer.models_dir)
+
+    assert sorted(registry.names("Stub")) == ["a", "b"]
+    assert registry.metadata("a")["target_column"] == "x"
+    assert loads == []
+
+    assert registry.get("a") == {"name": "a"}
+    assert registry.get("a") == {"name": "a"}
+    assert loads == ["a.joblib"]
+
+
+def test_panel_index_reads_ids_from_sidecar(trainer, loads):
+    panel = AutoregressiveForecaster().fit([[1.0, 2.0, 3.0]], ids=["AAA"])
+    trainer.save_model(panel, "panel", {"algorithm": "AutoregressivePanel"})
+    registry = ModelRegistry(trainer.models_dir)
+
+    assert registry.get_panel("BBB") is None
+    assert loads == []
+    assert registry.get_panel("AAA").ids_ == ["AAA"]
+
+
+def test_deleted_and_replaced_models_are_dropped(trainer):
+    _save(trainer, "a")
+    _save(trainer, "b")
+    registry = ModelRegistry(trainer.models_dir)
+    assert registry.get("a") == {"name": "a"}
+
+    os.remove(os.path.join(trainer.models_dir, "a.joblib"))
+    trainer.save_model({"name": "b2"}, "b", {"algorithm": "Other"})
+    path = os.path.join(trainer.models_dir, "b.joblib")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    assert registry.names("Stub") == []
+    assert registry.names("Other") == ["b"]
+    assert registry.get("b") == {"name": "b2"}
+    with pytest.raises(FileNotFoundError):
+        registry.get("a")
+    assert "a" not in registry._loaded
+
+
+def test_resident_models_are_bounded(trainer):
+    for name in ("a", "b", "c"):
+        _save(trainer, name)
+    registry = ModelRegistry(trainer.models_dir, max_resident=2)
+
+    for name in ("a", "b", "a", "c"):
+        registry.get(name)
+    assert list(registry._loaded) == ["a", "c"]
+
+
+def test_models_saved_without_sidecar_are_indexed(trainer):
+    os.makedirs(trainer.models_dir, exist_ok=True)
+    joblib.dump(
+        {"model": 1, "metadata": {"algorithm": "Stub"}, "timestamp": "t"},
+        os.path.join(trainer.models_dir, "legacy.joblib"),
+    )
+    registry = ModelRegistry(trainer.models_dir)
+
+    assert registry.metadata("legacy") == {"algorithm": "Stub", "timestamp": "t"}
+    assert registry._loaded == {}
+    assert registry.get("legacy") == 1
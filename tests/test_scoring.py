@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import IsolationForest
+
+from app.services.layer_3.training import ModelTrainer
+
+COLUMNS = ["price", "volume"]
+
+
+@pytest.fixture
+def trainer(tmp_path):
+    trainer = ModelTrainer(str(tmp_path / "data"), str(tmp_path / "models"))
+    values = np.random.default_rng(0).normal(size=(40, len(COLUMNS)))
+    pd.DataFrame(values, columns=COLUMNS).to_csv(
+        tmp_path / "data" / "ticks.csv", index=False
+    )
+    trainer.save_model(
+        IsolationForest(random_state=0).fit(values),
+        "forest",
+        {"algorithm": "IsolationForest", "feature_columns": COLUMNS},
+    )
+    return trainer
+
+
+def test_output_is_written_inside_data_dir(trainer, tmp_path):
+    result = trainer.score_anomaly_file(
+        "forest", "ticks.csv", output_filename="../../escaped.csv", max_workers=1
+    )
+    assert result["output_filename"] == "escaped.csv"
+    assert result["rows_scored"] == 40
+    assert (tmp_path / "data" / "escaped.csv").exists()
+    assert not (tmp_path.parent / "escaped.csv").exists()
+
+
+@pytest.mark.parametrize("name", ["scores.txt", "/etc/passwd", "..", ""])
+def test_output_requires_table_suffix(trainer, name):
+    with pytest.raises(ValueError, match="must end with"):
+        trainer.score_anomaly_file(
+            "forest", "ticks.csv", output_filename=name, max_workers=1
+        )
+
+
+def test_existing_output_is_not_overwritten(trainer, tmp_path):
+    with pytest.raises(FileExistsError):
+        trainer.score_anomaly_file(
+            "forest", "ticks.csv", output_filename="ticks.csv", max_workers=1
+        )
+    assert len(pd.read_csv(tmp_path / "data" / "ticks.csv").columns) == 2
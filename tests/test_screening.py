@@ -0,0 +1,107 @@
+import pandas as pd
+import pytest
+
+from app.services.layer_2.screening import FinancialScreener
+from app.services.layer_2.via import VIA
+from app.services.layer_3.registry import ModelRegistry
+
+# Một công ty an toàn, một vùng xám, một nguy hiểm và một thiếu phần lớn các cột
+STATEMENTS = [
+    {
+        "ticker": "SAFE",
+        "current_assets": 500,
+        "current_liabilities": 200,
+        "total_assets": 1000,
+        "retained_earnings": 400,
+        "ebit": 150,
+        "market_cap": 1500,
+        "total_liabilities": 400,
+        "sales": 1200,
+        "net_income": 100,
+        "operating_cash_flow": 130,
+        "roa": 0.1,
+        "prev_roa": 0.08,
+        "long_term_debt": 100,
+        "prev_long_term_debt": 150,
+        "prev_total_assets": 950,
+        "current_ratio": 2.5,
+        "prev_current_ratio": 2.2,
+        "shares_outstanding": 100,
+        "prev_shares_outstanding": 100,
+        "gross_margin": 0.4,
+        "prev_gross_margin": 0.38,
+        "asset_turnover": 1.2,
+        "prev_asset_turnover": 1.1,
+    },
+    {
+        "ticker": "GREY",
+        "current_assets": 300,
+        "current_liabilities": 250,
+        "total_assets": 1000,
+        "retained_earnings": 150,
+        "ebit": 60,
+        "market_cap": 700,
+        "total_liabilities": 600,
+        "sales": 1000,
+        "net_income": 30,
+        "operating_cash_flow": 20,
+        "roa": 0.03,
+        "prev_roa": 0.04,
+        "long_term_debt": 300,
+        "prev_long_term_debt": 280,
+        "prev_total_assets": 1000,
+        "current_ratio": 1.2,
+        "prev_current_ratio": 1.3,
+        "shares_outstanding": 110,
+        "prev_shares_outstanding": 100,
+        "gross_margin": 0.25,
+        "prev_gross_margin": 0.24,
+        "asset_turnover": 1.0,
+        "prev_asset_turnover": 1.0,
+    },
+    {
+        "ticker": "RISK",
+        "current_assets": 100,
+        "current_liabilities": 300,
+        "total_assets": 1000,
+        "retained_earnings": -200,
+        "ebit": -50,
+        "market_cap": 100,
+        "total_liabilities": 900,
+        "sales": 400,
+        "net_income": -80,
+        "operating_cash_flow": -10,
+        "long_term_debt": 600,
+        "prev_long_term_debt": 500,
+        "prev_total_assets": 1100,
+        "shares_outstanding": 150,
+        "prev_shares_outstanding": 100,
+    },
+    {"ticker": "SPARSE", "total_assets": 500, "ebit": 40, "net_income": 10},
+]
+
+
+def test_screen_matches_scalar_risk_mitigation(tmp_path):
+    via = VIA(model_registry=ModelRegistry(str(tmp_path)))
+    screened = (
+        FinancialScreener()
+        .screen(pd.DataFrame(STATEMENTS), sort_by="z_score")
+        .set_index("ticker")
+    )
+    assert screened["rank"].tolist() == [1, 2, 3, 4]
+
+    for statement in STATEMENTS:
+        financial = {k: v for k, v in statement.items() if k != "ticker"}
+        scalar = via.run_risk_mitigation(
+            {"financial_statements": financial, "stock_price_history": []}
+        )
+        row = screened.loc[statement["ticker"]]
+        z = scalar["altman_z_score"]
+        assert row["z_score"] == pytest.approx(z["score"], abs=0.006)
+        assert row["z_evaluation"] == z["evaluation"]
+        assert row["z_risk_level"] == z["risk_level"]
+        for name, value in z["components"].items():
+            assert row[name] == pytest.approx(value, abs=5e-5)
+        assert row["f_score"] == scalar["piotroski_f_score"]["score"]
+        assert row["f_evaluation"] == scalar["piotroski_f_score"]["evaluation"]
+        assert row["risk_rating"] == scalar["overall_risk_assessment"]["risk_rating"]
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from app.services.layer_3.sectors import SectorIndex
+
+
+def _write(path, sector, pe_ratios):
+    pd.DataFrame({"sector": sector, "pe_ratio": pe_ratios}).to_csv(path, index=False)
+
+
+def test_statistics_match_numpy(tmp_path):
+    _write(tmp_path / "a.csv", "Real Estate", [10.0, 12.0])
+    _write(tmp_path / "b.csv", "real-estate", [14.0, -3.0, 20.0])
+    stats = SectorIndex(str(tmp_path)).get("Real Estate")["pe"]
+
+    values = np.array([10.0, 12.0, 14.0, 20.0])
+    assert stats["count"] == 4
+    assert stats["mean"] == values.mean()
+    assert stats["p90"] == np.percentile(values, 90)
+
+
+def test_refresh_rereads_file_rewritten_in_place(tmp_path):
+    path = tmp_path / "pe.csv"
+    _write(path, "Banking", [10.0])
+    index = SectorIndex(str(tmp_path))
+    assert index.get("banking")["pe"]["mean"] == 10.0
+
+    # Rewriting an existing file does not change the directory mtime
+    _write(path, "Banking", [10.0, 30.0])
+    assert index.get("banking")["pe"]["mean"] == 20.0
+
+    path.unlink()
+    assert index.get("banking") is None
+
+
+def test_prefix_fallback_prefers_longest_key(tmp_path):
+    _write(tmp_path / "a.csv", "tech", [10.0])
+    _write(tmp_path / "b.csv", "technology", [30.0])
+    index = SectorIndex(str(tmp_path))
+    assert index.get("Technology Services")["pe"]["mean"] == 30.0
+    assert index.get("Tech Hardware")["pe"]["mean"] == 10.0
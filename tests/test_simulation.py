@@ -0,0 +1,257 @@
+import warnings
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from app import create_app
+from app.services.layer_2 import simulation
+from app.services.layer_2.simulation import MonteCarloEngine
+from app.services.layer_2.via import VIA
+from app.services.layer_3.registry import ModelRegistry
+
+PRICES = list(100 * np.cumprod(1 + np.random.default_rng(1).normal(0, 0.01, 60)))
+
+
+def _terminal_prices(engine, num_simulations, days, seed):
+    mu, sigma = engine.estimate_parameters(PRICES)
+    rng = np.random.default_rng(seed)
+    return engine.simulate_paths(PRICES[-1], mu, sigma, days, num_simulations, rng)[
+        :, -1
+    ]
+
+
+def _portfolio_request(*weights):
+    return {
+        "positions": [
+            {"ticker": f"T{i}", "stock_price_history": PRICES[i:], "weight": w}
+            for i, w in enumerate(weights)
+        ],
+        "days": 10,
+        "num_simulations": 2000,
+        "random_seed": 3,
+    }
+
+
+def _risk_request(**options):
+    return {
+        "financial_statements": {"total_assets": 100, "total_liabilities": 50},
+        "stock_price_history": PRICES,
+        "days": 20,
+        "num_simulations": 5000,
+        "random_seed": 7,
+        **options,
+    }
+
+
+def test_streaming_statistics_match_numpy():
+    engine = MonteCarloEngine()
+    result = engine.run_streaming(
+        PRICES, num_simulations=5000, days=20, seed=7, chunk_size=777
+    )
+    terminal = _terminal_prices(engine, 5000, 20, 7)
+
+    # Moments are exact; quantiles come from the sketch and are within a bin
+    assert result["num_simulations"] == 5000
+    assert result["expected_price"] == round(terminal.mean(), 2)
+    assert result["max_price"] == round(terminal.max(), 2)
+    assert result["min_price"] == round(terminal.min(), 2)
+    assert result["downside_probability"] == round(np.mean(terminal < PRICES[-1]), 4)
+    assert result["median_price"] == pytest.approx(np.median(terminal), rel=1e-3)
+    assert result["var_95"] == pytest.approx(np.percentile(terminal, 5), rel=1e-3)
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_parallel_statistics_match_numpy(max_workers):
+    engine = MonteCarloEngine(block_size=1000, max_workers=2)
+    try:
+        result = engine.run_parallel(
+            PRICES, num_simulations=4500, days=20, seed=11, max_workers=max_workers
+        )
+    finally:
+        engine.shutdown()
+
+    mu, sigma = engine.estimate_parameters(PRICES)
+    seeds = np.random.SeedSequence(11).spawn(5)
+    terminal = np.concatenate(
+        [
+            engine.simulate_paths(
+                PRICES[-1], mu, sigma, 20, size, np.random.default_rng(seed)
+            )[:, -1]
+            for seed, size in zip(seeds, [1000] * 4 + [500])
+        ]
+    )
+
+    assert result["num_simulations"] == 4500
+    assert result["num_blocks"] == 5
+    assert result["expected_price"] == round(terminal.mean(), 2)
+    assert result["price_volatility"] == round(terminal.std() / terminal.mean(), 4)
+    assert result["var_95"] == round(np.percentile(terminal, 5), 2)
+    tail = terminal[terminal <= np.percentile(terminal, 5)]
+    assert result["cvar_95"] == round(tail.mean(), 2)
+    assert result["median_price"] == pytest.approx(np.median(terminal), rel=1e-3)
+
+
+def test_parallel_blocks_return_bounded_tails(monkeypatch):
+    returned = []
+    simulate_block = simulation._simulate_block
+
+    def recording_block(task):
+        partial = simulate_block(task)
+        returned.append(len(partial["tail"]))
+        return partial
+
+    monkeypatch.setattr(simulation, "_simulate_block", recording_block)
+    engine = MonteCarloEngine(block_size=10000)
+    result = engine.run_parallel(
+        PRICES, num_simulations=100000, days=20, seed=3, max_workers=1
+    )
+
+    # About the block's 5% share of the tail plus a margin, not the whole block
+    assert len(returned) == 10
+    assert all(size == engine.block_tail_size(10000) for size in returned)
+    assert sum(returned) < 0.07 * 100000
+    terminal = np.concatenate(
+        [
+            engine.simulate_paths(
+                PRICES[-1],
+                *engine.estimate_parameters(PRICES),
+                20,
+                10000,
+                np.random.default_rng(seed),
+            )[:, -1]
+            for seed in np.random.SeedSequence(3).spawn(10)
+        ]
+    )
+    assert result["var_95"] == round(np.percentile(terminal, 5), 2)
+
+
+@pytest.mark.parametrize("num_workers", [0, -1])
+def test_parallel_rejects_non_positive_workers(tmp_path, num_workers):
+    via = VIA(model_registry=ModelRegistry(str(tmp_path)))
+    result = via.run_risk_mitigation(
+        _risk_request(simulation_mode="parallel", num_workers=num_workers)
+    )
+    assert result == {"error": "num_workers phải lớn hơn 0"}
+
+
+@pytest.mark.parametrize("chunk_size", [0, -5])
+def test_streaming_rejects_non_positive_chunk_size(tmp_path, chunk_size):
+    with pytest.raises(ValueError):
+        MonteCarloEngine().run_streaming(
+            PRICES, num_simulations=10, chunk_size=chunk_size
+        )
+
+    via = VIA(model_registry=ModelRegistry(str(tmp_path)))
+    result = via.run_risk_mitigation(
+        _risk_request(simulation_mode="streaming", chunk_size=chunk_size)
+    )
+    assert result == {"error": "chunk_size phải lớn hơn 0"}
+
+
+def test_plain_run_output_is_unchanged():
+    engine = MonteCarloEngine()
+    terminal = _terminal_prices(engine, 2000, 20, 5)
+    result = engine.run(PRICES, num_simulations=2000, days=20, seed=5)
+    assert result == engine.summarize(terminal, PRICES[-1])
+
+
+@pytest.mark.parametrize(
+    "method, minimum",
+    [("plain", 10), ("antithetic", 19), ("control_variate", 10), ("sobol", 10)],
+)
+def test_variance_reduction_needs_a_path_per_replicate(method, minimum):
+    engine = MonteCarloEngine()
+    with pytest.raises(ValueError, match="num_simulations"):
+        engine.run(PRICES, num_simulations=minimum - 1, variance_reduction=method)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        result = engine.run(
+            PRICES, num_simulations=minimum, days=20, seed=1, variance_reduction=method
+        )
+    assert all(np.isfinite(v) for v in result["standard_errors"].values())
+
+
+def test_plain_standard_errors_are_a_baseline_for_variance_reduction():
+    engine = MonteCarloEngine()
+    plain = engine.run(
+        PRICES, num_simulations=20000, days=20, seed=3, variance_reduction="plain"
+    )
+    terminal = _terminal_prices(engine, 20000, 20, 3)
+    # Cùng đường với "none", chỉ thêm sai số chuẩn theo nhóm
+    assert (
+        plain["expected_price"]
+        == engine.summarize(terminal, PRICES[-1])["expected_price"]
+    )
+    assert plain["num_simulations"] == 20000
+    assert plain["standard_errors"]["expected_price"] > 0
+    assert plain["ci_95_width"]["expected_price"] == pytest.approx(
+        2 * 1.96 * plain["standard_errors"]["expected_price"], abs=1e-3
+    )
+
+    for method in ("antithetic", "control_variate"):
+        reduced = engine.run(
+            PRICES, num_simulations=20000, days=20, seed=3, variance_reduction=method
+        )
+        assert (
+            reduced["standard_errors"]["expected_price"]
+            < plain["standard_errors"]["expected_price"]
+        )
+
+
+@pytest.mark.parametrize(
+    "options, message",
+    [
+        ({"batch_size": 0}, "batch_size và max_simulations phải lớn hơn 0"),
+        ({"max_simulations": -1}, "batch_size và max_simulations phải lớn hơn 0"),
+        ({"time_budget_seconds": "0"}, "time_budget_seconds phải lớn hơn 0"),
+    ],
+)
+def test_adaptive_rejects_invalid_limits(tmp_path, options, message):
+    via = VIA(model_registry=ModelRegistry(str(tmp_path)))
+    result = via.run_risk_mitigation(
+        _risk_request(simulation_mode="adaptive", **options)
+    )
+    assert result == {"error": message}
+
+
+def test_adaptive_accepts_string_time_budget(tmp_path):
+    via = VIA(model_registry=ModelRegistry(str(tmp_path)))
+    result = via.run_risk_mitigation(
+        _risk_request(
+            simulation_mode="adaptive", time_budget_seconds="5", batch_size="500"
+        )
+    )
+    assert "error" not in result["monte_carlo_simulation"]
+
+
+@pytest.mark.parametrize(
+    "weights, message",
+    [
+        ((0.7, -0.3), "không âm"),
+        ((0.5, float("nan")), "không âm"),
+        ((0.0, 0.0), "lớn hơn 0"),
+        ((0.5, "abc"), "phải là số"),
+    ],
+)
+def test_portfolio_rejects_invalid_weights(tmp_path, weights, message):
+    via = VIA(model_registry=ModelRegistry(str(tmp_path)))
+    result = via.run_portfolio_risk(_portfolio_request(*weights))
+    assert set(result) == {"error"}
+    assert message in result["error"]
+
+
+def test_portfolio_weights_are_normalised(tmp_path):
+    via = VIA(model_registry=ModelRegistry(str(tmp_path)))
+    scaled = via.run_portfolio_risk(_portfolio_request(3.0, 1.0))
+    assert scaled == via.run_portfolio_risk(_portfolio_request(0.75, 0.25))
+
+
+def test_analyze_returns_400_for_invalid_portfolio():
+    response = TestClient(create_app()).post(
+        "/analyze",
+        json={"task": "Portfolio Risk", "data": _portfolio_request(1.5, -0.5)},
+    )
+    assert response.status_code == 400
+    assert "không âm" in response.json()["error"]
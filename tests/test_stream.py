@@ -0,0 +1,28 @@
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app import create_app
+
+
+@pytest.fixture(scope="module")
+def client():
+    return TestClient(create_app())
+
+
+def test_invalid_messages_get_error_replies(client):
+    with client.websocket_connect("/ws/abnormal?window=10") as websocket:
+        websocket.send_text("not json")
+        assert "Invalid message" in websocket.receive_json()["error"]
+        websocket.send_json([5])
+        assert websocket.receive_json() == [{"error": "Tick must be a JSON object"}]
+        # The connection is still usable after an invalid message
+        websocket.send_text("{")
+        assert "error" in websocket.receive_json()
+
+
+@pytest.mark.parametrize("window", [1, 100001])
+def test_window_is_bounded(client, window):
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect(f"/ws/abnormal?window={window}") as websocket:
+            websocket.receive_json()
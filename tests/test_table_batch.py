@@ -0,0 +1,52 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+from app.services.layer_1.analysis import AnalysisService
+
+RATES = {"discount_rate": [0.1], "terminal_growth_rate": [0.02]}
+
+
+@pytest.fixture(scope="module")
+def service():
+    return AnalysisService()
+
+
+@pytest.mark.parametrize(
+    "table, message",
+    [
+        (pd.DataFrame(RATES), "Thiếu dữ liệu dòng tiền"),
+        (pd.DataFrame({"free_cash_flow": ["abc"], **RATES}), "could not convert"),
+    ],
+)
+def test_invalid_dcf_table_returns_error(service, table, message):
+    result = asyncio.run(service.handle_table_batch("DCF", "RandomForest", table))
+    assert isinstance(result, dict)
+    assert result["error"].startswith("Invalid table for DCF")
+    assert message in result["error"]
+
+
+def test_invalid_table_is_reported_per_row_in_batch_file(service, tmp_path):
+    path = tmp_path / "batch.csv"
+    pd.DataFrame(
+        {"task": ["DCF", "DCF"], **{k: v * 2 for k, v in RATES.items()}}
+    ).to_csv(path, index=False)
+    results = asyncio.run(service.handle_batch_request(str(path)))
+    assert len(results) == 2
+    assert all(r["error"].startswith("Invalid table for DCF") for r in results)
+
+
+def test_analyze_csv_returns_400_for_invalid_table():
+    from fastapi.testclient import TestClient
+
+    from app import create_app
+
+    client = TestClient(create_app())
+    response = client.post(
+        "/analyze-csv",
+        data={"task": "DCF", "model_type": "RandomForest"},
+        files={"file": ("cases.csv", b"free_cash_flow,discount_rate\nabc,0.1\n")},
+    )
+    assert response.status_code == 400
+    assert "could not convert" in response.json()["error"]
@@ -0,0 +1,204 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+from app import create_app
+from app.services.layer_2.valuation import BatchValuation
+from app.services.layer_2.via import VIA
+from app.services.layer_3.registry import ModelRegistry
+
+CASH_FLOWS = [100.0, 110.0, 121.0, 133.1, 146.41]
+
+
+@pytest.fixture(scope="module")
+def via(tmp_path_factory):
+    return VIA(model_registry=ModelRegistry(str(tmp_path_factory.mktemp("models"))))
+
+
+def _sensitivity_request(**ranges):
+    return {
+        "cash_flows": CASH_FLOWS,
+        "discount_rate": 0.1,
+        "terminal_growth_rate": 0.02,
+        "shares_outstanding": 10,
+        "net_debt": 50,
+        **ranges,
+    }
+
+
+@pytest.mark.parametrize(
+    "ranges, message",
+    [
+        ({"wacc_range": {"start": 0.05, "stop": 0.15, "step": 1e-9}}, "điểm"),
+        ({"growth_range": [0.01] * (VIA.SENSITIVITY_MAX_POINTS + 1)}, "điểm"),
+        (
+            {
+                "wacc_range": {"start": 0.05, "stop": 0.1098, "step": 0.0002},
+                "growth_range": {"start": 0.0, "stop": 0.0598, "step": 0.0002},
+            },
+            "ô",
+        ),
+        ({"wacc_range": {"start": 0.05, "stop": float("inf"), "step": 0.01}}, ""),
+    ],
+)
+def test_sensitivity_grid_size_is_bounded(via, ranges, message):
+    result = via.run_dcf_sensitivity(_sensitivity_request(**ranges))
+    assert set(result) == {"error"}
+    assert message in result["error"]
+
+
+def test_capital_structure_scenario_grid_is_bounded(via):
+    result = via.run_wacc(
+        {
+            "equity_value": 600,
+            "debt_value": 400,
+            "debt_to_equity_range": {"start": 0.0, "stop": 3.0, "step": 0.01},
+            "beta_range": {"start": 0.5, "stop": 1.5, "step": 0.005},
+        }
+    )
+    assert "vượt quá giới hạn" in result["error"]
+
+
+def test_sensitivity_route_rejects_oversized_axis():
+    response = TestClient(create_app()).post(
+        "/dcf-sensitivity",
+        json={
+            "data": {"free_cash_flow": CASH_FLOWS, "discount_rate": 0.1},
+            "wacc_range": {"start": 0.05, "stop": 0.15, "step": 1e-9},
+        },
+    )
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def _gordon_value(cash_flows, wacc, growth):
+    """Scalar reference: run_dcf plus the discounted Gordon terminal value."""
+    terminal = cash_flows[-1] * (1 + growth) / (wacc - growth)
+    return terminal / (1 + wacc) ** len(cash_flows)
+
+
+DCF_ROWS = [
+    {"cash_flows": CASH_FLOWS, "discount_rate": 0.1, "terminal_growth_rate": 0.02},
+    {"cash_flows": [50.0, -20.0, 80.0], "discount_rate": 0.08},
+    {"cash_flows": [10.0, 12.0], "discount_rate": 0.03, "terminal_growth_rate": 0.03},
+    {"cash_flows": [200.0], "discount_rate": 0.15, "terminal_growth_rate": 0.0},
+]
+
+
+def test_dcf_batch_matches_scalar_run_dcf(via):
+    batch = via.run_dcf_batch(
+        pd.DataFrame(
+            [{**row, "shares_outstanding": 10, "net_debt": 5} for row in DCF_ROWS]
+        )
+    )
+    for row, result in zip(DCF_ROWS, batch):
+        present_value = via.run_dcf(row)
+        assert result["dcf_value"] == pytest.approx(present_value, abs=0.01)
+
+        growth = row.get("terminal_growth_rate")
+        if growth is None:
+            expected = present_value
+        elif row["discount_rate"] > growth:
+            expected = present_value + _gordon_value(
+                row["cash_flows"], row["discount_rate"], growth
+            )
+        else:
+            # wacc <= g: không có terminal value hữu hạn
+            assert result["enterprise_value"] is None
+            continue
+        assert result["enterprise_value"] == pytest.approx(expected, abs=0.02)
+        assert result["equity_value_per_share"] == pytest.approx(
+            (expected - 5) / 10, abs=0.01
+        )
+
+
+def test_sensitivity_grid_matches_scalar_dcf(via):
+    wacc_values = [0.01, 0.02, 0.03, 0.08, 0.1]
+    growth_values = [0.0, 0.02, 0.03]
+    result = via.run_dcf_sensitivity(
+        _sensitivity_request(wacc_range=wacc_values, growth_range=growth_values)
+    )
+
+    for i, wacc in enumerate(wacc_values):
+        present_value = via.run_dcf({"cash_flows": CASH_FLOWS, "discount_rate": wacc})
+        for j, growth in enumerate(growth_values):
+            value = result["enterprise_value"][i][j]
+            per_share = result["equity_value_per_share"][i][j]
+            batch = via.run_dcf_batch(
+                pd.DataFrame(
+                    [
+                        {
+                            "cash_flows": CASH_FLOWS,
+                            "discount_rate": wacc,
+                            "terminal_growth_rate": growth,
+                            "shares_outstanding": 10,
+                            "net_debt": 50,
+                        }
+                    ]
+                )
+            )[0]
+            if wacc <= growth:
+                assert value is None and per_share is None
+                assert batch["enterprise_value"] is None
+                continue
+            expected = present_value + _gordon_value(CASH_FLOWS, wacc, growth)
+            assert value == pytest.approx(expected, rel=1e-6, abs=0.02)
+            assert per_share == pytest.approx((expected - 50) / 10, rel=1e-6, abs=0.01)
+            assert value == pytest.approx(batch["enterprise_value"], abs=0.01)
+
+
+WACC_ROWS = [
+    {"equity_value": 600, "debt_value": 400},
+    {
+        "equity_value": 1000,
+        "debt_value": 0,
+        "beta": 1.3,
+        "risk_free_rate": 0.04,
+        "market_return": 0.09,
+    },
+    {"equity_value": 200, "debt_value": 800, "cost_of_debt": 0.08, "tax_rate": 0.3},
+    {"equity_value": 0, "debt_value": 0},
+]
+
+
+def test_wacc_batch_matches_scalar_calculate_wacc(via):
+    batch = via.run_wacc_batch(pd.DataFrame(WACC_ROWS))
+    for row, result in zip(WACC_ROWS, batch):
+        assert result["wacc"] == pytest.approx(via.calculate_wacc(row), abs=1e-4)
+        assert via.run_wacc(row)["wacc"] == result["wacc"]
+
+
+def test_capital_structure_scenario_matches_scalar_wacc(via):
+    data = {
+        "equity_value": 600,
+        "debt_value": 400,
+        "beta": 1.2,
+        "tax_rate": 0.25,
+        "debt_to_equity_range": [0.0, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0],
+    }
+    scenario = via.run_wacc(data)["scenario"]
+    beta_u = 1.2 / (1 + 0.75 * 400 / 600)
+    curve = BatchValuation.DEBT_SPREAD_CURVE
+
+    expected = [
+        via.calculate_wacc(
+            {
+                "equity_value": 1.0,
+                "debt_value": de,
+                "beta": beta_u * (1 + 0.75 * de),
+                "cost_of_debt": 0.03
+                + np.interp(de, curve["debt_to_equity"], curve["spread"]),
+                "tax_rate": 0.25,
+            }
+        )
+        for de in data["debt_to_equity_range"]
+    ]
+    assert scenario["unlevered_beta"] == pytest.approx(beta_u, abs=1e-4)
+    assert scenario["wacc_curve"] == pytest.approx(expected, abs=1e-4)
+    optimal = scenario["optimal_structure"]
+    assert optimal["wacc"] == pytest.approx(min(expected), abs=1e-4)
+    assert (
+        optimal["debt_to_equity"]
+        == data["debt_to_equity_range"][int(np.argmin(expected))]
+    )